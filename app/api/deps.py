@@ -1,8 +1,13 @@
+from functools import lru_cache
+import re
 from fastapi import Depends, HTTPException, Header
 from sqlalchemy.orm import Session
-from app.db.base import SessionLocal
+from app.db.base import SessionLocal, AsyncSessionLocal
+from app.db.tenants import DEFAULT_TENANT
 from app.core.config import settings
 
+_TENANT_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
 
 def get_db():
     db = SessionLocal()
@@ -12,9 +17,42 @@ def get_db():
         db.close()
 
 
-def require_api_key(x_api_key: str = Header(None)):
-    if not settings.API_KEY:
-        # auth disabled in dev if no API_KEY
-        return
-    if x_api_key != settings.API_KEY:
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+@lru_cache(maxsize=1)
+def tenant_keys() -> dict[str, str]:
+    # API key -> tenant
+    keys = {}
+    for pair in settings.TENANT_API_KEYS.split(","):
+        if not pair.strip():
+            continue
+        key, _, tenant = pair.strip().rpartition(":")
+        if not key or not _TENANT_RE.match(tenant):
+            raise ValueError(f"TENANT_API_KEYS entries are key:tenant with tenant matching {_TENANT_RE.pattern}")
+        keys[key] = tenant
+    if settings.API_KEY:
+        keys[settings.API_KEY] = DEFAULT_TENANT
+    return keys
+
+
+def require_api_key(x_api_key: str = Header(None)) -> str:
+    # the caller's tenant; routes take it with Depends(require_api_key) (resolved once per request)
+    keys = tenant_keys()
+    if not keys:
+        # auth disabled in dev if no key is configured
+        return DEFAULT_TENANT
+    tenant = keys.get(x_api_key or "")
+    if tenant is None:
         raise HTTPException(status_code=401, detail="invalid API key")
+    return tenant
+
+
+def require_admin(x_api_key: str = Header(None)):
+    # index, shard and pool controls span every tenant: operator key only
+    if not tenant_keys():
+        return
+    if not settings.API_KEY or x_api_key != settings.API_KEY:
+        raise HTTPException(status_code=403, detail="admin API key required")
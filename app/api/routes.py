@@ -1,36 +1,75 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from typing import Optional
-from app.api.deps import get_db, require_api_key
+from uuid import uuid4
+import json
+import os
+from app.api.deps import get_db, get_async_db, require_admin, require_api_key
+from app.core.http import http_pool_stats
+from app.db.base import AsyncSessionLocal, db_pool_stats, engine
+from app.db.indexes import count_rows, index_info, rebuild_ann_index
+from app.db.tenants import is_partitioned, list_tenants, move_tenant, shard_stats
+from app.core.config import settings
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.documents import DocumentCreateResponse, DocumentStatusResponse
-from app.schemas.chat import ChatRequest, ChatResponse, SearchDebugResponse
+from app.schemas.chat import BatchChatRequest, ChatRequest, ChatResponse, SearchDebugResponse, AnswerCacheStatsResponse
+from app.schemas.embeddings import EmbeddingCacheStatsResponse
+from app.schemas.admin import (
+    IndexInfoResponse, IndexRebuildRequest, IndexRebuildResponse, PoolStatsResponse, ShardsResponse, SlowQueryConfig,
+    SlowQueryStateResponse, TenantMoveRequest, TenantMoveResponse,
+)
+from app.schemas.ingest import IngestJobRequest, IngestJobResponse, IngestJobStatusResponse
 from app.db.repositories import (
-    create_document_stub, get_document, set_document_status,
+    create_document_stub, get_document, get_ingest_job, set_document_status,
 )
-from app.ingestion.parsers import extract_text_from_upload
+from app.ingestion.bulk import collect_paths, create_job, enqueue_bulk_job, job_dir, job_progress, run_job_sync, unpack_upload
+from app.ingestion.parsers import aparse_file, detect_kind, spool_to_disk
 from app.ingestion.tasks import enqueue_ingest_document, ingest_document_sync
-from app.rag.pipeline import answer_query
-from app.rag.retriever import debug_search_chunks
+from app.rag.answer_cache import get_answer_cache
+from app.rag.embedding_cache import get_embedding_cache
+from app.rag.pipeline import aanswer_query, abatch_answer, astream_answer
+from app.rag.retriever import adebug_search_chunks
+from app.rag.telemetry import get_slow_query_sampler
 
+# every route runs as the tenant of its API key; Depends(require_api_key) in a route hands it over
 api_router = APIRouter(dependencies=[Depends(require_api_key)])
+_admin = [Depends(require_admin)]
 
 
 @api_router.post("/documents/upload", response_model=DocumentCreateResponse)
-async def upload_document(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    raw_bytes = await file.read()
-    text, meta = extract_text_from_upload(raw_bytes, file.filename, file.content_type)
-    doc = create_document_stub(db, filename=file.filename, mime_type=file.content_type, extracted_text=text, metadata=meta)
+async def upload_document(
+    file: UploadFile = File(...), db: Session = Depends(get_db), tenant: str = Depends(require_api_key)
+):
+    # spool to disk and parse in the process pool; nothing heavy runs on the event loop
+    path = await run_in_threadpool(spool_to_disk, file.file)
+    try:
+        parsed = await aparse_file(path, file.filename, file.content_type)
+    finally:
+        os.unlink(path)
+    meta = {
+        "filename": file.filename,
+        "mime_type": file.content_type,
+        "parser": detect_kind(file.filename, file.content_type),
+        "pages": len(parsed.page_offsets) or None,
+        "page_offsets": parsed.page_offsets or None,
+    }
+    doc = await run_in_threadpool(
+        create_document_stub, db, filename=file.filename, mime_type=file.content_type, extracted_text=parsed.text, metadata=meta,
+        tenant=tenant,
+    )
     # enqueue async ingest (Celery); fallback: sync (dev)
     try:
         enqueue_ingest_document(str(doc.id))
     except Exception:
-        ingest_document_sync(str(doc.id))
+        await run_in_threadpool(ingest_document_sync, str(doc.id))
     return DocumentCreateResponse(document_id=doc.id)
 
 
 @api_router.post("/documents/{document_id}/ingest", response_model=DocumentStatusResponse)
-def trigger_ingest(document_id: str, db: Session = Depends(get_db)):
-    doc = get_document(db, document_id)
+def trigger_ingest(document_id: str, db: Session = Depends(get_db), tenant: str = Depends(require_api_key)):
+    doc = get_document(db, document_id, tenant)
     if not doc:
         raise HTTPException(status_code=404, detail="document not found")
     set_document_status(db, document_id, "processing")
@@ -42,18 +81,191 @@ def trigger_ingest(document_id: str, db: Session = Depends(get_db)):
 
 
 @api_router.get("/documents/{document_id}/status", response_model=DocumentStatusResponse)
-def document_status(document_id: str, db: Session = Depends(get_db)):
-    doc = get_document(db, document_id)
+def document_status(document_id: str, db: Session = Depends(get_db), tenant: str = Depends(require_api_key)):
+    doc = get_document(db, document_id, tenant)
     if not doc:
         raise HTTPException(status_code=404, detail="document not found")
-    return DocumentStatusResponse(document_id=document_id, status=doc.status)
+    return DocumentStatusResponse(document_id=document_id, status=doc.status, ingested_chunks=doc.ingested_chunks)
+
+
+def _start_bulk_job(job_id: str, background: BackgroundTasks) -> None:
+    try:
+        enqueue_bulk_job(job_id)
+    except Exception:
+        background.add_task(run_job_sync, job_id)
+
+
+# server paths are shared by every tenant: operator key only, ingested as its (default) tenant
+@api_router.post("/ingest/jobs", response_model=IngestJobResponse, status_code=202, dependencies=_admin)
+def create_ingest_job_from_paths(
+    payload: IngestJobRequest, background: BackgroundTasks, tenant: str = Depends(require_api_key)
+):
+    try:
+        files = collect_paths(payload.paths)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not files:
+        raise HTTPException(status_code=400, detail="no files found")
+    job_id = create_job(", ".join(payload.paths)[:512], files, tenant=tenant)
+    _start_bulk_job(job_id, background)
+    return IngestJobResponse(job_id=job_id, status="pending", total_documents=len(files))
+
+
+@api_router.post("/ingest/jobs/archive", response_model=IngestJobResponse, status_code=202)
+async def create_ingest_job_from_archive(
+    background: BackgroundTasks, file: UploadFile = File(...), tenant: str = Depends(require_api_key)
+):
+    # zip or tar (optionally compressed); unpacked under BULK_INGEST_DIR, one document per regular file
+    job_id = uuid4()
+    try:
+        files = await run_in_threadpool(unpack_upload, file.file, job_id)
+    except (ValueError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"cannot unpack archive: {e}")
+    if not files:
+        raise HTTPException(status_code=400, detail="archive contains no files")
+    await run_in_threadpool(create_job, f"archive:{file.filename}"[:512], files, job_id, job_dir(str(job_id)), tenant)
+    _start_bulk_job(str(job_id), background)
+    return IngestJobResponse(job_id=str(job_id), status="pending", total_documents=len(files))
+
+
+@api_router.get("/ingest/jobs/{job_id}", response_model=IngestJobStatusResponse)
+def ingest_job_status(job_id: str, db: Session = Depends(get_db), tenant: str = Depends(require_api_key)):
+    job = get_ingest_job(db, job_id, tenant)
+    if not job:
+        raise HTTPException(status_code=404, detail="ingest job not found")
+    return IngestJobStatusResponse(**job_progress(db, job))
 
 
 @api_router.post("/chat/query", response_model=ChatResponse)
-def chat_query(payload: ChatRequest, db: Session = Depends(get_db)):
-    return answer_query(db, payload)
+async def chat_query(
+    payload: ChatRequest, db: AsyncSession = Depends(get_async_db), tenant: str = Depends(require_api_key)
+):
+    return await aanswer_query(db, payload, tenant)
+
+
+@api_router.post("/chat/query/stream")
+async def chat_query_stream(payload: ChatRequest, request: Request, tenant: str = Depends(require_api_key)):
+    # Server-sent events: `citations`, then `token`s as the model produces them, then `done`.
+    async def events():
+        # own session: the response outlives the request's dependencies
+        async with AsyncSessionLocal() as db:
+            stream = astream_answer(db, payload, tenant)
+            try:
+                async for event, data in stream:
+                    if await request.is_disconnected():
+                        break
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+            finally:
+                # stops the upstream generation if the client went away
+                await stream.aclose()
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@api_router.post("/chat/batch")
+async def chat_batch(payload: BatchChatRequest, request: Request, tenant: str = Depends(require_api_key)):
+    # NDJSON, one BatchChatResult per line in completion order (match them up by `index`)
+    if len(payload.queries) > settings.BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"at most {settings.BATCH_MAX_QUERIES} queries per batch")
+
+    async def lines():
+        async with AsyncSessionLocal() as db:
+            results = abatch_answer(db, payload, tenant)
+            try:
+                async for result in results:
+                    if await request.is_disconnected():
+                        break
+                    yield result.model_dump_json() + "\n"
+            except Exception as e:
+                yield json.dumps({"error": str(e)}) + "\n"
+            finally:
+                await results.aclose()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
 
 
 @api_router.get("/chunks/search", response_model=SearchDebugResponse)
-def chunks_search_debug(q: str, top_k: Optional[int] = 5, db: Session = Depends(get_db)):
-    return debug_search_chunks(db, query=q, top_k=top_k or 5)
+async def chunks_search_debug(
+    q: str,
+    top_k: Optional[int] = 5,
+    probes: Optional[int] = Query(None, ge=1),
+    ef_search: Optional[int] = Query(None, ge=1, le=1000),
+    mode: Optional[str] = Query(None, pattern="^(vector|lexical|hybrid)$"),
+    db: AsyncSession = Depends(get_async_db),
+    tenant: str = Depends(require_api_key),
+):
+    return await adebug_search_chunks(
+        db, query=q, top_k=top_k or 5, probes=probes, ef_search=ef_search, mode=mode, tenant=tenant
+    )
+
+
+# process-wide counters, so they tell about every tenant's traffic: operator key only
+@api_router.get("/embeddings/cache/stats", response_model=EmbeddingCacheStatsResponse, dependencies=_admin)
+def embedding_cache_stats():
+    return EmbeddingCacheStatsResponse(**get_embedding_cache().stats.snapshot())
+
+
+@api_router.get("/chat/cache/stats", response_model=AnswerCacheStatsResponse, dependencies=_admin)
+def answer_cache_stats():
+    cache = get_answer_cache()
+    if cache is None:
+        raise HTTPException(status_code=404, detail="answer cache disabled")
+    return AnswerCacheStatsResponse(**cache.stats())
+
+
+@api_router.get("/admin/index", response_model=IndexInfoResponse, dependencies=_admin)
+def ann_index_info(db: Session = Depends(get_db)):
+    conn = db.connection()
+    return IndexInfoResponse(rows=count_rows(conn), index=index_info(conn))
+
+
+@api_router.post("/admin/index/rebuild", response_model=IndexRebuildResponse, status_code=202, dependencies=_admin)
+def ann_index_rebuild(payload: IndexRebuildRequest, background: BackgroundTasks):
+    # CREATE INDEX CONCURRENTLY can take minutes on a large corpus; run it after responding
+    kind = payload.kind or settings.ANN_INDEX
+    storage = payload.storage or settings.VECTOR_STORAGE
+    background.add_task(rebuild_ann_index, engine, kind, storage)
+    return IndexRebuildResponse(status="rebuilding", kind=kind, storage=storage)
+
+
+@api_router.get("/admin/shards", response_model=ShardsResponse, dependencies=_admin)
+def shards(db: Session = Depends(get_db)):
+    conn = db.connection()
+    partitioned = is_partitioned(conn)
+    return ShardsResponse(
+        partitioned=partitioned, shards=shard_stats(conn) if partitioned else [], tenants=list_tenants(conn)
+    )
+
+
+@api_router.post(
+    "/admin/tenants/{tenant_id}/move", response_model=TenantMoveResponse, status_code=202, dependencies=_admin
+)
+def tenant_move(tenant_id: str, payload: TenantMoveRequest, background: BackgroundTasks):
+    # re-keys the tenant's embeddings batch by batch after responding; it stays searchable meanwhile
+    background.add_task(move_tenant, engine, tenant_id, payload.shard)
+    return TenantMoveResponse(status="moving", tenant_id=tenant_id, shard=payload.shard)
+
+
+@api_router.get("/admin/slow-queries", response_model=SlowQueryStateResponse, dependencies=_admin)
+def slow_queries(tenant: Optional[str] = None):
+    # samples from every tenant unless ?tenant= narrows them down
+    return SlowQueryStateResponse(**get_slow_query_sampler().state(tenant))
+
+
+@api_router.put("/admin/slow-queries", response_model=SlowQueryStateResponse, dependencies=_admin)
+def configure_slow_queries(payload: SlowQueryConfig):
+    # this process only; restart-proof values belong in SLOW_QUERY_* settings
+    sampler = get_slow_query_sampler()
+    sampler.configure(**payload.model_dump())
+    return SlowQueryStateResponse(**sampler.state())
+
+
+@api_router.get("/admin/pools", response_model=PoolStatsResponse, dependencies=_admin)
+def pool_stats():
+    from app.ingestion.celery_app import broker_pool_stats
+
+    return PoolStatsResponse(db=db_pool_stats(), http=http_pool_stats(), broker=broker_pool_stats())
@@ -0,0 +1,63 @@
+"""Chunker benchmark: python -m app.bench.chunker --mb 1 4 16"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from app.bench.common import make_document
+from app.rag.chunker import iter_chunks
+from app.rag.tokenizer import CharTokenizer, get_tokenizer
+
+
+def legacy_chunk_text(text: str, chunk_size: int = 1000, overlap: int = 150) -> list[str]:
+    # the original character chunker, kept as the baseline
+    tokens = list(text)
+    chunks: list[str] = []
+    start = 0
+    n = len(tokens)
+    while start < n:
+        end = min(start + chunk_size, n)
+        chunks.append("".join(tokens[start:end]))
+        if end == n:
+            break
+        start = end - overlap
+        if start < 0:
+            start = 0
+    return chunks
+
+
+def _measure(fn) -> dict:
+    t0 = time.perf_counter()
+    chunks = fn()
+    elapsed = time.perf_counter() - t0
+    # second run for memory only: tracemalloc distorts timings
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(elapsed, 4), "chunks": len(chunks), "peak_mb": round(peak / 2**20, 2)}
+
+
+def run(mb: float) -> dict:
+    text = make_document(int(mb * 2**20))
+    pieces = lambda: (text[i:i + 200_000] for i in range(0, len(text), 200_000))  # noqa: E731
+    results = {"legacy_chars": _measure(lambda: legacy_chunk_text(text))}
+    tok = get_tokenizer()
+    if tok.name != "chars":
+        results[f"tokens_{tok.name}"] = _measure(lambda: list(iter_chunks(pieces(), tokenizer=tok)))
+    results["tokens_char_estimate"] = _measure(lambda: list(iter_chunks(pieces(), tokenizer=CharTokenizer())))
+    for r in results.values():
+        r["mb_per_s"] = round(mb / r["seconds"], 2) if r["seconds"] else None
+    return {"mb": mb, **results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mb", type=float, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+    for mb in args.mb:
+        print(json.dumps(run(mb)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import random
+import statistics
+
+_SYLLABLES = ["al", "be", "cor", "da", "en", "fi", "gor", "ha", "in", "jo", "ka", "lu", "mo", "ne", "or", "pa", "qui", "ra", "so", "tu"]
+
+
+def make_vocabulary(size: int, seed: int = 7) -> list[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(1, 4))) for _ in range(size)]
+
+
+def make_document(n_chars: int, seed: int = 7, vocab: list[str] | None = None) -> str:
+    # Paragraphs of sentences of words: deterministic for a given seed.
+    rng = random.Random(seed)
+    vocab = vocab or make_vocabulary(5000, seed)
+    paras: list[str] = []
+    total = 0
+    while total < n_chars:
+        sentences = []
+        for _ in range(rng.randint(1, 10)):
+            words = rng.choices(vocab, k=rng.randint(5, 30))
+            sentences.append(" ".join(words).capitalize() + rng.choice([".", ".", ".", "?", "!"]))
+        para = " ".join(sentences)
+        paras.append(para)
+        total += len(para) + 2
+    return "\n\n".join(paras)[:n_chars]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize_ms(samples_s: list[float]) -> dict:
+    ms = [s * 1000 for s in samples_s]
+    return {
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "mean_ms": round(statistics.fmean(ms), 3) if ms else 0.0,
+    }
@@ -0,0 +1,84 @@
+"""Sync (threadpool) vs async /chat/query path under concurrent load, and /chat/batch at several batch sizes.
+
+Offline: EMBEDDING_PROVIDER=hashing CHAT_PROVIDER=echo ECHO_LATENCY_MS=300 python -m app.bench.load
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.bench.common import make_vocabulary, summarize_ms
+from app.db.base import AsyncSessionLocal, SessionLocal, async_engine
+from app.rag.pipeline import aanswer_query, abatch_answer, answer_query
+from app.schemas.chat import BatchChatRequest, ChatRequest
+
+
+def make_queries(n: int, seed: int = 11) -> list[ChatRequest]:
+    rng = random.Random(seed)
+    vocab = make_vocabulary(2000)
+    return [ChatRequest(query=" ".join(rng.choices(vocab, k=6)), top_k=6) for _ in range(n)]
+
+
+def run_sync(queries: list[ChatRequest], threads: int) -> dict:
+    def one(payload: ChatRequest) -> float:
+        t0 = time.perf_counter()
+        with SessionLocal() as db:
+            answer_query(db, payload)
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(one, queries))
+    elapsed = time.perf_counter() - t0
+    return {"path": f"sync/threads={threads}", "requests": len(queries), "seconds": round(elapsed, 3), "rps": round(len(queries) / elapsed, 2), **summarize_ms(latencies)}
+
+
+async def run_async(queries: list[ChatRequest], concurrency: int) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(payload: ChatRequest) -> float:
+        async with sem:
+            t0 = time.perf_counter()
+            async with AsyncSessionLocal() as db:
+                await aanswer_query(db, payload)
+            return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    latencies = await asyncio.gather(*(one(q) for q in queries))
+    elapsed = time.perf_counter() - t0
+    await async_engine.dispose()
+    return {"path": f"async/concurrency={concurrency}", "requests": len(queries), "seconds": round(elapsed, 3), "rps": round(len(queries) / elapsed, 2), **summarize_ms(list(latencies))}
+
+
+async def run_batch(queries: list[ChatRequest], batch_size: int) -> dict:
+    # batches go one after another, as a single API worker would serve them
+    t0 = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        payload = BatchChatRequest(queries=[q.query for q in queries[i:i + batch_size]], top_k=queries[0].top_k)
+        async with AsyncSessionLocal() as db:
+            async for _ in abatch_answer(db, payload):
+                pass
+    elapsed = time.perf_counter() - t0
+    await async_engine.dispose()
+    return {"path": f"batch/size={batch_size}", "requests": len(queries), "seconds": round(elapsed, 3), "rps": round(len(queries) / elapsed, 2)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    # Starlette runs sync handlers on a 40-thread pool by default
+    parser.add_argument("--threads", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--batch-sizes", type=int, nargs="*", default=[1, 10, 50, 200])
+    args = parser.parse_args()
+    queries = make_queries(args.requests)
+    print(json.dumps(run_sync(queries, args.threads)))
+    print(json.dumps(asyncio.run(run_async(queries, args.concurrency))))
+    for size in args.batch_sizes:
+        print(json.dumps(asyncio.run(run_batch(queries, size))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Prompt packing benchmark: context tokens of the plain join vs the packed prompt.
+
+Simulates retrieval that returns runs of neighbouring chunks (overlapping text) plus
+near-duplicate boilerplate, the case packing is for. Offline, no database.
+
+    python -m app.bench.prompt --top-k 6 12 24 --budget 3000
+"""
+import argparse
+import json
+import random
+import time
+
+from app.bench.common import make_document, make_vocabulary, summarize_ms
+
+
+def make_rows(chunks: list[list[str]], top_k: int, rng: random.Random) -> list[tuple]:
+    # a few documents, a run of adjacent chunks from each, and a copied chunk under another document id
+    rows = []
+    while len(rows) < top_k:
+        d = rng.randrange(len(chunks))
+        start = rng.randrange(max(1, len(chunks[d]) - 4))
+        for idx in range(start, min(start + rng.randint(1, 4), len(chunks[d]))):
+            rows.append((f"doc-{d}", f"{d}-{idx}", idx, 0.0, chunks[d][idx]))
+        if rng.random() < 0.3:
+            _, _, idx, _, content = rng.choice(rows)
+            rows.append((f"copy-{len(rows)}", f"copy-{len(rows)}", idx, 0.0, content))
+    rows = rows[:top_k]
+    rng.shuffle(rows)
+    return [(d, c, i, 1.0 - n / top_k, content) for n, (d, c, i, _, content) in enumerate(rows)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-k", type=int, nargs="*", default=[6, 12, 24])
+    parser.add_argument("--budget", type=int, help="PROMPT_CONTEXT_TOKENS (default: settings)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    from app.rag.chunker import chunk_text
+    from app.rag.prompt import build_prompt, pack_contexts
+    from app.rag.tokenizer import get_tokenizer
+
+    tok = get_tokenizer()
+    vocab = make_vocabulary(8000, seed=args.seed)
+    chunks = [chunk_text(make_document(30_000, seed=args.seed + d, vocab=vocab)) for d in range(20)]
+    rng = random.Random(args.seed)
+    for top_k in args.top_k:
+        plain, packed, latencies = [], [], []
+        for _ in range(args.queries):
+            rows = make_rows(chunks, top_k, rng)
+            plain.append(tok.count(build_prompt("q", [r[4] for r in rows])))
+            t0 = time.perf_counter()
+            contexts, _ = pack_contexts(rows, args.budget)
+            latencies.append(time.perf_counter() - t0)
+            packed.append(tok.count(build_prompt("q", contexts)))
+        print(json.dumps({
+            "top_k": top_k,
+            "tokenizer": tok.name,
+            "plain_tokens_mean": round(sum(plain) / len(plain), 1),
+            "packed_tokens_mean": round(sum(packed) / len(packed), 1),
+            "packed_tokens_max": max(packed),
+            "reduction": round(1 - sum(packed) / sum(plain), 3),
+            **{f"pack_{k}": v for k, v in summarize_ms(latencies).items()},
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Rerank benchmark: scorer latency per candidate pool size, and how often the chunk a query was
+lifted from reaches the prompt's top_k with and without reranking.
+
+Simulates a retriever that ranks the source chunk anywhere in its candidate pool (uniformly), the
+case over-fetching is for. Offline, no database; --scorer cross-encoder needs sentence-transformers.
+
+    python -m app.bench.rerank --pools 10 30 100 --top-k 6
+"""
+import argparse
+import json
+import random
+import time
+
+from app.bench.common import make_document, make_vocabulary, summarize_ms
+from app.core.config import settings
+
+
+def make_pool(chunks: list[str], size: int, rng: random.Random) -> tuple[str, list[tuple], int]:
+    # (query, rows in retrieval order, position of the source chunk)
+    picked = rng.sample(range(len(chunks)), size)
+    source = rng.randrange(size)
+    words = chunks[picked[source]].split()
+    start = rng.randrange(max(1, len(words) - 10))
+    query = " ".join(words[start:start + rng.randint(4, 10)])
+    rows = [(f"doc-{j}", f"chunk-{j}", 0, 1.0 - n / size, chunks[j], None) for n, j in enumerate(picked)]
+    return query, rows, source
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pools", type=int, nargs="*", default=[10, 30, 100])
+    parser.add_argument("--top-k", type=int, default=6)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--scorer", choices=["bm25", "cross-encoder"], help="default RERANK_SCORER")
+    parser.add_argument("--weight", type=float, help="override RERANK_WEIGHT")
+    parser.add_argument("--seed", type=int, default=23)
+    args = parser.parse_args()
+
+    if args.scorer:
+        settings.RERANK_SCORER = args.scorer
+    if args.weight is not None:
+        settings.RERANK_WEIGHT = args.weight
+
+    from app.rag.chunker import chunk_text
+    from app.rag.rerank import get_scorer, rerank
+
+    vocab = make_vocabulary(8000, seed=args.seed)
+    chunks = [c for i in range(40) for c in chunk_text(make_document(20000, seed=args.seed + i, vocab=vocab))]
+    t0 = time.perf_counter()
+    scorer = get_scorer()
+    print(json.dumps({"stage": "load", "scorer": scorer.name, "chunks": len(chunks), "seconds": round(time.perf_counter() - t0, 3)}))
+    rng = random.Random(args.seed)
+    for size in args.pools:
+        latencies, before, after = [], 0, 0
+        for _ in range(args.queries):
+            query, rows, source = make_pool(chunks, min(size, len(chunks)), rng)
+            t0 = time.perf_counter()
+            kept = rerank(query, rows, args.top_k)
+            latencies.append(time.perf_counter() - t0)
+            before += source < args.top_k
+            after += rows[source] in kept
+        print(json.dumps({
+            "stage": "rerank",
+            "scorer": scorer.name,
+            "pool": size,
+            "top_k": args.top_k,
+            f"hit@{args.top_k}_retrieval": round(before / args.queries, 4),
+            f"hit@{args.top_k}_reranked": round(after / args.queries, 4),
+            **summarize_ms(latencies),
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Startup benchmark: import time of the API and worker entry points, with a per-package
+breakdown from `python -X importtime`, and time until a fresh uvicorn answers /v1/health.
+
+Every run is a fresh interpreter, as for a new pod. Needs no database: the serve path no longer
+runs DDL (see app.db.migrate) and /v1/health doesn't touch Postgres.
+
+    python -m app.bench.startup --runs 5
+    python -m app.bench.startup --modules app.main --top 15 --serve
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def import_profile(module: str) -> tuple[float, list[tuple[str, int, int, int]]]:
+    # (wall seconds, [(module, self_us, cumulative_us, depth)]) for one cold import
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True,
+        env={**os.environ, "PYTHONWARNINGS": "ignore"},
+    )
+    wall = time.perf_counter() - t0
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), (len(m.group(3)) - 1) // 2))
+    return wall, rows
+
+
+def by_package(rows: list[tuple[str, int, int, int]]) -> dict[str, float]:
+    # self time summed per top-level package, in ms
+    totals: dict[str, float] = {}
+    for name, self_us, _, _ in rows:
+        top = name.split(".")[0]
+        totals[top] = totals.get(top, 0.0) + self_us / 1000
+    return totals
+
+
+def bench_imports(module: str, runs: int, top: int) -> dict:
+    walls, totals, packages = [], [], {}
+    for _ in range(runs):
+        wall, rows = import_profile(module)
+        walls.append(wall)
+        totals.append(next((cum for name, _, cum, _ in rows if name == module), 0) / 1000)
+        for pkg, ms in by_package(rows).items():
+            packages.setdefault(pkg, []).append(ms)
+    ranked = sorted(((pkg, statistics.median(v)) for pkg, v in packages.items()), key=lambda x: -x[1])
+    return {
+        "module": module,
+        "runs": runs,
+        "interpreter_wall_ms": round(statistics.median(walls) * 1000, 1),
+        "import_ms": round(statistics.median(totals), 1),
+        "top_packages_ms": {pkg: round(ms, 1) for pkg, ms in ranked[:top]},
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_serve(timeout_s: float) -> dict:
+    # process start -> first 200 from /v1/health
+    port = _free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+    )
+    try:
+        while time.perf_counter() - t0 < timeout_s:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {proc.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/v1/health", timeout=1) as resp:
+                    if resp.status == 200:
+                        return {"ready_ms": round((time.perf_counter() - t0) * 1000, 1)}
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError(f"/v1/health not ready after {timeout_s}s")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="*", default=["app.main", "app.ingestion.worker"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="packages to list by self import time")
+    parser.add_argument("--serve", action="store_true", help="also time a uvicorn boot until /v1/health answers")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        print(json.dumps({"stage": "import", **bench_imports(module, args.runs, args.top)}))
+    if args.serve:
+        ready = [bench_serve(args.timeout)["ready_ms"] for _ in range(args.runs)]
+        print(json.dumps({"stage": "serve", "runs": args.runs, "ready_ms": round(statistics.median(ready), 1)}))
+
+
+if __name__ == "__main__":
+    main()
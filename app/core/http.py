@@ -0,0 +1,60 @@
+"""Process-wide keep-alive HTTP clients for the model providers, so requests reuse pooled
+connections instead of paying for a TCP + TLS handshake each time."""
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    import httpx
+
+
+def _limits() -> "httpx.Limits":
+    import httpx
+
+    return httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_S,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_http_client() -> "httpx.Client":
+    import httpx
+
+    return httpx.Client(limits=_limits(), timeout=settings.HTTP_TIMEOUT_S)
+
+
+@lru_cache(maxsize=1)
+def get_async_http_client() -> "httpx.AsyncClient":
+    # bound to the event loop that first uses it: the API's
+    import httpx
+
+    return httpx.AsyncClient(limits=_limits(), timeout=settings.HTTP_TIMEOUT_S)
+
+
+def _pool_size(client: "httpx.Client | httpx.AsyncClient") -> dict:
+    # httpx has no public pool stats; read the transport's pool defensively
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = sum(1 for c in connections if getattr(c, "is_idle", lambda: False)())
+    return {"connections": len(connections), "idle": idle, "max_connections": settings.HTTP_MAX_CONNECTIONS}
+
+
+def http_pool_stats() -> dict:
+    stats = {}
+    if get_http_client.cache_info().currsize:
+        stats["sync"] = _pool_size(get_http_client())
+    if get_async_http_client.cache_info().currsize:
+        stats["async"] = _pool_size(get_async_http_client())
+    return stats
+
+
+async def aclose_http_clients() -> None:
+    if get_http_client.cache_info().currsize:
+        get_http_client().close()
+        get_http_client.cache_clear()
+    if get_async_http_client.cache_info().currsize:
+        await get_async_http_client().aclose()
+        get_async_http_client.cache_clear()
@@ -0,0 +1,133 @@
+"""In-process Prometheus-style metrics: counters and fixed-bucket histograms, rendered in the
+text exposition format by `render()`. Values are per process (each uvicorn/Celery worker has its own)."""
+from bisect import bisect_left
+from threading import Lock
+from typing import Optional, Sequence
+
+# seconds; covers cache hits (sub-ms) through slow LLM generations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_REGISTRY: list["_Metric"] = []
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()])
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [per-bucket counts (+Inf last), sum]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def snapshot(self, **labels: str) -> tuple[int, float]:
+        # (count, sum) of one series
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return (sum(series[0]), series[1]) if series else (0, 0.0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+def render(extra: Sequence[str] = ()) -> str:
+    # text exposition format 0.0.4; `extra` takes pre-rendered gauges computed at scrape time
+    return "\n".join([m.render() for m in _REGISTRY] + list(extra)) + "\n"
+
+
+def gauge(name: str, help: str, value: float = 0, series: Optional[Sequence[tuple[dict, float]]] = None) -> str:
+    # one unlabelled value, or (labels, value) pairs
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    if series is not None:
+        lines += [f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(v)}" for labels, v in series]
+    else:
+        lines.append(f"{name} {_number(value)}")
+    return "\n".join(lines)
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to response headers, by route template.", ("method", "route", "status")
+)
+RAG_STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Query pipeline stage durations (embed, retrieve, rerank, prompt, llm_first_token, llm, total).",
+    ("route", "stage"),
+)
+RAG_QUERIES = Counter("rag_queries_total", "Answered queries by route and cache tier.", ("route", "cache"))
+INGEST_STAGE_SECONDS = Histogram(
+    "ingest_stage_seconds", "Ingest stage durations per document or bulk task.", ("path", "stage"),
+)
+QUERY_LOG_ROWS = Counter("query_log_rows_total", "query_logs rows by outcome (written, dropped, failed).", ("outcome",))
+SLOW_QUERIES = Counter("rag_slow_queries_total", "Queries over the slow-query threshold.", ("route",))
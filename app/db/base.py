@@ -1,6 +1,7 @@
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from app.core.config import settings
 import logging
 
@@ -11,8 +12,18 @@ class Base(DeclarativeBase):
     pass
 
 
+def _pool_options() -> dict:
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_S,
+        "pool_recycle": settings.DB_POOL_RECYCLE_S,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
 def init_engine_and_session():
-    engine = create_engine(settings.DB_DSN, pool_pre_ping=True)
+    engine = create_engine(settings.DB_DSN, **_pool_options())
     SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
     return engine, SessionLocal
 
@@ -20,6 +31,70 @@ def init_engine_and_session():
 engine, SessionLocal = init_engine_and_session()
 
 
+def init_async_engine_and_session():
+    # psycopg 3 serves both engines; SQLAlchemy picks its async dialect here
+    async_engine = create_async_engine(settings.DB_DSN, **_pool_options())
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+    return async_engine, AsyncSessionLocal
+
+
+async_engine, AsyncSessionLocal = init_async_engine_and_session()
+
+
+def _pool_status(pool) -> dict:
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(0, pool.overflow()),  # negative until the pool is full
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+    }
+
+
+def db_pool_stats() -> dict:
+    return {"sync": _pool_status(engine.pool), "async": _pool_status(async_engine.sync_engine.pool)}
+
+# create_all() never alters existing tables; columns added after the first
+# release are patched in here so older databases keep up.
+SCHEMA_PATCHES = [
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS ingested_chunks integer NOT NULL DEFAULT 0",
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_hash varchar(64)",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_document_id_hash ON document_chunks (document_id, content_hash)",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now()",
+    "CREATE INDEX IF NOT EXISTS ix_documents_updated_at ON documents (updated_at)",
+    "ALTER TABLE chunk_embeddings ADD COLUMN IF NOT EXISTS document_id uuid",
+    """
+    UPDATE chunk_embeddings ce SET document_id = dc.document_id
+    FROM document_chunks dc WHERE dc.id = ce.chunk_id AND ce.document_id IS NULL
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_chunk_embeddings_document_id ON chunk_embeddings (document_id)",
+    # rewrites document_chunks once on an existing database
+    f"""
+    ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('{settings.FTS_CONFIG}'::regconfig, content)) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_content_tsv ON document_chunks USING gin (content_tsv)",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS job_id uuid REFERENCES ingest_jobs (id) ON DELETE SET NULL",
+    "CREATE INDEX IF NOT EXISTS ix_documents_job_id ON documents (job_id)",
+    "ALTER TABLE query_logs ADD COLUMN IF NOT EXISTS route varchar(32)",
+    "ALTER TABLE query_logs ADD COLUMN IF NOT EXISTS cache varchar(16)",
+    "ALTER TABLE query_logs ADD COLUMN IF NOT EXISTS status varchar(16)",
+    "ALTER TABLE query_logs ADD COLUMN IF NOT EXISTS timings json",
+    # tenancy: everything written before it belongs to the default tenant on shard 0
+    "ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS tenant_id varchar(64) NOT NULL DEFAULT 'default'",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS tenant_id varchar(64) NOT NULL DEFAULT 'default'",
+    "CREATE INDEX IF NOT EXISTS ix_documents_tenant_id_updated_at ON documents (tenant_id, updated_at)",
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS tenant_id varchar(64) NOT NULL DEFAULT 'default'",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_tenant_id ON document_chunks (tenant_id)",
+    "ALTER TABLE chunk_embeddings ADD COLUMN IF NOT EXISTS tenant_id varchar(64) NOT NULL DEFAULT 'default'",
+    "ALTER TABLE chunk_embeddings ADD COLUMN IF NOT EXISTS shard smallint NOT NULL DEFAULT 0",
+    "CREATE INDEX IF NOT EXISTS ix_chunk_embeddings_tenant_id ON chunk_embeddings (tenant_id)",
+    "ALTER TABLE query_logs ADD COLUMN IF NOT EXISTS tenant_id varchar(64) NOT NULL DEFAULT 'default'",
+    "CREATE INDEX IF NOT EXISTS ix_query_logs_tenant_id_created_at ON query_logs (tenant_id, created_at)",
+    "INSERT INTO tenants (tenant_id) VALUES ('default') ON CONFLICT DO NOTHING",
+]
+
+
 def create_all_tables_and_indexes(engine: Engine) -> None:
     # Ensure extension
     with engine.begin() as conn:
@@ -27,16 +102,13 @@ def create_all_tables_and_indexes(engine: Engine) -> None:
     # Import models to register metadata
     from app.db import models  # noqa: F401
     Base.metadata.create_all(bind=engine)
-    # Create ANN index for embeddings (IVFFLAT with cosine)
     with engine.begin() as conn:
-        conn.execute(
-            text(
-                """
-                CREATE INDEX IF NOT EXISTS ix_chunk_embeddings_embedding
-                ON chunk_embeddings
-                USING ivfflat (embedding vector_cosine_ops)
-                WITH (lists = 100)
-                """
-            )
-        )
+        for stmt in SCHEMA_PATCHES:
+            conn.execute(text(stmt))
+    # one chunk_embeddings partition per shard in use
+    from app.db.tenants import ensure_partitions
+    ensure_partitions(engine)
+    # ANN index (kind and parameters chosen from the row count); a partitioned index, one piece per shard
+    from app.db.indexes import ensure_ann_index
+    ensure_ann_index(engine)
     logger.info("DB schema ensured (tables + indexes).")
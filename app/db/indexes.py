@@ -0,0 +1,352 @@
+"""ANN index management for chunk_embeddings: python -m app.db.indexes {show,rebuild,evaluate}"""
+from typing import NamedTuple, Optional
+import argparse
+import json
+import logging
+import math
+import re
+import time
+
+from sqlalchemy import TextClause, text
+from sqlalchemy.engine import Connection, Engine
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "ix_chunk_embeddings_embedding"
+
+# Compact storage is an expression index over the full vectors (pgvector >= 0.7), so switching
+# modes is an index rebuild: no row is rewritten and the full vectors stay for re-ranking.
+STORAGE_MODES = ("full", "halfvec", "binary", "truncate")
+# candidates per returned row when re-ranking a compact pass
+_RERANK_FACTOR = {"full": 1, "halfvec": 2, "truncate": 4, "binary": 10}
+_TRUNCATE_RE = re.compile(r"subvector\(embedding, 1, (\d+)\)")
+
+
+class IndexPlan(NamedTuple):
+    kind: str  # hnsw | ivfflat
+    build: dict  # WITH (...) storage parameters
+    search: dict  # default GUCs for queries, e.g. {"ivfflat.probes": 10}
+    storage: str = "full"
+    dims: int = 0  # dimensions the index compares (EMBED_DIM, or the truncated size)
+
+
+def storage_dims(storage: str) -> int:
+    return min(settings.VECTOR_TRUNCATE_DIM, settings.EMBED_DIM) if storage == "truncate" else settings.EMBED_DIM
+
+
+def compact_expr(storage: str, dims: int, vec: str) -> str:
+    # the indexed form of a vector expression; the query vector goes through the same one
+    if storage == "full":
+        return vec
+    if storage == "halfvec":
+        return f"({vec})::halfvec({dims})"
+    if storage == "binary":
+        return f"binary_quantize({vec})::bit({dims})"
+    if storage == "truncate":
+        return f"subvector({vec}, 1, {dims})::vector({dims})"
+    raise ValueError(f"unknown vector storage: {storage}")
+
+
+def compact_distance(storage: str, dims: int, qvec: str) -> str:
+    # ORDER BY key the ANN index serves: cosine distance, Hamming distance for binary codes
+    op = "<~>" if storage == "binary" else "<=>"
+    return f"{compact_expr(storage, dims, 'embedding')} {op} {compact_expr(storage, dims, qvec)}"
+
+
+def rerank_factor(storage: str) -> int:
+    if storage == "full":
+        return 1
+    return settings.COMPACT_RERANK_FACTOR or _RERANK_FACTOR[storage]
+
+
+def _opclass(storage: str) -> str:
+    return {"full": "vector_cosine_ops", "halfvec": "halfvec_cosine_ops", "binary": "bit_hamming_ops"}.get(
+        storage, "vector_cosine_ops"
+    )
+
+
+def _storage_of(indexdef: str) -> tuple[str, int]:
+    if "binary_quantize" in indexdef:
+        return "binary", settings.EMBED_DIM
+    if "halfvec" in indexdef:
+        return "halfvec", settings.EMBED_DIM
+    if m := _TRUNCATE_RE.search(indexdef):
+        return "truncate", int(m.group(1))
+    return "full", settings.EMBED_DIM
+
+
+def plan_index(kind: str, rows: int, storage: Optional[str] = None) -> IndexPlan:
+    # pgvector guidance: lists = rows/1000 up to 1M rows, sqrt(rows) beyond; probes = sqrt(lists)
+    storage = (storage or settings.VECTOR_STORAGE).lower()
+    if storage not in STORAGE_MODES:
+        raise ValueError(f"unknown vector storage: {storage}")
+    dims = storage_dims(storage)
+    if kind == "ivfflat":
+        lists = max(1, rows // 1000) if rows <= 1_000_000 else int(math.sqrt(rows))
+        return IndexPlan("ivfflat", {"lists": lists}, _search_for("ivfflat", {"lists": lists}), storage, dims)
+    if kind == "hnsw":
+        large = rows > 5_000_000
+        m = settings.HNSW_M * (2 if large else 1)
+        ef_construction = max(settings.HNSW_EF_CONSTRUCTION, 2 * m)
+        build = {"m": m, "ef_construction": ef_construction}
+        return IndexPlan("hnsw", build, _search_for("hnsw", build), storage, dims)
+    raise ValueError(f"unknown ANN index kind: {kind}")
+
+
+def count_rows(conn: Connection) -> int:
+    return conn.execute(text("SELECT count(*) FROM chunk_embeddings")).scalar_one()
+
+
+def _create_sql(name: str, plan: IndexPlan, concurrently: bool, table: str = "chunk_embeddings") -> str:
+    with_clause = ", ".join(f"{k} = {int(v)}" for k, v in plan.build.items())
+    expr = "embedding" if plan.storage == "full" else f"({compact_expr(plan.storage, plan.dims, 'embedding')})"
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} "
+        f"ON {table} USING {plan.kind} ({expr} {_opclass(plan.storage)}) WITH ({with_clause})"
+    )
+
+
+def partitions(conn: Connection) -> list[str]:
+    # leaf tables of chunk_embeddings, one per shard (app.db.tenants); empty if it isn't partitioned
+    return list(conn.scalars(text(
+        "SELECT relid::regclass::text FROM pg_partition_tree('chunk_embeddings') WHERE isleaf AND level > 0 ORDER BY 1"
+    )))
+
+
+def _search_for(kind: str, build: dict) -> dict:
+    if kind == "ivfflat":
+        return {"ivfflat.probes": max(1, int(math.sqrt(int(build.get("lists", 100)))))}
+    if kind == "hnsw":
+        return {"hnsw.ef_search": settings.HNSW_EF_SEARCH}
+    return {}
+
+
+def index_info(conn: Connection) -> Optional[dict]:
+    row = conn.execute(
+        text(
+            """
+            SELECT am.amname, c.reloptions, i.indisvalid, pg_get_indexdef(c.oid),
+                   -- a partitioned index has no storage itself: one piece per shard
+                   (SELECT sum(pg_relation_size(relid)) FROM pg_partition_tree(c.oid)),
+                   (SELECT count(*) FROM pg_partition_tree(c.oid) WHERE isleaf)
+            FROM pg_class c
+            JOIN pg_index i ON i.indexrelid = c.oid
+            JOIN pg_am am ON am.oid = c.relam
+            WHERE c.relname = :name
+            """
+        ),
+        {"name": INDEX_NAME},
+    ).first()
+    if row is None:
+        return None
+    kind, reloptions, valid, indexdef, size, pieces = row
+    build = dict(opt.split("=", 1) for opt in (reloptions or []))
+    storage, dims = _storage_of(indexdef)
+    return {
+        "kind": kind, "build": build, "search": _search_for(kind, build), "size_bytes": int(size or 0), "valid": valid,
+        "storage": storage, "dims": dims, "partitions": pieces,
+    }
+
+
+def ensure_ann_index(engine: Engine) -> None:
+    # Startup path: never rebuilds. IVFFlat centroids trained on an (almost) empty
+    # table are useless, so that kind waits for ANN_IVFFLAT_MIN_ROWS; queries use exact scans until then.
+    kind = settings.ANN_INDEX.lower()
+    with engine.begin() as conn:
+        if index_info(conn) is not None:
+            return
+        rows = count_rows(conn)
+        if kind == "ivfflat" and rows < settings.ANN_IVFFLAT_MIN_ROWS:
+            logger.info("Skipping ivfflat index: %d rows < ANN_IVFFLAT_MIN_ROWS; rebuild once the corpus grows", rows)
+            return
+        plan = plan_index(kind, rows)
+        conn.execute(text(_create_sql(INDEX_NAME, plan, concurrently=False)))
+    logger.info("Created %s index %s (%s storage) with %s", plan.kind, INDEX_NAME, plan.storage, plan.build)
+
+
+def rebuild_ann_index(engine: Engine, kind: Optional[str] = None, storage: Optional[str] = None) -> IndexPlan:
+    # Builds a replacement next to the live index without blocking writes, swaps the
+    # names in one short transaction, then drops the old index. This is also the storage
+    # migration: queries follow the live index's storage from their next search on.
+    kind = (kind or settings.ANN_INDEX).lower()
+    tmp, retired = f"{INDEX_NAME}_new", f"{INDEX_NAME}_old"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        plan = plan_index(kind, count_rows(conn), storage)
+        parts = partitions(conn)
+        # leftovers of an interrupted rebuild (an INVALID index) must go first
+        conn.execute(text(f"DROP INDEX {'' if parts else 'CONCURRENTLY '}IF EXISTS {tmp}"))
+        conn.execute(text(f"DROP INDEX {'' if parts else 'CONCURRENTLY '}IF EXISTS {retired}"))
+        conn.execute(text(f"SET maintenance_work_mem = '{settings.ANN_BUILD_MAINTENANCE_WORK_MEM}'"))
+        t0 = time.perf_counter()
+        if parts:
+            _build_partitioned(conn, tmp, plan, parts)
+        else:
+            conn.execute(text(_create_sql(tmp, plan, concurrently=True)))
+        logger.info(
+            "Built %s index (%s storage) in %.1fs with %s", plan.kind, plan.storage, time.perf_counter() - t0, plan.build
+        )
+        with engine.begin() as tx:
+            tx.execute(text(f"ALTER INDEX IF EXISTS {INDEX_NAME} RENAME TO {retired}"))
+            tx.execute(text(f"ALTER INDEX {tmp} RENAME TO {INDEX_NAME}"))
+        if parts:
+            # DROP INDEX CONCURRENTLY can't take a partitioned index; this lock lasts as long as the unlink
+            conn.execute(text(f"DROP INDEX IF EXISTS {retired}"))
+            for part in parts:
+                conn.execute(text(f"ALTER INDEX IF EXISTS {part}_ann_new RENAME TO {part}_ann"))
+        else:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {retired}"))
+    return plan
+
+
+def _build_partitioned(conn: Connection, name: str, plan: IndexPlan, parts: list[str]) -> None:
+    # CREATE INDEX CONCURRENTLY doesn't take a partitioned table: an (invalid) index on the parent
+    # only, then each shard's piece built concurrently and attached; the last one makes it valid
+    for part in parts:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {part}_ann_new"))
+    conn.execute(text(_create_sql(name, plan, concurrently=False, table="ONLY chunk_embeddings")))
+    for part in parts:
+        conn.execute(text(_create_sql(f"{part}_ann_new", plan, concurrently=True, table=part)))
+        conn.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {part}_ann_new"))
+
+
+# (pg_get_indexdef, live index info) behind the search GUCs and storage. The definition is one
+# catalog lookup per search and names the kind, storage and build options, so a rebuild in any
+# process is picked up by the next search; the rest (sizes, partitions) is re-read only when it changes.
+_live: Optional[tuple[Optional[str], Optional[dict]]] = None
+_INDEXDEF_SQL = text("SELECT pg_get_indexdef(c.oid) FROM pg_class c WHERE c.relname = :name AND c.relkind IN ('i', 'I')")
+
+
+def live_index(conn: Connection) -> Optional[dict]:
+    global _live
+    indexdef = conn.execute(_INDEXDEF_SQL, {"name": INDEX_NAME}).scalar()
+    cached = _live
+    if cached is not None and cached[0] == indexdef:
+        return cached[1]
+    info = index_info(conn) if indexdef else None
+    _live = (indexdef, info)
+    return info
+
+
+def search_defaults(conn: Connection) -> dict:
+    info = live_index(conn)
+    return info["search"] if info else {}
+
+
+def search_storage(conn: Connection) -> tuple[str, int]:
+    # (storage, dims) the live index was built with; without an index every search is exact anyway
+    info = live_index(conn)
+    return (info["storage"], info["dims"]) if info else ("full", settings.EMBED_DIM)
+
+
+def search_gucs(defaults: dict, probes: Optional[int] = None, ef_search: Optional[int] = None) -> dict:
+    gucs = dict(defaults)
+    if probes:
+        gucs["ivfflat.probes"] = probes
+    if ef_search:
+        gucs["hnsw.ef_search"] = ef_search
+    return gucs
+
+
+def set_gucs_stmt(gucs: dict) -> tuple[TextClause, dict]:
+    # one round trip; is_local=true scopes the settings to the current transaction
+    calls = ", ".join(f"set_config(:n{i}, :v{i}, true)" for i in range(len(gucs)))
+    params = {}
+    for i, (name, value) in enumerate(gucs.items()):
+        params[f"n{i}"], params[f"v{i}"] = name, str(value)
+    return text(f"SELECT {calls}"), params
+
+
+def evaluate(engine: Engine, k: int = 10, queries: int = 100, probes: Optional[list[int]] = None, ef_search: Optional[list[int]] = None) -> list[dict]:
+    # Recall@k and latency of the ANN index at several search settings vs an exact scan.
+    with engine.begin() as conn:
+        sample = [r[0] for r in conn.execute(
+            text("SELECT embedding::text FROM chunk_embeddings ORDER BY random() LIMIT :n"), {"n": queries}
+        )]
+        info = index_info(conn)
+    if not sample:
+        return []
+    exact_sql = text("SELECT chunk_id FROM chunk_embeddings ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k")
+    storage, dims = (info["storage"], info["dims"]) if info else ("full", settings.EMBED_DIM)
+    cand = k * rerank_factor(storage)
+    if storage == "full":
+        search_sql = exact_sql
+    else:
+        # compact pass over the index, then re-rank the candidates on the full vectors
+        key = compact_distance(storage, dims, "CAST(:q AS vector)")
+        search_sql = text(
+            f"SELECT chunk_id FROM (SELECT chunk_id, embedding FROM chunk_embeddings ORDER BY {key} LIMIT :cand) c "
+            f"ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k"
+        )
+
+    def run(gucs: dict, exact: bool = False) -> tuple[list[set], list[float]]:
+        results, latencies = [], []
+        with engine.begin() as conn:
+            if exact:
+                conn.execute(text("SET LOCAL enable_indexscan = off"))
+                conn.execute(text("SET LOCAL enable_bitmapscan = off"))
+            if gucs:
+                conn.execute(*set_gucs_stmt(gucs))
+            for q in sample:
+                t0 = time.perf_counter()
+                sql = exact_sql if exact else search_sql
+                ids = {r[0] for r in conn.execute(sql, {"q": q, "k": k, "cand": cand})}
+                latencies.append(time.perf_counter() - t0)
+                results.append(ids)
+        return results, latencies
+
+    def summary(label: str, gucs: dict, results: list[set], latencies: list[float], truth: list[set]) -> dict:
+        recall = sum(len(r & t) / max(1, len(t)) for r, t in zip(results, truth)) / len(truth)
+        ordered = sorted(latencies)
+        return {
+            "setting": label,
+            "storage": "full" if label == "exact" else storage,
+            "gucs": gucs,
+            f"recall@{k}": round(recall, 4),
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        }
+
+    truth, exact_lat = run({}, exact=True)
+    report = [summary("exact", {}, truth, exact_lat, truth)]
+    kind = info["kind"] if info else None
+    if kind == "ivfflat":
+        settings_list = [{"ivfflat.probes": p} for p in (probes or [1, 5, 10, 20, 40])]
+    elif kind == "hnsw":
+        settings_list = [{"hnsw.ef_search": e} for e in (ef_search or [20, 40, 80, 160])]
+    else:
+        settings_list = []
+    for gucs in settings_list:
+        results, lat = run(gucs)
+        report.append(summary(kind, gucs, results, lat, truth))
+    return report
+
+
+def main() -> None:
+    from app.db.base import engine
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("show")
+    rebuild = sub.add_parser("rebuild")
+    rebuild.add_argument("--kind", choices=["hnsw", "ivfflat"])
+    rebuild.add_argument("--storage", choices=STORAGE_MODES, help="default VECTOR_STORAGE")
+    ev = sub.add_parser("evaluate")
+    ev.add_argument("--k", type=int, default=10)
+    ev.add_argument("--queries", type=int, default=100)
+    ev.add_argument("--probes", type=int, nargs="*")
+    ev.add_argument("--ef-search", type=int, nargs="*")
+    args = parser.parse_args()
+    if args.cmd == "show":
+        with engine.connect() as conn:
+            print(json.dumps({"rows": count_rows(conn), "index": index_info(conn)}))
+    elif args.cmd == "rebuild":
+        print(json.dumps(rebuild_ann_index(engine, args.kind, args.storage)._asdict()))
+    else:
+        for line in evaluate(engine, args.k, args.queries, args.probes, args.ef_search):
+            print(json.dumps(line))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Schema migration (extension, tables, SCHEMA_PATCHES, ANN index): python -m app.db.migrate
+
+Run once per deploy before the API and workers start. Concurrent runs serialize on a Postgres
+advisory lock, so replicas started with DB_MIGRATE_ON_STARTUP cannot race on the DDL: the first
+one applies it, the others wait and then find nothing left to do.
+"""
+import logging
+import time
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_lock key shared by every migrating process of this service
+MIGRATION_LOCK_ID = 7_215_390_441
+
+
+def migrate(engine: Engine) -> float:
+    from app.db.base import create_all_tables_and_indexes
+
+    t0 = time.perf_counter()
+    # a session-level lock on its own connection; the DDL runs on others from the pool
+    with engine.connect() as lock:
+        lock.execute(text("SELECT pg_advisory_lock(:k)"), {"k": MIGRATION_LOCK_ID})
+        lock.commit()
+        waited = time.perf_counter() - t0
+        try:
+            create_all_tables_and_indexes(engine)
+        finally:
+            lock.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": MIGRATION_LOCK_ID})
+            lock.commit()
+    elapsed = time.perf_counter() - t0
+    logger.info("Migration done in %.2fs (%.2fs waiting for the lock)", elapsed, waited)
+    return elapsed
+
+
+def main() -> None:
+    from app.core.logging import setup_logging
+    from app.db.base import engine
+
+    setup_logging()
+    migrate(engine)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,60 @@
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, Text, Integer, ForeignKey, JSON, TIMESTAMP, func
+from sqlalchemy import String, Text, Integer, SmallInteger, ForeignKey, JSON, TIMESTAMP, Index, Computed, func
 from pgvector.sqlalchemy import Vector
 from uuid import uuid4
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
 from app.db.base import Base
 from app.core.config import settings
+from app.db.tenants import DEFAULT_SHARD, DEFAULT_TENANT
+
+
+class Tenant(Base):
+    # where a tenant's embeddings live; see app.db.tenants
+    __tablename__ = "tenants"
+    tenant_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    shard: Mapped[int] = mapped_column(SmallInteger, default=DEFAULT_SHARD, server_default=str(DEFAULT_SHARD))
+    moving_to: Mapped[int | None] = mapped_column(SmallInteger, default=None)
+    created_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+
+
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+    id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    tenant_id: Mapped[str] = mapped_column(String(64), default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    status: Mapped[str] = mapped_column(String(32), default="pending")  # pending | running | done | failed
+    source: Mapped[str] = mapped_column(String(512))
+    total_documents: Mapped[int] = mapped_column(Integer, default=0)
+    error: Mapped[str | None] = mapped_column(Text, default=None)
+    created_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+    started_at: Mapped[str | None] = mapped_column(TIMESTAMP(timezone=True), default=None)
+    finished_at: Mapped[str | None] = mapped_column(TIMESTAMP(timezone=True), default=None)
 
 
 class Document(Base):
     __tablename__ = "documents"
     id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    tenant_id: Mapped[str] = mapped_column(String(64), default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
     filename: Mapped[str] = mapped_column(String(512))
     mime_type: Mapped[str] = mapped_column(String(128))
     status: Mapped[str] = mapped_column(String(32), default="uploaded")  
     metadata: Mapped[dict | None] = mapped_column(JSON, default=None)
+    ingested_chunks: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
     created_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+    # bumped on every status change; cached answers are keyed on it
+    updated_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now(), index=True)
+    # set for documents created by a bulk ingest job
+    job_id: Mapped[UUID | None] = mapped_column(
+        UUID(as_uuid=True), ForeignKey("ingest_jobs.id", ondelete="SET NULL"), index=True, default=None
+    )
 
     text = relationship("DocumentText", back_populates="document", uselist=False, cascade="all,delete")
     chunks = relationship("DocumentChunk", back_populates="document", cascade="all,delete")
 
+    __table_args__ = (
+        # per-tenant corpus stamp
+        Index("ix_documents_tenant_id_updated_at", "tenant_id", "updated_at"),
+    )
+
 
 class DocumentText(Base):
     __tablename__ = "document_texts"
@@ -34,28 +70,68 @@ class DocumentChunk(Base):
     __tablename__ = "document_chunks"
     id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
     document_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"))
+    # denormalized from documents: the lexical leg scopes on it without the join
+    tenant_id: Mapped[str] = mapped_column(String(64), default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
     chunk_index: Mapped[int] = mapped_column(Integer)
     content: Mapped[str] = mapped_column(Text)
+    # sha256 of content; lets re-ingest keep unchanged rows and their embeddings
+    content_hash: Mapped[str | None] = mapped_column(String(64), default=None)
     token_count: Mapped[int | None] = mapped_column(Integer, default=None)
     metadata: Mapped[dict | None] = mapped_column(JSON, default=None)
+    # full-text side of hybrid search; maintained by Postgres, never loaded by the ORM
+    content_tsv = mapped_column(
+        TSVECTOR, Computed(f"to_tsvector('{settings.FTS_CONFIG}'::regconfig, content)", persisted=True), deferred=True
+    )
 
     document = relationship("Document", back_populates="chunks")
     embedding = relationship("ChunkEmbedding", back_populates="chunk", uselist=False, cascade="all,delete")
 
+    __table_args__ = (
+        Index("ix_document_chunks_document_id_hash", "document_id", "content_hash"),
+        Index("ix_document_chunks_content_tsv", "content_tsv", postgresql_using="gin"),
+        Index("ix_document_chunks_tenant_id", "tenant_id"),
+    )
+
 
 class ChunkEmbedding(Base):
     __tablename__ = "chunk_embeddings"
     chunk_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("document_chunks.id", ondelete="CASCADE"), primary_key=True)
+    # denormalized from document_chunks so filtered searches never need the join
+    document_id: Mapped[UUID | None] = mapped_column(UUID(as_uuid=True), index=True, default=None)
+    tenant_id: Mapped[str] = mapped_column(String(64), index=True, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    # partition key: the tenant's shard when the row was written (app.db.tenants moves it)
+    shard: Mapped[int] = mapped_column(
+        SmallInteger, primary_key=True, default=DEFAULT_SHARD, server_default=str(DEFAULT_SHARD)
+    )
     embedding: Mapped[list[float]] = mapped_column(Vector(settings.EMBED_DIM))
 
     chunk = relationship("DocumentChunk", back_populates="embedding")
 
+    __table_args__ = ({"postgresql_partition_by": "LIST (shard)"},)
+
 
 class QueryLog(Base):
     __tablename__ = "query_logs"
     id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    tenant_id: Mapped[str] = mapped_column(String(64), default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
     query: Mapped[str] = mapped_column(Text)
     top_k: Mapped[int] = mapped_column(Integer)
     latency_ms: Mapped[int | None]
     model: Mapped[str | None] = mapped_column(String(128))
+    route: Mapped[str | None] = mapped_column(String(32), default=None)
+    cache: Mapped[str | None] = mapped_column(String(16), default=None)  # exact | semantic | None
+    status: Mapped[str | None] = mapped_column(String(16), default=None)  # ok | error | cancelled
+    # stage -> milliseconds (cache, embed, retrieve, prompt, llm_first_token, llm, total)
+    timings: Mapped[dict | None] = mapped_column(JSON, default=None)
     created_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+
+    __table_args__ = (Index("ix_query_logs_tenant_id_created_at", "tenant_id", "created_at"),)
+
+
+class EmbeddingCacheEntry(Base):
+    __tablename__ = "embedding_cache"
+    model: Mapped[str] = mapped_column(String(128), primary_key=True)
+    content_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    # dimensionless: one table serves every embedding model
+    embedding: Mapped[list[float]] = mapped_column(Vector())
+    last_used_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now(), index=True)
@@ -1,12 +1,37 @@
 from sqlalchemy.orm import Session
-from app.db.models import Document, DocumentText, DocumentChunk, ChunkEmbedding
-from typing import Optional
-from uuid import UUID
-from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.db.models import Document, DocumentText, DocumentChunk, ChunkEmbedding, IngestJob, QueryLog, Tenant
+from typing import Iterable, Iterator, Optional, Sequence
+import codecs
+from uuid import UUID, uuid4
+from sqlalchemy import select, update, delete, insert, func, case, text
+from app.db.tenants import DEFAULT_TENANT
+from app.db.utils import copy_embeddings
 
 
-def create_document_stub(db: Session, filename: str, mime_type: str, extracted_text: str, metadata: dict | None):
-    doc = Document(filename=filename, mime_type=mime_type, metadata=metadata, status="uploaded")
+def _register_tenant(db: Session, tenant: str) -> None:
+    # writers lock this row (see _placements); new tenants start on the shared shard
+    db.execute(pg_insert(Tenant).values(tenant_id=tenant).on_conflict_do_nothing())
+
+
+def _placements(db: Session, document_ids: Iterable[UUID]) -> dict[UUID, tuple[str, int]]:
+    # document -> (tenant, shard for its new embeddings). FOR SHARE until the caller commits keeps a
+    # tenant move from switching shards under this write; during a move new rows go to the target.
+    rows = db.execute(
+        select(Document.id, Tenant.tenant_id, func.coalesce(Tenant.moving_to, Tenant.shard))
+        .join(Tenant, Tenant.tenant_id == Document.tenant_id)
+        .where(Document.id.in_(list(document_ids)))
+        .with_for_update(read=True, of=Tenant)
+    ).all()
+    return {doc_id: (tenant, shard) for doc_id, tenant, shard in rows}
+
+
+def create_document_stub(
+    db: Session, filename: str, mime_type: str, extracted_text: str, metadata: dict | None, tenant: str = DEFAULT_TENANT
+):
+    _register_tenant(db, tenant)
+    doc = Document(tenant_id=tenant, filename=filename, mime_type=mime_type, metadata=metadata, status="uploaded")
     db.add(doc)
     db.flush()
     db.add(DocumentText(document_id=doc.id, extracted_text=extracted_text))
@@ -15,22 +40,36 @@ def create_document_stub(db: Session, filename: str, mime_type: str, extracted_t
     return doc
 
 
-def get_document(db: Session, document_id: str) -> Optional[Document]:
-    return db.get(Document, UUID(document_id))
+def get_document(db: Session, document_id: str, tenant: Optional[str] = None) -> Optional[Document]:
+    # with a tenant, another tenant's document is as good as missing
+    doc = db.get(Document, UUID(document_id))
+    if doc is None or (tenant is not None and doc.tenant_id != tenant):
+        return None
+    return doc
 
 
 def set_document_status(db: Session, document_id: str, status: str) -> None:
-    db.execute(update(Document).where(Document.id == UUID(document_id)).values(status=status))
+    # updated_at moves the corpus stamp, which invalidates cached answers in scope
+    db.execute(update(Document).where(Document.id == UUID(document_id)).values(status=status, updated_at=func.now()))
     db.commit()
 
 
-def upsert_chunks(db: Session, document_id: str, chunks: list[tuple[int, str]]):
-    # chunks: list of (chunk_index, content)
-    # Drop old
-    db.execute(delete(DocumentChunk).where(DocumentChunk.document_id == UUID(document_id)))
-    for idx, content in chunks:
-        db.add(DocumentChunk(document_id=UUID(document_id), chunk_index=idx, content=content))
-    db.commit()
+def _corpus_stamp_stmt(document_ids: Optional[list[str]], tenant: str):
+    stmt = select(func.max(Document.updated_at)).where(Document.tenant_id == tenant)
+    if document_ids:
+        stmt = stmt.where(Document.id.in_([UUID(d) for d in document_ids]))
+    return stmt
+
+
+def corpus_stamp(db: Session, document_ids: Optional[list[str]] = None, tenant: str = DEFAULT_TENANT) -> str:
+    # Latest status change among the documents in scope (all the tenant's documents if unfiltered).
+    stamp = db.scalar(_corpus_stamp_stmt(document_ids, tenant))
+    return stamp.isoformat() if stamp else ""
+
+
+async def acorpus_stamp(db: AsyncSession, document_ids: Optional[list[str]] = None, tenant: str = DEFAULT_TENANT) -> str:
+    stamp = await db.scalar(_corpus_stamp_stmt(document_ids, tenant))
+    return stamp.isoformat() if stamp else ""
 
 
 def fetch_chunks_for_embedding(db: Session, document_id: str) -> list[DocumentChunk]:
@@ -43,3 +82,238 @@ def list_chunk_texts(db: Session, document_id: str) -> list[tuple[str, str]]:
         select(DocumentChunk.id, DocumentChunk.content).where(DocumentChunk.document_id == UUID(document_id))
     ).all()
     return [(str(r[0]), r[1]) for r in rows]
+
+
+def iter_document_text(db: Session, document_id: str, piece_chars: int) -> Iterator[str]:
+    # Stream extracted_text in slices of at most piece_chars through a server-side cursor. The value is
+    # detoasted and converted to bytes once; each slice is then a bytea substring at a byte offset. A
+    # substr() query per slice decompressed the column from the start every time (and still walks it
+    # char by char under UTF-8 when uncompressed). The cursor lives until `db` commits: read on a
+    # session that doesn't, and close the generator when stopping early.
+    stmt = text(
+        """
+        SELECT substring(t.b FROM s.start FOR :n)
+        FROM (SELECT convert_to(extracted_text, 'UTF8') AS b FROM document_texts WHERE document_id = :id OFFSET 0) t,
+             generate_series(1, octet_length(t.b), :n) AS s(start)
+        """
+    )
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with db.execute(stmt, {"id": UUID(document_id), "n": piece_chars}, execution_options={"yield_per": 1}) as result:
+        for (piece,) in result:
+            # a slice may end inside a multi-byte character; the decoder carries it over
+            if text_ := decoder.decode(piece):
+                yield text_
+
+
+def load_chunk_hashes(db: Session, document_id: str) -> dict[str, list[tuple[UUID, int, int | None, dict | None]]]:
+    # content_hash -> [(chunk_id, chunk_index, token_count, metadata)], lowest index last so pop() takes it first
+    rows = db.execute(
+        select(
+            DocumentChunk.content_hash, DocumentChunk.id, DocumentChunk.chunk_index, DocumentChunk.token_count,
+            DocumentChunk.metadata,
+        )
+        .where(DocumentChunk.document_id == UUID(document_id))
+        .order_by(DocumentChunk.chunk_index.desc())
+    ).all()
+    out: dict[str, list[tuple[UUID, int, int | None, dict | None]]] = {}
+    for h, chunk_id, idx, tokens, meta in rows:
+        # rows from before content hashing never match, so they get replaced
+        out.setdefault(h or "", []).append((chunk_id, idx, tokens, meta))
+    out.pop("", None)
+    return out
+
+
+def reset_ingest_progress(db: Session, document_id: str) -> None:
+    db.execute(update(Document).where(Document.id == UUID(document_id)).values(ingested_chunks=0))
+    db.commit()
+
+
+def add_ingest_progress(db: Session, document_id: str, n: int) -> None:
+    db.execute(update(Document).where(Document.id == UUID(document_id)).values(ingested_chunks=Document.ingested_chunks + n))
+    db.commit()
+
+
+def write_chunk_batch(
+    db: Session,
+    document_id: str,
+    fresh: Sequence[tuple[int, str, str, int, dict | None]],
+    vectors: Sequence[Sequence[float]],
+    updated: Sequence[tuple[UUID, int, int, dict | None]],
+) -> None:
+    # fresh: (chunk_index, content, content_hash, token_count, metadata) rows to insert with their vectors;
+    # updated: (chunk_id, chunk_index, token_count, metadata) for unchanged chunks whose stored fields differ.
+    # Does not commit: a re-ingest swaps the whole chunk set in one transaction.
+    doc_id = UUID(document_id)
+    if fresh:
+        tenant, shard = _placements(db, [doc_id])[doc_id]
+        rows = [
+            {
+                "id": uuid4(), "document_id": doc_id, "tenant_id": tenant, "chunk_index": idx, "content": content,
+                "content_hash": h, "token_count": n, "metadata": meta,
+            }
+            for idx, content, h, n, meta in fresh
+        ]
+        db.execute(insert(DocumentChunk), rows)
+        copy_embeddings(db, ((r["id"], doc_id, tenant, shard, vec) for r, vec in zip(rows, vectors)))
+    if updated:
+        db.execute(
+            update(DocumentChunk),
+            [{"id": chunk_id, "chunk_index": idx, "token_count": n, "metadata": meta} for chunk_id, idx, n, meta in updated],
+        )
+
+
+def delete_chunks(db: Session, chunk_ids: Sequence[UUID]) -> None:
+    # slices keep the IN list well under the driver's bind parameter limit; the caller commits
+    for i in range(0, len(chunk_ids), 1000):
+        db.execute(delete(DocumentChunk).where(DocumentChunk.id.in_(chunk_ids[i:i + 1000])))
+
+
+def create_ingest_job(
+    db: Session, job_id: UUID, source: str, files: Sequence[tuple[str, str, str]], tenant: str = DEFAULT_TENANT
+) -> IngestJob:
+    # files: (path, filename, mime_type); one Document row per file, inserted in bulk
+    _register_tenant(db, tenant)
+    job = IngestJob(id=job_id, tenant_id=tenant, source=source, total_documents=len(files), status="pending")
+    db.add(job)
+    db.flush()
+    for i in range(0, len(files), 1000):
+        db.execute(
+            insert(Document),
+            [
+                {
+                    "id": uuid4(), "tenant_id": tenant, "filename": filename[:512], "mime_type": (mime_type or "")[:128],
+                    "status": "queued",
+                    "job_id": job_id, "metadata": {"filename": filename, "mime_type": mime_type, "source_path": path},
+                }
+                for path, filename, mime_type in files[i:i + 1000]
+            ],
+        )
+    db.commit()
+    return job
+
+
+def get_ingest_job(db: Session, job_id: str, tenant: Optional[str] = None) -> Optional[IngestJob]:
+    job = db.get(IngestJob, UUID(job_id))
+    if job is None or (tenant is not None and job.tenant_id != tenant):
+        return None
+    return job
+
+
+def set_ingest_job(db: Session, job_id: str, **values) -> None:
+    db.execute(update(IngestJob).where(IngestJob.id == UUID(job_id)).values(**values))
+    db.commit()
+
+
+def job_document_ids(db: Session, job_id: str, status: Optional[str] = None) -> list[str]:
+    stmt = select(Document.id).where(Document.job_id == UUID(job_id))
+    if status:
+        stmt = stmt.where(Document.status == status)
+    return [str(i) for i in db.scalars(stmt.order_by(Document.id))]
+
+
+def ingest_job_counts(db: Session, job_id: str) -> dict:
+    # {status: documents} plus embedded chunks, from the job's documents; no counters to contend on
+    rows = db.execute(
+        select(Document.status, func.count(), func.coalesce(func.sum(Document.ingested_chunks), 0))
+        .where(Document.job_id == UUID(job_id))
+        .group_by(Document.status)
+    ).all()
+    return {"documents": {status: n for status, n, _ in rows}, "chunks_embedded": int(sum(c for _, _, c in rows))}
+
+
+def store_parsed_document(
+    db: Session, document_id: str, text_: str, metadata: dict, chunks: Sequence[tuple[int, str, str, int, dict | None]],
+    tenant: str,
+) -> None:
+    # text plus (chunk_index, content, content_hash, token_count, metadata) rows without embeddings;
+    # the document waits as "chunked" until the embedding stage picks its chunks up
+    doc_id = UUID(document_id)
+    db.add(DocumentText(document_id=doc_id, extracted_text=text_))
+    for i in range(0, len(chunks), 1000):
+        db.execute(
+            insert(DocumentChunk),
+            [
+                {
+                    "id": uuid4(), "document_id": doc_id, "tenant_id": tenant, "chunk_index": idx, "content": content,
+                    "content_hash": h, "token_count": n, "metadata": meta,
+                }
+                for idx, content, h, n, meta in chunks[i:i + 1000]
+            ],
+        )
+    db.execute(update(Document).where(Document.id == doc_id).values(metadata=metadata, status="chunked"))
+    db.commit()
+
+
+def chunk_range_bounds(db: Session, job_id: str, size: int) -> list[Optional[str]]:
+    # every `size`-th chunk id (by id) among the job's chunks still missing an embedding;
+    # consecutive bounds delimit batches that pack chunks across document boundaries
+    rows = db.execute(
+        text(
+            """
+            SELECT id::text FROM (
+                SELECT dc.id, row_number() OVER (ORDER BY dc.id) AS rn
+                FROM document_chunks dc
+                JOIN documents d ON d.id = dc.document_id
+                WHERE d.job_id = :job_id AND d.status = 'chunked'
+                  AND NOT EXISTS (SELECT 1 FROM chunk_embeddings ce WHERE ce.chunk_id = dc.id)
+            ) numbered
+            WHERE rn % :size = 1
+            ORDER BY id
+            """
+        ),
+        {"job_id": job_id, "size": size},
+    ).all()
+    return [r[0] for r in rows]
+
+
+def chunks_in_range(db: Session, job_id: str, lo: str, hi: Optional[str]) -> list[tuple[UUID, UUID, str]]:
+    # (chunk_id, document_id, content) of un-embedded job chunks with lo <= id < hi
+    stmt = (
+        select(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.content)
+        .join(Document, Document.id == DocumentChunk.document_id)
+        .where(Document.job_id == UUID(job_id), Document.status == "chunked", DocumentChunk.id >= UUID(lo))
+        .where(~select(ChunkEmbedding.chunk_id).where(ChunkEmbedding.chunk_id == DocumentChunk.id).exists())
+        .order_by(DocumentChunk.id)
+    )
+    if hi:
+        stmt = stmt.where(DocumentChunk.id < UUID(hi))
+    return [tuple(r) for r in db.execute(stmt).all()]
+
+
+def write_embeddings(db: Session, rows: Sequence[tuple[UUID, UUID]], vectors: Sequence[Sequence[float]]) -> None:
+    # rows: (chunk_id, document_id); bumps each document's ingested_chunks by its share
+    placed = _placements(db, {doc_id for _, doc_id in rows})
+    copy_embeddings(db, ((chunk_id, doc_id, *placed[doc_id], vec) for (chunk_id, doc_id), vec in zip(rows, vectors)))
+    per_doc: dict[UUID, int] = {}
+    for _, doc_id in rows:
+        per_doc[doc_id] = per_doc.get(doc_id, 0) + 1
+    for doc_id, n in per_doc.items():
+        db.execute(update(Document).where(Document.id == doc_id).values(ingested_chunks=Document.ingested_chunks + n))
+    db.commit()
+
+
+def finish_job_documents(db: Session, job_id: str) -> None:
+    # chunked documents become ready once every chunk has an embedding, failed otherwise
+    missing = (
+        select(DocumentChunk.id)
+        .where(DocumentChunk.document_id == Document.id)
+        .where(~select(ChunkEmbedding.chunk_id).where(ChunkEmbedding.chunk_id == DocumentChunk.id).exists())
+        .exists()
+    )
+    # documents a lost parse task never reached
+    db.execute(
+        update(Document)
+        .where(Document.job_id == UUID(job_id), Document.status == "queued")
+        .values(status="failed", updated_at=func.now())
+    )
+    db.execute(
+        update(Document)
+        .where(Document.job_id == UUID(job_id), Document.status == "chunked")
+        .values(status=case((missing, "failed"), else_="ready"), updated_at=func.now())
+    )
+    db.commit()
+
+
+def write_query_logs(db: Session, rows: Sequence[dict]) -> None:
+    db.execute(insert(QueryLog), [{"id": uuid4(), **row} for row in rows])
+    db.commit()
@@ -0,0 +1,211 @@
+"""Tenant placement: python -m app.db.tenants {show,add-shard,move,partition}
+
+chunk_embeddings is LIST-partitioned on `shard`, and the ANN index is a partitioned index, so every
+shard has its own graph (or lists) and a search only walks the shard(s) of its tenant. Small
+tenants share shard 0; a large one gets a shard of its own with `move`. The `tenants` table maps
+tenant -> shard. While a tenant moves, `moving_to` names the target: writers put new rows there,
+searches read both shards, and the mover re-keys the old rows in batches (an UPDATE of the
+partition key moves a row between partitions), so the tenant stays searchable throughout.
+"""
+from typing import Optional
+import argparse
+import json
+import logging
+import time
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+DEFAULT_SHARD = 0
+MAX_SHARD = 32767  # smallint
+
+
+def partition_name(shard: int) -> str:
+    return f"chunk_embeddings_s{int(shard)}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    return conn.scalar(text("SELECT relkind = 'p' FROM pg_class WHERE oid = 'chunk_embeddings'::regclass"))
+
+
+def add_shard(conn: Connection, shard: int, parent: str = "chunk_embeddings") -> None:
+    # a new partition inherits every index of the parent, the ANN index included (built empty)
+    if not 0 <= shard <= MAX_SHARD:
+        raise ValueError(f"shard out of range: {shard}")
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {partition_name(shard)} PARTITION OF {parent} FOR VALUES IN ({int(shard)})"))
+
+
+def _known_shards(conn: Connection) -> list[int]:
+    return sorted({DEFAULT_SHARD, *conn.scalars(text(
+        "SELECT shard FROM tenants UNION SELECT moving_to FROM tenants WHERE moving_to IS NOT NULL"
+    ))})
+
+
+def ensure_partitions(engine: Engine) -> None:
+    # startup path: the partitions the tenants table refers to
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            logger.warning("chunk_embeddings is not partitioned; convert it with: python -m app.db.tenants partition")
+            return
+        for shard in _known_shards(conn):
+            add_shard(conn, shard)
+
+
+def move_tenant(engine: Engine, tenant: str, shard: int, batch_rows: Optional[int] = None) -> int:
+    """Move a tenant's embeddings to `shard` (created if missing); returns the rows moved.
+
+    Writers read the tenant's placement FOR SHARE in their own transaction, so setting moving_to
+    waits for the ones that picked the old shard; afterwards nothing new lands there and the batches
+    below drain it. Resumes an interrupted move to the same shard.
+    """
+    batch_rows = batch_rows or settings.TENANT_MOVE_BATCH_ROWS
+    with engine.begin() as conn:
+        add_shard(conn, shard)
+    with engine.begin() as conn:
+        row = conn.execute(
+            text("SELECT shard, moving_to FROM tenants WHERE tenant_id = :t FOR UPDATE"), {"t": tenant}
+        ).first()
+        if row is None:
+            # no data yet: just place it
+            conn.execute(text("INSERT INTO tenants (tenant_id, shard) VALUES (:t, :s)"), {"t": tenant, "s": shard})
+            return 0
+        source, moving_to = row
+        if moving_to is not None and moving_to != shard:
+            raise ValueError(f"tenant {tenant} is already moving to shard {moving_to}")
+        if source == shard:
+            return 0
+        conn.execute(text("UPDATE tenants SET moving_to = :s WHERE tenant_id = :t"), {"t": tenant, "s": shard})
+    t0 = time.perf_counter()
+    moved = 0
+    while True:
+        # short transactions: each batch's locks and index inserts stay small
+        with engine.begin() as conn:
+            n = conn.execute(
+                text(
+                    """
+                    UPDATE chunk_embeddings SET shard = :dst
+                    WHERE shard = :src AND chunk_id IN (
+                        SELECT chunk_id FROM chunk_embeddings WHERE shard = :src AND tenant_id = :t LIMIT :n
+                    )
+                    """
+                ),
+                {"src": source, "dst": shard, "t": tenant, "n": batch_rows},
+            ).rowcount
+        moved += n
+        if n < batch_rows:
+            break
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE tenants SET shard = :s, moving_to = NULL WHERE tenant_id = :t"), {"t": tenant, "s": shard})
+    logger.info("Moved tenant %s: %d rows shard %d -> %d in %.1fs", tenant, moved, source, shard, time.perf_counter() - t0)
+    return moved
+
+
+def partition_table(engine: Engine) -> int:
+    """One-off conversion of a chunk_embeddings created before partitioning; returns the rows copied.
+
+    Everything (rows, btrees, ANN index) is built on a new partitioned table while a SHARE lock
+    holds off ingest writes; searches keep reading the old table until the swap commits.
+    """
+    from app.db.indexes import INDEX_NAME, _create_sql, index_info, plan_index
+
+    new = "chunk_embeddings_partitioned"
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            return 0
+        conn.execute(text("LOCK TABLE chunk_embeddings IN SHARE MODE"))
+        info = index_info(conn)
+        conn.execute(text(f"""
+            CREATE TABLE {new} (
+                LIKE chunk_embeddings INCLUDING DEFAULTS,
+                CONSTRAINT {new}_pkey PRIMARY KEY (chunk_id, shard),
+                FOREIGN KEY (chunk_id) REFERENCES document_chunks (id) ON DELETE CASCADE
+            ) PARTITION BY LIST (shard)
+        """))
+        for shard in _known_shards(conn):
+            add_shard(conn, shard, parent=new)
+        columns = "chunk_id, document_id, tenant_id, shard, embedding"
+        rows = conn.execute(text(f"INSERT INTO {new} ({columns}) SELECT {columns} FROM chunk_embeddings")).rowcount
+        conn.execute(text(f"SET LOCAL maintenance_work_mem = '{settings.ANN_BUILD_MAINTENANCE_WORK_MEM}'"))
+        conn.execute(text(f"CREATE INDEX {new}_document_id ON {new} (document_id)"))
+        conn.execute(text(f"CREATE INDEX {new}_tenant_id ON {new} (tenant_id)"))
+        if info is not None:
+            plan = plan_index(info["kind"], rows, info["storage"])
+            conn.execute(text(_create_sql(f"{new}_embedding", plan, concurrently=False, table=new)))
+        # the swap: a brief ACCESS EXCLUSIVE lock, released at commit
+        conn.execute(text("DROP TABLE chunk_embeddings"))
+        conn.execute(text(f"ALTER TABLE {new} RENAME TO chunk_embeddings"))
+        # renames the constraint's index too
+        conn.execute(text(f"ALTER TABLE chunk_embeddings RENAME CONSTRAINT {new}_pkey TO chunk_embeddings_pkey"))
+        conn.execute(text(f"ALTER INDEX {new}_document_id RENAME TO ix_chunk_embeddings_document_id"))
+        conn.execute(text(f"ALTER INDEX {new}_tenant_id RENAME TO ix_chunk_embeddings_tenant_id"))
+        if info is not None:
+            conn.execute(text(f"ALTER INDEX {new}_embedding RENAME TO {INDEX_NAME}"))
+    logger.info("Partitioned chunk_embeddings: %d rows", rows)
+    return rows
+
+
+def shard_stats(conn: Connection) -> list[dict]:
+    # per partition: planner row estimate and the size of its piece of the ANN index
+    from app.db.indexes import INDEX_NAME
+
+    rows = conn.execute(
+        text(
+            """
+            SELECT t.relid::regclass::text, pg_get_expr(c.relpartbound, c.oid), greatest(c.reltuples, 0)::bigint,
+                   (SELECT coalesce(sum(pg_relation_size(x.relid)), 0)
+                    FROM pg_partition_tree(to_regclass(:index)) x JOIN pg_index i ON i.indexrelid = x.relid
+                    WHERE i.indrelid = t.relid)
+            FROM pg_partition_tree('chunk_embeddings') t JOIN pg_class c ON c.oid = t.relid
+            WHERE t.isleaf
+            ORDER BY 1
+            """
+        ),
+        {"index": INDEX_NAME},
+    ).all()
+    return [{"partition": name, "bound": bound, "rows": n, "ann_index_bytes": size} for name, bound, n, size in rows]
+
+
+def list_tenants(conn: Connection) -> list[dict]:
+    rows = conn.execute(text("SELECT tenant_id, shard, moving_to FROM tenants ORDER BY tenant_id")).all()
+    return [{"tenant_id": t, "shard": s, "moving_to": m} for t, s, m in rows]
+
+
+def main() -> None:
+    from app.core.logging import setup_logging
+    from app.db.base import engine
+
+    setup_logging()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("show")
+    add = sub.add_parser("add-shard")
+    add.add_argument("shard", type=int)
+    move = sub.add_parser("move")
+    move.add_argument("tenant")
+    move.add_argument("--to", type=int, required=True, dest="shard")
+    move.add_argument("--batch-rows", type=int, help="default TENANT_MOVE_BATCH_ROWS")
+    sub.add_parser("partition")
+    args = parser.parse_args()
+    if args.cmd == "show":
+        with engine.connect() as conn:
+            print(json.dumps({
+                "partitioned": is_partitioned(conn), "shards": shard_stats(conn), "tenants": list_tenants(conn),
+            }))
+    elif args.cmd == "add-shard":
+        with engine.begin() as conn:
+            add_shard(conn, args.shard)
+        print(json.dumps({"shard": args.shard, "partition": partition_name(args.shard)}))
+    elif args.cmd == "move":
+        moved = move_tenant(engine, args.tenant, args.shard, args.batch_rows)
+        print(json.dumps({"tenant_id": args.tenant, "shard": args.shard, "rows_moved": moved}))
+    else:
+        print(json.dumps({"rows_copied": partition_table(engine)}))
+
+
+if __name__ == "__main__":
+    main()
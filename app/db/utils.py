@@ -1,17 +1,55 @@
-from typing import Iterable, Sequence
-from sqlalchemy.engine import Connection
-from sqlalchemy import text
-
-
-def insert_embeddings(conn: Connection, rows: Iterable[tuple[str, Sequence[float]]]) -> None:
-    # rows: (chunk_id, embedding_vector)
-    conn.execute(
-        text("DELETE FROM chunk_embeddings WHERE chunk_id = ANY(:ids)"),
-        {"ids": [r[0] for r in rows]},
-    )
-    conn.execute(
-        text("INSERT INTO chunk_embeddings (chunk_id, embedding) VALUES " +
-             ", ".join([f"(:id{i}, :emb{i})" for i, _ in enumerate(rows)])),
-        {**{f"id{i}": r[0] for i, r in enumerate(rows)},
-         **{f"emb{i}": r[1] for i, r in enumerate(rows)}},
-    )
+from typing import Iterable, Optional, Sequence
+from uuid import UUID
+
+from psycopg.types import TypeInfo
+from sqlalchemy.orm import Session
+
+# vector's oid, fetched once per process (the extension is created before any ingest)
+_vector_info: Optional[TypeInfo] = None
+
+_COPY_COLUMNS = "chunk_id, document_id, tenant_id, shard, embedding"
+
+
+def _copy_cursor(db: Session):
+    # a cursor on the session's own connection, so the COPY joins the session's transaction;
+    # pgvector's dumpers go on the cursor only, leaving how the ORM reads vectors untouched
+    from pgvector.psycopg.vector import register_vector_info  # pulls in numpy
+
+    global _vector_info
+    raw = db.connection().connection.driver_connection
+    cur = raw.cursor()
+    if _vector_info is None:
+        _vector_info = TypeInfo.fetch(raw, "vector")
+    register_vector_info(cur, _vector_info)
+    return cur
+
+
+def copy_embeddings(
+    db: Session, rows: Iterable[tuple[UUID, Optional[UUID], str, int, Sequence[float]]], upsert: bool = False
+) -> int:
+    """Write (chunk_id, document_id, tenant_id, shard, vector) rows with one binary COPY; the caller commits.
+
+    Vectors go over the wire as pgvector's binary format (4 bytes per dimension) instead of
+    float text, in a single streamed statement whatever the row count; COPY into the partitioned
+    table routes each row to its shard. With `upsert`, rows are copied into a transaction-local
+    staging table and replace the existing embeddings of those chunks, wherever they live.
+    """
+    with _copy_cursor(db) as cur:
+        target = "chunk_embeddings"
+        if upsert:
+            target = "chunk_embeddings_staging"
+            cur.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {target} (LIKE chunk_embeddings INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            )
+        n = 0
+        with cur.copy(f"COPY {target} ({_COPY_COLUMNS}) FROM STDIN (FORMAT BINARY)") as copy:
+            copy.set_types(["uuid", "uuid", "varchar", "int2", "vector"])
+            for row in rows:
+                copy.write_row(row)
+                n += 1
+        if upsert:
+            # the primary key includes the shard, so ON CONFLICT (chunk_id) has no index to arbitrate on
+            cur.execute(f"DELETE FROM chunk_embeddings ce USING {target} s WHERE ce.chunk_id = s.chunk_id")
+            cur.execute(f"INSERT INTO chunk_embeddings ({_COPY_COLUMNS}) SELECT {_COPY_COLUMNS} FROM {target}")
+            cur.execute(f"TRUNCATE {target}")
+        return n
@@ -0,0 +1,305 @@
+"""Bulk ingest: one job, many documents, in two fan-out stages.
+
+Stage 1 (groups of BULK_PARSE_GROUP documents) parses and chunks, storing chunks without
+embeddings. Stage 2 cuts all of the job's pending chunks into ranges of BULK_EMBED_BATCH_SIZE,
+regardless of which document they belong to, so every embedding call is a full batch. The worker
+chains the stages with Celery chords; run_job_sync runs the same steps in-process.
+"""
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import BinaryIO, Optional
+from uuid import UUID, uuid4
+import logging
+import mimetypes
+import os
+import shutil
+import tarfile
+import zipfile
+
+from sqlalchemy import func
+
+from app.core.config import settings
+from app.core.metrics import INGEST_STAGE_SECONDS
+from app.db.base import SessionLocal
+from app.db.tenants import DEFAULT_TENANT
+from app.db.repositories import (
+    chunk_range_bounds, chunks_in_range, create_ingest_job, finish_job_documents, get_document, ingest_job_counts,
+    job_document_ids, set_document_status, set_ingest_job, store_parsed_document, write_embeddings,
+)
+from app.ingestion.parsers import detect_kind, parse_file, spool_to_disk
+from app.ingestion.tasks import batched, chunk_pages
+from app.rag.chunker import iter_chunks
+from app.rag.embedding_cache import content_hash
+from app.rag.embeddings import embed_texts
+from app.rag.telemetry import StageTimer
+
+logger = logging.getLogger(__name__)
+
+
+# --- job sources ---
+
+def _inside(path: str, root: str) -> bool:
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def allowed_roots() -> list[str]:
+    return [os.path.realpath(r.strip()) for r in settings.BULK_INGEST_ALLOWED_ROOTS.split(",") if r.strip()]
+
+
+def collect_paths(paths: list[str]) -> list[str]:
+    # Files under the given server-local files/directories; everything must resolve inside an allowed root.
+    roots = allowed_roots()
+    if not roots:
+        raise ValueError("path ingest is disabled (BULK_INGEST_ALLOWED_ROOTS is empty)")
+    files: list[str] = []
+    for path in paths:
+        real = os.path.realpath(path)
+        if not any(_inside(real, root) for root in roots):
+            raise ValueError(f"path outside BULK_INGEST_ALLOWED_ROOTS: {path}")
+        if os.path.isfile(real):
+            files.append(real)
+        elif os.path.isdir(real):
+            for dirpath, dirnames, filenames in os.walk(real):
+                dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+                for name in sorted(filenames):
+                    # symlinked files are followed only if they stay inside a root
+                    target = os.path.realpath(os.path.join(dirpath, name))
+                    if not name.startswith(".") and os.path.isfile(target) and any(_inside(target, r) for r in roots):
+                        files.append(target)
+        else:
+            raise ValueError(f"no such file or directory: {path}")
+    return files
+
+
+def job_dir(job_id: str) -> str:
+    return os.path.join(settings.BULK_INGEST_DIR, str(job_id))
+
+
+def _member_target(dest: str, name: str) -> str:
+    target = os.path.realpath(os.path.join(dest, name))
+    if not _inside(target, dest) or target == dest:
+        raise ValueError(f"unsafe archive member: {name}")
+    return target
+
+
+def _too_large() -> ValueError:
+    return ValueError(f"archive unpacks to more than {settings.BULK_ARCHIVE_MAX_BYTES} bytes")
+
+
+def _copy_member(src: BinaryIO, target: str, limit: int) -> int:
+    # copies at most `limit` bytes; the sizes in archive headers are not trusted
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    written = 0
+    with open(target, "wb") as dst:
+        while block := src.read(1 << 20):
+            written += len(block)
+            if written > limit:
+                raise _too_large()
+            dst.write(block)
+    return written
+
+
+@contextmanager
+def _bad_archive(*errors: type[Exception]) -> Iterator[None]:
+    # corrupt or forged archives (e.g. sizes that don't match the data) are the caller's ValueError
+    try:
+        yield
+    except errors as e:
+        raise ValueError(f"bad archive: {e}") from e
+
+
+def _check_members(count: int) -> None:
+    if count > settings.BULK_ARCHIVE_MAX_MEMBERS:
+        raise ValueError(f"archive has more than {settings.BULK_ARCHIVE_MAX_MEMBERS} members")
+
+
+def extract_archive(archive: str, dest: str) -> list[str]:
+    # Regular files only; links, devices and members escaping `dest` are skipped or rejected.
+    # Over BULK_ARCHIVE_MAX_MEMBERS entries or BULK_ARCHIVE_MAX_BYTES unpacked: ValueError.
+    dest = os.path.realpath(dest)
+    files: list[str] = []
+    budget = settings.BULK_ARCHIVE_MAX_BYTES
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf, _bad_archive(zipfile.BadZipFile):
+            infos = zf.infolist()
+            # the central directory gives both up front
+            _check_members(len(infos))
+            if sum(info.file_size for info in infos) > budget:
+                raise _too_large()
+            for info in infos:
+                if info.is_dir():
+                    continue
+                target = _member_target(dest, info.filename)
+                with zf.open(info) as src:
+                    budget -= _copy_member(src, target, budget)
+                files.append(target)
+    elif tarfile.is_tarfile(archive):
+        with tarfile.open(archive) as tf, _bad_archive(tarfile.TarError):
+            # a (compressed) tar has no index: headers are checked as the stream reaches them
+            for count, member in enumerate(tf, 1):
+                _check_members(count)
+                if not member.isfile():
+                    continue
+                if member.size > budget:
+                    raise _too_large()
+                target = _member_target(dest, member.name)
+                with tf.extractfile(member) as src:
+                    budget -= _copy_member(src, target, budget)
+                files.append(target)
+    else:
+        raise ValueError("unsupported archive: expected zip or tar")
+    return sorted(f for f in files if not os.path.basename(f).startswith("."))
+
+
+def unpack_upload(src: BinaryIO, job_id: UUID) -> list[str]:
+    # spool the upload, unpack it into the job's directory (shared with the workers), drop the archive
+    dest = job_dir(str(job_id))
+    os.makedirs(dest, exist_ok=True)
+    archive = spool_to_disk(src)
+    try:
+        files = extract_archive(archive, dest)
+        if not files:
+            shutil.rmtree(dest, ignore_errors=True)
+        return files
+    except BaseException:
+        shutil.rmtree(dest, ignore_errors=True)
+        raise
+    finally:
+        os.unlink(archive)
+
+
+def create_job(
+    source: str, files: list[str], job_id: Optional[UUID] = None, root: Optional[str] = None, tenant: str = DEFAULT_TENANT
+) -> str:
+    # filenames are relative to `root` (the unpacked archive) when given
+    job_id = job_id or uuid4()
+    rows = [
+        (path, os.path.relpath(path, root) if root else os.path.basename(path), mimetypes.guess_type(path)[0] or "")
+        for path in files
+    ]
+    with SessionLocal() as db:
+        create_ingest_job(db, job_id, source, rows, tenant)
+    return str(job_id)
+
+
+# --- stages ---
+
+def start_job(job_id: str) -> list[str]:
+    with SessionLocal() as db:
+        set_ingest_job(db, job_id, status="running", started_at=func.now())
+        return job_document_ids(db, job_id, "queued")
+
+
+def _parse_and_chunk_one(db, document_id: str, timer: StageTimer) -> int:
+    doc = get_document(db, document_id)
+    if doc is None or doc.status != "queued":  # redelivered task
+        return 0
+    meta = dict(doc.metadata or {})
+    with timer.stage("parse"):
+        parsed = parse_file(meta["source_path"], doc.filename, doc.mime_type)
+    if not parsed.text.strip():
+        set_document_status(db, document_id, "failed")
+        return 0
+    meta.update(
+        parser=detect_kind(doc.filename, doc.mime_type),
+        pages=len(parsed.page_offsets) or None,
+        page_offsets=parsed.page_offsets or None,
+    )
+    with timer.stage("chunk"):
+        chunks = [
+            (idx, chunk.text, content_hash(chunk.text), chunk.token_count, chunk_pages(chunk, parsed.page_offsets))
+            for idx, chunk in enumerate(iter_chunks([parsed.text]))
+        ]
+    with timer.stage("write"):
+        store_parsed_document(db, document_id, parsed.text, meta, chunks, doc.tenant_id)
+    return len(chunks)
+
+
+def parse_and_chunk(document_ids: list[str]) -> int:
+    # never raises: a bad file fails its document, not the group (nor the chord waiting on it)
+    total = 0
+    timer = StageTimer(INGEST_STAGE_SECONDS, path="bulk_parse")
+    with SessionLocal() as db:
+        for document_id in document_ids:
+            try:
+                total += _parse_and_chunk_one(db, document_id, timer)
+            except Exception:
+                logger.exception("Bulk parse failed for document %s", document_id)
+                db.rollback()
+                set_document_status(db, document_id, "failed")
+    timer.finish()
+    logger.info("Parsed %d documents into %d chunks; stage ms %s", len(document_ids), total, timer.ms())
+    return total
+
+
+def embed_ranges(job_id: str) -> list[tuple[str, Optional[str]]]:
+    # [lo, hi) chunk-id ranges of BULK_EMBED_BATCH_SIZE pending chunks each; the last one is open-ended
+    with SessionLocal() as db:
+        bounds = chunk_range_bounds(db, job_id, settings.BULK_EMBED_BATCH_SIZE)
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def embed_chunk_range(job_id: str, lo: str, hi: Optional[str]) -> int:
+    # embed + write in one step: vectors never travel through the broker
+    timer = StageTimer(INGEST_STAGE_SECONDS, path="bulk_embed")
+    with SessionLocal() as db:
+        with timer.stage("read"):
+            rows = chunks_in_range(db, job_id, lo, hi)
+        if not rows:
+            return 0
+        parts = list(batched([content for _, _, content in rows], settings.EMBED_BATCH_SIZE))
+        with timer.stage("embed"), ThreadPoolExecutor(max_workers=settings.EMBED_CONCURRENCY) as pool:
+            vectors = [v for part in pool.map(embed_texts, parts) for v in part]
+        with timer.stage("write"):
+            write_embeddings(db, [(chunk_id, doc_id) for chunk_id, doc_id, _ in rows], vectors)
+    timer.finish()
+    logger.info("Embedded %d chunks of job %s; stage ms %s", len(rows), job_id, timer.ms())
+    return len(rows)
+
+
+def finish_job(job_id: str, error: Optional[str] = None) -> None:
+    with SessionLocal() as db:
+        finish_job_documents(db, job_id)
+        set_ingest_job(db, job_id, status="failed" if error else "done", error=error, finished_at=func.now())
+    shutil.rmtree(job_dir(job_id), ignore_errors=True)
+    logger.info("Bulk ingest job %s finished%s", job_id, f" with error: {error}" if error else "")
+
+
+def run_job_sync(job_id: str) -> None:
+    # no-Celery fallback: the same stages, one after the other
+    try:
+        for group in batched(start_job(job_id), settings.BULK_PARSE_GROUP):
+            parse_and_chunk(group)
+        for lo, hi in embed_ranges(job_id):
+            embed_chunk_range(job_id, lo, hi)
+    except Exception as e:
+        logger.exception("Bulk ingest job %s failed", job_id)
+        finish_job(job_id, error=str(e))
+        return
+    finish_job(job_id)
+
+
+def enqueue_bulk_job(job_id: str) -> None:
+    from app.ingestion.celery_app import celery_app
+
+    celery_app.send_task("bulk_ingest_job", args=[job_id], queue="bulk")
+
+
+def job_progress(db, job) -> dict:
+    counts = ingest_job_counts(db, str(job.id))
+    docs = counts["documents"]
+    finished = docs.get("ready", 0) + docs.get("failed", 0)
+    end = job.finished_at or db.scalar(func.now().select())
+    elapsed = (end - job.started_at).total_seconds() if job.started_at else 0.0
+    return {
+        "job_id": str(job.id),
+        "status": job.status,
+        "source": job.source,
+        "total_documents": job.total_documents,
+        "documents": docs,
+        "chunks_embedded": counts["chunks_embedded"],
+        "elapsed_s": round(elapsed, 1),
+        "docs_per_min": round(finished / elapsed * 60, 1) if elapsed > 0 else None,
+        "error": job.error,
+    }
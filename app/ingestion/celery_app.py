@@ -0,0 +1,36 @@
+from celery import Celery
+from celery.signals import worker_process_init
+from app.core.config import settings
+
+# One Celery app per process: producers (the API) reuse its broker connection pool for every
+# send_task; the worker registers its tasks on it in app.ingestion.worker.
+celery_app = Celery("ai_docs_assistant", broker=settings.REDIS_URL, backend=settings.REDIS_URL)
+celery_app.conf.update(
+    task_default_queue="default",
+    # bulk jobs get their own queue so a 50k-document job can't starve single uploads
+    task_routes={"bulk_*": {"queue": "bulk"}},
+    worker_concurrency=settings.CELERY_CONCURRENCY,
+    # tasks are long and uneven: take one at a time, ack when done so a lost worker's task is redelivered
+    worker_prefetch_multiplier=settings.CELERY_PREFETCH_MULTIPLIER,
+    task_acks_late=True,
+    worker_max_tasks_per_child=settings.CELERY_MAX_TASKS_PER_CHILD,
+    broker_pool_limit=settings.CELERY_BROKER_POOL_LIMIT,
+)
+
+
+def broker_pool_stats() -> dict:
+    # the producer pool only exists once something was sent; kombu keeps its counters private
+    pool = celery_app._pool
+    stats = {"limit": settings.CELERY_BROKER_POOL_LIMIT, "created": pool is not None}
+    if pool is not None:
+        stats["in_use"] = len(getattr(pool, "_dirty", ()))
+    return stats
+
+
+@worker_process_init.connect
+def _reset_db_pools(**_) -> None:
+    # prefork children inherit the parent's pooled sockets; drop them without closing the parent's
+    from app.db.base import async_engine, engine
+
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
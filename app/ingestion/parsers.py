@@ -1,22 +1,260 @@
-from typing import Tuple, Dict, Any
-from pypdf import PdfReader
-import io
+"""Upload parsing. Parsers run in a process pool (PDFs split into page ranges) over a spooled
+copy of the upload, read through mmap, so the API event loop never parses."""
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Any, BinaryIO, Callable, NamedTuple, Optional
+import asyncio
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
 
+from app.core.config import settings
 
-def extract_text_from_pdf(data: bytes) -> str:
-    reader = PdfReader(io.BytesIO(data))
-    texts = []
-    for page in reader.pages:
-        texts.append(page.extract_text() or "")
-    return "\n".join(texts)
+_SPOOL_COPY_BYTES = 1 << 20
 
 
-def extract_text_from_upload(raw: bytes, filename: str, mime_type: str | None) -> Tuple[str, Dict[str, Any]]:
-    meta = {"filename": filename, "mime_type": mime_type}
-    if mime_type and "pdf" in mime_type.lower():
-        return extract_text_from_pdf(raw), meta
-    # Fallback: treat as utf-8 text
+class ParsedDocument(NamedTuple):
+    text: str
+    # character offset where each page starts in `text`; empty for unpaged formats
+    page_offsets: list[int]
+
+
+class _Parser(NamedTuple):
+    parse: Callable[[str], ParsedDocument]
+    mime_types: tuple[str, ...]
+    extensions: tuple[str, ...]
+
+
+PARSERS: dict[str, _Parser] = {}
+
+
+def register_parser(kind: str, mime_types: tuple[str, ...] = (), extensions: tuple[str, ...] = ()):
+    def decorator(fn: Callable[[str], ParsedDocument]) -> Callable[[str], ParsedDocument]:
+        PARSERS[kind] = _Parser(fn, mime_types, extensions)
+        return fn
+
+    return decorator
+
+
+def detect_kind(filename: Optional[str], mime_type: Optional[str]) -> str:
+    # the declared MIME type wins; browsers send application/octet-stream for much, so fall back to the extension
+    mime = (mime_type or "").split(";")[0].strip().lower()
+    for kind, parser in PARSERS.items():
+        if mime in parser.mime_types:
+            return kind
+    ext = os.path.splitext(filename or "")[1].lower()
+    for kind, parser in PARSERS.items():
+        if ext in parser.extensions:
+            return kind
+    return "text"
+
+
+def _join_pages(pages: list[str]) -> ParsedDocument:
+    offsets, pos = [], 0
+    for page in pages:
+        offsets.append(pos)
+        pos += len(page) + 1
+    return ParsedDocument("\n".join(pages), offsets)
+
+
+def _read_mapped(path: str, errors: str = "strict") -> str:
+    # decodes straight from the mapping: no intermediate bytes copy of the file
+    if os.path.getsize(path) == 0:  # mmap of an empty file is an error
+        return ""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+        return str(view, "utf-8", errors)
+
+
+# --- PDF ---
+
+def pdf_page_count(path: str) -> int:
+    from pypdf import PdfReader
+
+    if os.path.getsize(path) == 0:
+        return 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return len(PdfReader(mm).pages)
+
+
+def extract_pdf_pages(path: str, start: int, end: int) -> list[str]:
+    # pages [start, end); each pool task maps the file itself, nothing is pickled but text
+    from pypdf import PdfReader
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        reader = PdfReader(mm)
+        return [reader.pages[i].extract_text() or "" for i in range(start, min(end, len(reader.pages)))]
+
+
+@register_parser("pdf", ("application/pdf", "application/x-pdf"), (".pdf",))
+def parse_pdf(path: str) -> ParsedDocument:
+    return _join_pages(extract_pdf_pages(path, 0, pdf_page_count(path)))
+
+
+# --- HTML ---
+
+class _HTMLText(HTMLParser):
+    _SKIP = {"script", "style", "noscript", "template", "svg", "head"}
+    _BLOCK = {
+        "p", "div", "section", "article", "header", "footer", "main", "aside", "nav", "li", "ul", "ol", "table",
+        "tr", "br", "hr", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "dd", "dt", "figcaption",
+    }
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self._skip = 0
+
+    def handle_starttag(self, tag: str, attrs: Any) -> None:
+        if tag in self._SKIP:
+            self._skip += 1
+        elif tag in self._BLOCK:
+            self.parts.append("\n\n")
+        elif tag in ("td", "th"):
+            self.parts.append(" ")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in self._SKIP:
+            self._skip = max(0, self._skip - 1)
+        elif tag in self._BLOCK:
+            self.parts.append("\n\n")
+
+    def handle_data(self, data: str) -> None:
+        if not self._skip:
+            self.parts.append(data)
+
+
+_BLANK_LINES_RE = re.compile(r"\n\s*\n\s*")
+_SPACES_RE = re.compile(r"[ \t\r\f\v]+")
+
+
+def _tidy(text: str) -> str:
+    return _BLANK_LINES_RE.sub("\n\n", _SPACES_RE.sub(" ", text)).strip()
+
+
+@register_parser("html", ("text/html", "application/xhtml+xml"), (".html", ".htm", ".xhtml"))
+def parse_html(path: str) -> ParsedDocument:
+    parser = _HTMLText()
+    parser.feed(_read_mapped(path, errors="replace"))
+    parser.close()
+    return ParsedDocument(_tidy("".join(parser.parts)), [])
+
+
+# --- Markdown ---
+
+# Line prefixes match [ \t] only, never newlines: blank lines keep paragraphs apart.
+_MD_RULES = [
+    (re.compile(r"^```[^\n]*$", re.M), ""),  # fences; the code itself stays
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),  # images -> alt text
+    (re.compile(r"\[([^\]]+)\]\([^)]*\)"), r"\1"),  # links -> label
+    (re.compile(r"^[ \t]{0,3}#{1,6}[ \t]+", re.M), ""),  # headings
+    (re.compile(r"^[ \t]{0,3}>[ \t]?", re.M), ""),  # blockquotes
+    (re.compile(r"^[ \t]*([-*_][ \t]*){3,}$", re.M), ""),  # horizontal rules, before "- - -" reads as a list
+    (re.compile(r"^[ \t]*([-*+]|\d+[.)])[ \t]+", re.M), ""),  # list markers
+    # emphasis and inline code only at word boundaries: ERR_CONN_RESET keeps its underscores
+    (re.compile(r"(?<!\w)(\*\*|__|\*|_|~~|`)(?=\S)(.+?)(?<=\S)\1(?!\w)"), r"\2"),
+    (re.compile(r"<!--.*?-->", re.S), ""),  # HTML comments
+    # real tags only (attributes as name=value), so "a<b and c>d" stays text
+    (re.compile(r"</?[A-Za-z][\w-]*(?:\s+[\w:.-]+\s*=\s*(?:\"[^\"]*\"|'[^']*'|[^\s\"'<>=`]+))*\s*/?>"), ""),
+]
+
+
+@register_parser("markdown", ("text/markdown", "text/x-markdown"), (".md", ".markdown"))
+def parse_markdown(path: str) -> ParsedDocument:
+    text = _read_mapped(path, errors="replace")
+    for pattern, repl in _MD_RULES:
+        text = pattern.sub(repl, text)
+    return ParsedDocument(text.strip(), [])
+
+
+# --- DOCX ---
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+@register_parser(
+    "docx",
+    ("application/vnd.openxmlformats-officedocument.wordprocessingml.document",),
+    (".docx",),
+)
+def parse_docx(path: str) -> ParsedDocument:
+    # Paragraph text from word/document.xml; explicit page breaks start a new page.
+    # zipfile needs a real file object (mmap has no seekable()); it reads members lazily anyway.
+    import zipfile
+    from xml.etree import ElementTree
+
+    with zipfile.ZipFile(path) as zf, zf.open("word/document.xml") as xml:
+        pages: list[list[str]] = [[]]
+        for _, el in ElementTree.iterparse(xml, events=("end",)):
+            if el.tag != f"{_W}p":
+                continue
+            parts = []
+            for node in el.iter():
+                if node.tag == f"{_W}t" and node.text:
+                    parts.append(node.text)
+                elif node.tag == f"{_W}tab":
+                    parts.append("\t")
+                elif node.tag == f"{_W}br":
+                    if node.get(f"{_W}type") == "page":
+                        pages[-1].append("".join(parts))
+                        pages.append([])
+                        parts = []
+                    else:
+                        parts.append("\n")
+            pages[-1].append("".join(parts))
+            el.clear()
+    texts = ["\n\n".join(p for p in page if p.strip()) for page in pages]
+    if len(texts) == 1:
+        return ParsedDocument(texts[0], [])
+    return _join_pages(texts)
+
+
+# --- plain text ---
+
+@register_parser("text", ("text/plain",), (".txt", ".text", ".log", ".csv"))
+def parse_text(path: str) -> ParsedDocument:
+    # unknown binary formats end up here too; undecodable content yields no text
+    try:
+        return ParsedDocument(_read_mapped(path), [])
+    except UnicodeDecodeError:
+        return ParsedDocument("", [])
+
+
+def parse_file(path: str, filename: Optional[str], mime_type: Optional[str]) -> ParsedDocument:
+    # in-process, whole file: for the pool workers, scripts and benchmarks
+    return PARSERS[detect_kind(filename, mime_type)].parse(path)
+
+
+@lru_cache(maxsize=1)
+def get_parse_pool() -> ProcessPoolExecutor:
+    # spawn: forking a process that runs an event loop and DB pools is not safe
+    return ProcessPoolExecutor(max_workers=settings.PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+async def aparse_file(path: str, filename: Optional[str], mime_type: Optional[str]) -> ParsedDocument:
+    loop = asyncio.get_running_loop()
+    pool = get_parse_pool()
+    kind = detect_kind(filename, mime_type)
+    if kind != "pdf":
+        return await loop.run_in_executor(pool, PARSERS[kind].parse, path)
+    pages = await loop.run_in_executor(pool, pdf_page_count, path)
+    step = settings.PARSE_PAGES_PER_TASK
+    ranges = await asyncio.gather(
+        *(loop.run_in_executor(pool, extract_pdf_pages, path, start, start + step) for start in range(0, pages, step))
+    )
+    return _join_pages([page for texts in ranges for page in texts])
+
+
+def spool_to_disk(src: BinaryIO) -> str:
+    # Copies an upload to a named temp file in fixed-size blocks; the caller removes it.
+    fd, path = tempfile.mkstemp(prefix="upload-", dir=settings.UPLOAD_SPOOL_DIR)
     try:
-        return raw.decode("utf-8"), meta
-    except Exception:
-        return "", meta
+        with os.fdopen(fd, "wb") as dst:
+            shutil.copyfileobj(src, dst, _SPOOL_COPY_BYTES)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
@@ -1,49 +1,146 @@
 from app.core.config import settings
-from app.db.base import SessionLocal, engine
-from app.db.repositories import set_document_status, upsert_chunks, list_chunk_texts, fetch_chunks_for_embedding
-from app.rag.chunker import chunk_text
+from app.core.metrics import INGEST_STAGE_SECONDS
+from app.db.base import SessionLocal
+from app.db.repositories import (
+    set_document_status, iter_document_text, load_chunk_hashes, reset_ingest_progress, write_chunk_batch, delete_chunks,
+    add_ingest_progress, get_document,
+)
+from app.rag.chunker import Chunk, iter_chunks
+from app.rag.embedding_cache import content_hash
 from app.rag.embeddings import embed_texts
-from sqlalchemy import text
+from app.rag.telemetry import StageTimer
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator
+from uuid import UUID
 import logging
 
 logger = logging.getLogger(__name__)
 
+
 # Public API for router
 def enqueue_ingest_document(document_id: str) -> None:
-    # If worker is up, send Celery task; otherwise raise to allow sync fallback
-    try:
-        from app.ingestion.worker import celery_app
-        celery_app.send_task("ingest_document", args=[document_id], queue="default")
-    except Exception as e:
-        raise e
+    # If worker is up, send Celery task; otherwise raise to allow sync fallback.
+    # Celery is imported on the first enqueue, not at API startup.
+    from app.ingestion.celery_app import celery_app
+
+    celery_app.send_task("ingest_document", args=[document_id], queue="default")
+
+
+def batched[T](items: Iterable[T], size: int) -> Iterator[list[T]]:
+    it = iter(items)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def chunk_pages(chunk: Chunk, page_offsets: list[int]) -> dict | None:
+    # 1-based first/last page of the chunk's source span, for paged formats
+    if not page_offsets:
+        return None
+    first = bisect_right(page_offsets, chunk.start)
+    last = bisect_right(page_offsets, max(chunk.start, chunk.end - 1))
+    return {"page": first, "page_end": last}
+
+
+class ChunkDiff:
+    # Matches re-chunked text against the stored chunks by content hash.
+    def __init__(
+        self,
+        existing: dict[str, list[tuple[UUID, int, int | None, dict | None]]],
+        page_offsets: list[int] | None = None,
+    ):
+        self.existing = existing
+        self.page_offsets = page_offsets or []
+        self.kept = 0
+
+    def classify(
+        self, batch: list[tuple[int, Chunk]]
+    ) -> tuple[list[tuple[int, str, str, int, dict | None]], list[tuple[UUID, int, int, dict | None]]]:
+        fresh: list[tuple[int, str, str, int, dict | None]] = []
+        updated: list[tuple[UUID, int, int, dict | None]] = []
+        for idx, chunk in batch:
+            h = content_hash(chunk.text)
+            meta = chunk_pages(chunk, self.page_offsets)
+            matches = self.existing.get(h)
+            if matches:
+                chunk_id, *stored = matches.pop()
+                self.kept += 1
+                # same text, but its position, pages or token count (tokenizer change) may differ
+                if stored != [idx, chunk.token_count, meta]:
+                    updated.append((chunk_id, idx, chunk.token_count, meta))
+            else:
+                fresh.append((idx, chunk.text, h, chunk.token_count, meta))
+        return fresh, updated
+
+    def stale_ids(self) -> list[UUID]:
+        return [match[0] for matches in self.existing.values() for match in matches]
 
 
 def ingest_document_sync(document_id: str) -> None:
+    # text pieces -> lazy chunks -> diff against stored hashes -> embed only new chunks in
+    # fixed-size batches (bounded window) -> one write per batch -> drop chunks that disappeared.
+    # At most EMBED_CONCURRENCY + 1 batches are held in memory at any time.
+    # The text cursor, the writes and the deletes share one transaction, so searches see the old
+    # chunk set until the new one replaces it whole, and a failure leaves the old set alone. Progress
+    # is committed from a second session as batches land (its row lock doesn't conflict with the
+    # inserts' FK checks). The cursor is closed before anything on `db` commits or rolls back.
     logger.info("Running sync ingest for document %s", document_id)
-    with SessionLocal() as db:
+    timer = StageTimer(INGEST_STAGE_SECONDS, path="document")
+    with SessionLocal() as db, SessionLocal() as progress:
         set_document_status(db, document_id, "processing")
-        # 1) read extracted text
-        rows = db.execute(text("SELECT extracted_text FROM document_texts WHERE document_id = :id"), {"id": document_id}).all()
-        if not rows or not rows[0][0]:
+        pieces = iter_document_text(db, document_id, settings.INGEST_READ_CHARS)
+        try:
+            first = next(pieces, None)
+            if not first:
+                pieces.close()
+                set_document_status(db, document_id, "failed")
+                return
+            doc = get_document(db, document_id)
+            page_offsets = (doc.metadata or {}).get("page_offsets") or []
+            diff = ChunkDiff(load_chunk_hashes(db, document_id), page_offsets)
+            reset_ingest_progress(progress, document_id)
+
+            def all_pieces() -> Iterator[str]:
+                yield first
+                yield from pieces
+
+            # read+chunk is timed as it is pulled; embed runs in the pool, so it can exceed wall time
+            batches = timer.iterate("chunk", batched(enumerate(iter_chunks(all_pieces())), settings.EMBED_BATCH_SIZE))
+            embed = timer.timed("embed", embed_texts)
+            window: deque = deque()
+            inserted = 0
+            with ThreadPoolExecutor(max_workers=settings.EMBED_CONCURRENCY) as pool:
+                for batch in batches:
+                    fresh, updated = diff.classify(batch)
+                    future = pool.submit(embed, [f[1] for f in fresh]) if fresh else None
+                    window.append((fresh, updated, len(batch), future))
+                    if len(window) >= settings.EMBED_CONCURRENCY:
+                        inserted += _write_batch(db, progress, document_id, timer, *window.popleft())
+                while window:
+                    inserted += _write_batch(db, progress, document_id, timer, *window.popleft())
+            stale = diff.stale_ids()
+            with timer.stage("write"):
+                delete_chunks(db, stale)
+                db.commit()
+        except Exception:
+            pieces.close()
+            db.rollback()
             set_document_status(db, document_id, "failed")
-            return
-        text_body = rows[0][0]
-        # 2) chunk
-        chunks = chunk_text(text_body)
-        chunk_tuples = [(i, c) for i, c in enumerate(chunks)]
-        upsert_chunks(db, document_id, chunk_tuples)
-        # 3) embed
-        chunk_rows = fetch_chunks_for_embedding(db, document_id)
-        vectors = embed_texts([c.content for c in chunk_rows])
-        pairs = [(str(c.id), vec) for c, vec in zip(chunk_rows, vectors)]
-        with engine.begin() as conn:
-            # Bulk insert embeddings
-            # Use simple multi-values approach
-            conn.exec_driver_sql("DELETE FROM chunk_embeddings WHERE chunk_id = ANY(%s)", ([p[0] for p in pairs],))
-            # Build values
-            values_sql = ", ".join(["(%s, %s)"] * len(pairs))
-            params = []
-            for cid, vec in pairs:
-                params.extend([cid, vec])
-            conn.exec_driver_sql("INSERT INTO chunk_embeddings (chunk_id, embedding) VALUES " + values_sql, params)
+            raise
         set_document_status(db, document_id, "ready")
+        timer.finish()
+        logger.info(
+            "Ingested document %s: %d kept, %d inserted, %d deleted; stage ms %s",
+            document_id, diff.kept, inserted, len(stale), timer.ms(),
+        )
+
+
+def _write_batch(db, progress, document_id: str, timer: StageTimer, fresh, updated, seen: int, future) -> int:
+    with timer.stage("embed_wait"):
+        vectors = future.result() if future is not None else []
+    with timer.stage("write"):
+        write_chunk_batch(db, document_id, fresh, vectors, updated)
+    add_ingest_progress(progress, document_id, seen)
+    return len(fresh)
@@ -1,16 +1,11 @@
-from celery import Celery
+from celery import chord, group
 from app.core.config import settings
-from app.ingestion.tasks import ingest_document_sync
+from app.ingestion.celery_app import celery_app
+from app.ingestion.tasks import batched, ingest_document_sync
 import logging
 
 logger = logging.getLogger(__name__)
 
-celery_app = Celery("ai_docs_assistant", broker=settings.REDIS_URL, backend=settings.REDIS_URL)
-celery_app.conf.update(
-    task_default_queue="default",
-    worker_concurrency=settings.CELERY_CONCURRENCY,
-)
-
 
 @celery_app.task(name="ingest_document")
 def ingest_document_task(document_id: str):
@@ -19,3 +14,56 @@ def ingest_document_task(document_id: str):
     except Exception as e:
         logger.exception("Ingest failed for %s: %s", document_id, e)
         raise
+
+
+# Bulk ingest: parse+chunk chord over document groups -> plan embedding ranges -> embed+write chord -> finish
+
+
+@celery_app.task(name="bulk_ingest_job")
+def bulk_ingest_job_task(job_id: str):
+    from app.ingestion.bulk import start_job
+
+    groups = list(batched(start_job(job_id), settings.BULK_PARSE_GROUP))
+    if not groups:
+        bulk_plan_embed_task.delay(job_id)
+        return
+    chord(group(bulk_parse_chunk_task.s(ids) for ids in groups))(bulk_plan_embed_task.si(job_id))
+
+
+@celery_app.task(name="bulk_parse_chunk")
+def bulk_parse_chunk_task(document_ids: list[str]) -> int:
+    from app.ingestion.bulk import parse_and_chunk
+
+    return parse_and_chunk(document_ids)
+
+
+@celery_app.task(name="bulk_plan_embed")
+def bulk_plan_embed_task(job_id: str):
+    from app.ingestion.bulk import embed_ranges
+
+    ranges = embed_ranges(job_id)
+    if not ranges:
+        bulk_finish_task.delay(job_id)
+        return
+    chord(group(bulk_embed_task.s(job_id, lo, hi) for lo, hi in ranges))(bulk_finish_task.si(job_id))
+
+
+@celery_app.task(name="bulk_embed", bind=True, max_retries=3, default_retry_delay=10)
+def bulk_embed_task(self, job_id: str, lo: str, hi: str | None) -> int:
+    from app.ingestion.bulk import embed_chunk_range
+
+    try:
+        return embed_chunk_range(job_id, lo, hi)
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        # give up on the range without failing the chord; finish marks its documents failed
+        logger.exception("Bulk embed failed for job %s range %s..%s", job_id, lo, hi)
+        return 0
+
+
+@celery_app.task(name="bulk_finish")
+def bulk_finish_task(job_id: str):
+    from app.ingestion.bulk import finish_job
+
+    finish_job(job_id)
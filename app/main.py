@@ -1,21 +1,75 @@
+from contextlib import asynccontextmanager
+import asyncio
+import sys
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from app.core.config import settings
+from app.core.http import aclose_http_clients, http_pool_stats
+from app.core.metrics import gauge, render
 from app.core.logging import setup_logging
-from app.db.base import init_engine_and_session, create_all_tables_and_indexes
+from app.db.base import async_engine, db_pool_stats, engine
+from app.db.migrate import migrate
+from app.api.middleware import MetricsMiddleware
 from app.api.routes import api_router
+from app.rag.embeddings import get_embedding_provider
+from app.rag.llm import get_chat_model
+from app.rag.telemetry import get_query_log_writer
 
 setup_logging()
-engine, SessionLocal = init_engine_and_session()
 
-app = FastAPI(title=settings.API_TITLE, version=settings.API_VERSION)
-app.include_router(api_router, prefix="/v1")
+
+def _warm_providers() -> None:
+    get_embedding_provider()
+    get_chat_model()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Process-wide resources: the engines from app.db.base, the shared HTTP clients behind the
+    # model providers and the Celery producer pool. Released on shutdown.
+    # The schema is migrated by `python -m app.db.migrate` before the replicas start.
+    if settings.DB_MIGRATE_ON_STARTUP:
+        await run_in_threadpool(migrate, engine)
+    # LangChain and the provider clients load in the background, so readiness doesn't wait on them
+    warmup = asyncio.create_task(run_in_threadpool(_warm_providers)) if settings.WARM_PROVIDERS_ON_STARTUP else None
+    yield
+    if warmup is not None:
+        await asyncio.gather(warmup, return_exceptions=True)
+    # flush queued query_logs rows before the pools go away
+    await run_in_threadpool(get_query_log_writer().close)
+    await aclose_http_clients()
+    # Celery is only imported once something was enqueued
+    if "app.ingestion.celery_app" in sys.modules:
+        sys.modules["app.ingestion.celery_app"].celery_app.close()
+    await async_engine.dispose()
+    engine.dispose()
 
 
-@app.on_event("startup")
-def on_startup() -> None:
-    create_all_tables_and_indexes(engine)
+app = FastAPI(title=settings.API_TITLE, version=settings.API_VERSION, lifespan=lifespan)
+app.include_router(api_router, prefix="/v1")
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/v1/health")
 def health():
     return {"status": "ok", "env": settings.APP_ENV, "db": "postgres+pgvector"}
+
+
+def _pool_gauges() -> list[str]:
+    db = db_pool_stats()
+    http = http_pool_stats()
+    return [
+        gauge("db_pool_checked_out", "Pooled DB connections in use.", series=[({"engine": k}, v["checked_out"]) for k, v in db.items()]),
+        gauge("db_pool_checked_in", "Idle pooled DB connections.", series=[({"engine": k}, v["checked_in"]) for k, v in db.items()]),
+        gauge("db_pool_overflow", "DB connections beyond pool_size.", series=[({"engine": k}, v["overflow"]) for k, v in db.items()]),
+        gauge("http_pool_connections", "Open provider HTTP connections.", series=[({"client": k}, v["connections"]) for k, v in http.items()]),
+    ]
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # Prometheus text format; per process, like the histograms behind it
+    queued = gauge("query_log_queue_depth", "query_logs rows waiting for the writer.", get_query_log_writer().pending())
+    return PlainTextResponse(render([queued, *_pool_gauges()]), media_type="text/plain; version=0.0.4")
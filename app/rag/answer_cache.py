@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from typing import TYPE_CHECKING
+import hashlib
+import json
+import time
+
+from app.core.config import settings
+from app.db.tenants import DEFAULT_TENANT
+from app.schemas.chat import ChatRequest, ChatResponse
+
+if TYPE_CHECKING:
+    import numpy as np  # imported on first use: keeps it off the API's startup path
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+def params_key(payload: ChatRequest, tenant: str = DEFAULT_TENANT) -> str:
+    # everything but the query text that changes the answer; tenants never share entries
+    params = payload.model_dump(exclude={"query"})
+    params["tenant"] = tenant
+    if params.get("document_ids"):
+        params["document_ids"] = sorted(params["document_ids"])
+    params["model"] = f"{settings.CHAT_PROVIDER}:{settings.CHAT_MODEL}"
+    return json.dumps(params, sort_keys=True)
+
+
+class _Entry:
+    __slots__ = ("key", "group", "vector", "stamp", "response", "expires_at")
+
+    def __init__(self, key: str, group: str, vector: np.ndarray | None, stamp: str, response: ChatResponse, expires_at: float):
+        self.key = key
+        self.group = group
+        self.vector = vector
+        self.stamp = stamp
+        self.response = response
+        self.expires_at = expires_at
+
+
+class _Group:
+    # Entries sharing the same request params; the stacked matrix is rebuilt lazily.
+    def __init__(self) -> None:
+        self.entries: dict[str, _Entry] = {}
+        self._keys: list[str] = []
+        self._matrix: np.ndarray | None = None
+
+    def add(self, entry: _Entry) -> None:
+        self.entries[entry.key] = entry
+        self._matrix = None
+
+    def remove(self, key: str) -> None:
+        if self.entries.pop(key, None) is not None:
+            self._matrix = None
+
+    def nearest(self, vector: np.ndarray) -> tuple[_Entry | None, float]:
+        import numpy as np
+
+        if self._matrix is None:
+            self._keys = [k for k, e in self.entries.items() if e.vector is not None]
+            if not self._keys:
+                return None, 0.0
+            self._matrix = np.stack([self.entries[k].vector for k in self._keys])
+        scores = self._matrix @ vector
+        best = int(np.argmax(scores))
+        return self.entries[self._keys[best]], float(scores[best])
+
+
+class AnswerCache:
+    """Exact tier keyed by (normalized query, params); semantic tier by query-embedding cosine
+    within the same params. Entries are only served while the corpus stamp of their scope is unchanged."""
+
+    def __init__(self, max_items: int, ttl_s: int, similarity: float):
+        self.max_items = max_items
+        self.ttl_s = ttl_s
+        self.similarity = similarity
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._groups: dict[str, _Group] = {}
+        self._lock = Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(payload: ChatRequest, group: str) -> str:
+        return hashlib.sha256(f"{normalize_query(payload.query)}\x00{group}".encode()).hexdigest()
+
+    @staticmethod
+    def _unit(vector: list[float]) -> np.ndarray:
+        import numpy as np
+
+        v = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else v
+
+    def _drop(self, entry: _Entry) -> None:
+        self._entries.pop(entry.key, None)
+        group = self._groups.get(entry.group)
+        if group is not None:
+            group.remove(entry.key)
+            if not group.entries:
+                del self._groups[entry.group]
+
+    def _valid(self, entry: _Entry | None, stamp: str) -> bool:
+        if entry is None:
+            return False
+        if entry.expires_at < time.monotonic() or entry.stamp != stamp:
+            self._drop(entry)
+            return False
+        self._entries.move_to_end(entry.key)
+        return True
+
+    def get_exact(self, payload: ChatRequest, stamp: str, tenant: str = DEFAULT_TENANT) -> ChatResponse | None:
+        group = params_key(payload, tenant)
+        with self._lock:
+            entry = self._entries.get(self._key(payload, group))
+            if self._valid(entry, stamp):
+                self.exact_hits += 1
+                return entry.response.model_copy(update={"cache": "exact"})
+        return None
+
+    def get_semantic(
+        self, payload: ChatRequest, query_vector: list[float], stamp: str, tenant: str = DEFAULT_TENANT
+    ) -> ChatResponse | None:
+        if self.similarity <= 0:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            group = self._groups.get(params_key(payload, tenant))
+            if group is not None:
+                entry, score = group.nearest(self._unit(query_vector))
+                if score >= self.similarity and self._valid(entry, stamp):
+                    self.semantic_hits += 1
+                    return entry.response.model_copy(update={"cache": "semantic"})
+            self.misses += 1
+        return None
+
+    def put(
+        self, payload: ChatRequest, query_vector: list[float] | None, stamp: str, response: ChatResponse,
+        tenant: str = DEFAULT_TENANT,
+    ) -> None:
+        group_key = params_key(payload, tenant)
+        key = self._key(payload, group_key)
+        vector = self._unit(query_vector) if query_vector is not None else None
+        entry = _Entry(key, group_key, vector, stamp, response, time.monotonic() + self.ttl_s)
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                self._drop(old)
+            self._entries[key] = entry
+            self._groups.setdefault(group_key, _Group()).add(entry)
+            while len(self._entries) > self.max_items:
+                self._drop(next(iter(self._entries.values())))
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_answer_cache() -> AnswerCache | None:
+    if not settings.ANSWER_CACHE_ENABLED:
+        return None
+    return AnswerCache(settings.ANSWER_CACHE_MAX_ITEMS, settings.ANSWER_CACHE_TTL_S, settings.ANSWER_CACHE_SIMILARITY)
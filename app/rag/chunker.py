@@ -1,19 +1,205 @@
+from typing import Iterable, Iterator, NamedTuple
+import re
 from app.core.config import settings
+from app.rag.tokenizer import Tokenizer, get_tokenizer
 
+_PARA_RE = re.compile(r"\n[ \t]*\n\s*")
+_SENT_END_RE = re.compile(r"[.!?]\s+")
+_WORD_RE = re.compile(r"\S+")
+# a paragraph without blank lines is force-closed at a line break past this size
+_MAX_PARA_CHARS = 100_000
+# reserved per segment for the separator it is joined with
+_SEP_TOKENS = 1
+# overlap sentences are looked for only this many chars per token from the segment end
+_OVERLAP_CHARS_PER_TOKEN = 16
 
-def chunk_text(text: str, chunk_size: int | None = None, overlap: int | None = None) -> list[str]:
-    size = chunk_size or settings.CHUNK_SIZE
-    ovl = overlap or settings.CHUNK_OVERLAP
-    tokens = list(text)
-    chunks: list[str] = []
+
+class Chunk(NamedTuple):
+    text: str
+    token_count: int
+    # character span in the source text (of its first and last segment), e.g. to map chunks to pages
+    start: int = 0
+    end: int = 0
+
+
+class _Seg(NamedTuple):
+    text: str
+    tokens: int
+    para_start: bool
+    start: int  # offset in the source text
+
+
+def _iter_paragraphs(pieces: Iterable[str]) -> Iterator[tuple[str, int]]:
+    # (paragraph, source offset). Only the trailing, still-open paragraph is buffered between pieces.
+    buf = ""
+    base = 0  # source offset of buf[0]
+    for piece in pieces:
+        buf += piece
+        start = 0
+        for m in _PARA_RE.finditer(buf):
+            raw = buf[start:m.start()]
+            para = raw.strip()
+            if para:
+                yield para, base + start + len(raw) - len(raw.lstrip())
+            start = m.end()
+        buf = buf[start:]
+        base += start
+        if len(buf) > _MAX_PARA_CHARS:
+            cut = buf.rfind("\n", 0, _MAX_PARA_CHARS) + 1 or _MAX_PARA_CHARS
+            raw, buf = buf[:cut], buf[cut:]
+            para = raw.strip()
+            if para:
+                yield para, base + len(raw) - len(raw.lstrip())
+            base += cut
+    para = buf.strip()
+    if para:
+        yield para, base + len(buf) - len(buf.lstrip())
+
+
+def _sentences(text: str) -> list[tuple[str, int]]:
+    # (sentence, offset in text)
+    out = []
     start = 0
-    n = len(tokens)
-    while start < n:
-        end = min(start + size, n)
-        chunks.append("".join(tokens[start:end]))
-        if end == n:
-            break
-        start = end - ovl
-        if start < 0:
-            start = 0
-    return chunks
+    for m in _SENT_END_RE.finditer(text):
+        out.append((text[start:m.start() + 1], start))
+        start = m.end()
+    out.append((text[start:], start))
+    return out
+
+
+def _split_long(sentence: str, budget: int, tok: Tokenizer) -> Iterator[tuple[str, int, int]]:
+    # (text, tokens, offset in sentence): word-boundary groups; a single word longer
+    # than the budget is split by tokens.
+    matches = list(_WORD_RE.finditer(sentence))
+    words = [m.group() for m in matches]
+    group: list[str] = []
+    group_start = 0
+    used = 0
+    for m, word, n in zip(matches, words, tok.count_many(words)):
+        if n > budget:
+            if group:
+                yield _counted(" ".join(group), group_start, tok)
+                group, used = [], 0
+            for part in tok.split(word, budget):
+                yield _counted(part, m.start(), tok)
+            continue
+        if group and used + n + _SEP_TOKENS > budget:
+            yield _counted(" ".join(group), group_start, tok)
+            group, used = [], 0
+        if not group:
+            group_start = m.start()
+        group.append(word)
+        used += n + _SEP_TOKENS
+    if group:
+        yield _counted(" ".join(group), group_start, tok)
+
+
+def _counted(text: str, start: int, tok: Tokenizer) -> tuple[str, int, int]:
+    return text, tok.count(text), start
+
+
+def _split_paragraph(para: str, offset: int, budget: int, tok: Tokenizer) -> Iterator[_Seg]:
+    n = tok.count(para)
+    if n <= budget:
+        # fast path: most paragraphs fit whole and cost one tokenizer call
+        yield _Seg(para, n, True, offset)
+        return
+    first = True
+    sentences = _sentences(para)
+    for (sent, start), n in zip(sentences, tok.count_many([s for s, _ in sentences])):
+        if n <= budget:
+            yield _Seg(sent, n, first, offset + start)
+            first = False
+            continue
+        for part, m, part_start in _split_long(sent, budget, tok):
+            yield _Seg(part, m, first, offset + start + part_start)
+            first = False
+
+
+def _overlap_tail(segs: list[_Seg], overlap: int, tok: Tokenizer) -> list[_Seg]:
+    # Trailing whole segments, then trailing sentences of the next one, up to `overlap` tokens.
+    tail: list[_Seg] = []
+    used = 0
+    for seg in reversed(segs):
+        if used + seg.tokens <= overlap:
+            tail.insert(0, seg)
+            used += seg.tokens
+            continue
+        span = overlap * _OVERLAP_CHARS_PER_TOKEN
+        suffix_start = seg.start + max(0, len(seg.text) - span)
+        sentences = _sentences(seg.text[-span:])
+        if len(seg.text) > span:
+            # the first piece of a suffix may be a partial sentence
+            sentences = sentences[1:]
+        if sentences:
+            counts = tok.count_many([s for s, _ in sentences])
+            for (sent, start), n in reversed(list(zip(sentences, counts))):
+                if used + n > overlap:
+                    break
+                tail.insert(0, _Seg(sent, n, False, suffix_start + start))
+                used += n
+        break
+    return tail
+
+
+def _cut_point(window: list[_Seg], carried: int, budget: int) -> int:
+    # Prefer ending the chunk at a paragraph boundary once it is at least half full.
+    used = 0
+    best = len(window)
+    for i, seg in enumerate(window):
+        if i > carried and seg.para_start and used >= budget // 2:
+            best = i
+        used += seg.tokens
+    return best
+
+
+def _join(segs: list[_Seg], tok: Tokenizer) -> Chunk:
+    parts = []
+    for i, seg in enumerate(segs):
+        if i:
+            parts.append("\n\n" if seg.para_start else " ")
+        parts.append(seg.text)
+    text = "".join(parts)
+    start, end = segs[0].start, segs[-1].start + len(segs[-1].text)
+    if len(segs) == 1:
+        return Chunk(text, segs[0].tokens, start, end)
+    return Chunk(text, tok.count(text), start, end)
+
+
+def iter_chunks(
+    pieces: Iterable[str],
+    max_tokens: int | None = None,
+    overlap_tokens: int | None = None,
+    tokenizer: Tokenizer | None = None,
+) -> Iterator[Chunk]:
+    # Lazily pack paragraphs (then sentences, then words) into chunks of at most
+    # `max_tokens`, carrying `overlap_tokens` of trailing context into the next chunk.
+    budget = max_tokens or settings.CHUNK_TOKENS
+    overlap = settings.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    if overlap >= budget:
+        raise ValueError("chunk overlap must be smaller than chunk size")
+    tok = tokenizer or get_tokenizer()
+    window: list[_Seg] = []
+    carried = 0  # leading segments of `window` already emitted (the overlap)
+    used = 0
+    for para, offset in _iter_paragraphs(pieces):
+        for seg in _split_paragraph(para, offset, budget, tok):
+            cost = seg.tokens + _SEP_TOKENS
+            while len(window) > carried and used + cost > budget:
+                cut = _cut_point(window, carried, budget)
+                yield _join(window[:cut], tok)
+                tail = _overlap_tail(window[:cut], overlap, tok)
+                window = tail + window[cut:]
+                carried = len(tail)
+                used = sum(s.tokens + _SEP_TOKENS for s in window)
+            if used + cost > budget:
+                # the overlap alone would crowd out this segment
+                window, carried, used = [], 0, 0
+            window.append(seg)
+            used += cost
+    if len(window) > carried:
+        yield _join(window, tok)
+
+
+def chunk_text(text: str, max_tokens: int | None = None, overlap_tokens: int | None = None) -> list[str]:
+    return [c.text for c in iter_chunks([text], max_tokens, overlap_tokens)]
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+import asyncio
+import hashlib
+import logging
+
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# prune the Postgres store after this many new rows
+_PRUNE_EVERY = 5000
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.chars_saved = 0
+        self.texts_embedded = 0
+        self.embed_seconds = 0.0
+
+    def record_lookup(self, memory_hits: int, store_hits: int, misses: int, chars_saved: int) -> None:
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.store_hits += store_hits
+            self.misses += misses
+            self.chars_saved += chars_saved
+
+    def record_embed(self, n_texts: int, seconds: float) -> None:
+        with self._lock:
+            self.texts_embedded += n_texts
+            self.embed_seconds += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.store_hits
+            total = hits + self.misses
+            avg_ms = (self.embed_seconds * 1000 / self.texts_embedded) if self.texts_embedded else 0.0
+            return {
+                "hits": hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "store_hits": self.store_hits,
+                "hit_rate": hits / total if total else 0.0,
+                "texts_embedded": self.texts_embedded,
+                "chars_saved": self.chars_saved,
+                "avg_embed_ms_per_text": avg_ms,
+                "est_saved_ms": avg_ms * hits,
+            }
+
+
+class PostgresCacheStore:
+    """Shared, persistent tier; rows are evicted by `last_used_at` once over `max_rows`."""
+
+    def __init__(self, max_rows: int):
+        self.max_rows = max_rows
+        self._inserted_since_prune = 0
+
+    def get_many(self, model: str, keys: list[str]) -> dict[str, list[float]]:
+        from app.db.base import SessionLocal
+        from app.db.models import EmbeddingCacheEntry as E
+
+        # touch + fetch in one round trip
+        stmt = (
+            update(E)
+            .where(E.model == model, E.content_hash.in_(keys))
+            .values(last_used_at=func.now())
+            .returning(E.content_hash, E.embedding)
+        )
+        with SessionLocal() as db:
+            rows = db.execute(stmt).all()
+            db.commit()
+        return {h: [float(x) for x in emb] for h, emb in rows}
+
+    def put_many(self, model: str, items: dict[str, list[float]]) -> None:
+        from app.db.base import SessionLocal
+        from app.db.models import EmbeddingCacheEntry as E
+
+        values = [{"model": model, "content_hash": h, "embedding": v} for h, v in items.items()]
+        with SessionLocal() as db:
+            db.execute(insert(E).values(values).on_conflict_do_nothing())
+            db.commit()
+        self._inserted_since_prune += len(values)
+        if self._inserted_since_prune >= _PRUNE_EVERY:
+            self._inserted_since_prune = 0
+            self.prune()
+
+    def prune(self) -> int:
+        from app.db.base import SessionLocal
+        from app.db.models import EmbeddingCacheEntry as E
+
+        with SessionLocal() as db:
+            total = db.scalar(select(func.count()).select_from(E)) or 0
+            excess = total - self.max_rows
+            if excess <= 0:
+                return 0
+            oldest = select(E.model, E.content_hash).order_by(E.last_used_at).limit(excess)
+            db.execute(delete(E).where(tuple_(E.model, E.content_hash).in_(oldest)))
+            db.commit()
+        logger.info("Embedding cache pruned %d rows", excess)
+        return excess
+
+
+class EmbeddingCache:
+    """Two tiers: an in-process LRU in front of an optional shared store."""
+
+    def __init__(self, memory_items: int, store: PostgresCacheStore | None = None):
+        self.memory_items = memory_items
+        self.store = store
+        self.stats = CacheStats()
+        self._lru: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+        self._lock = Lock()
+
+    def _remember(self, model: str, key: str, vector: list[float]) -> None:
+        self._lru[(model, key)] = vector
+        self._lru.move_to_end((model, key))
+        while len(self._lru) > self.memory_items:
+            self._lru.popitem(last=False)
+
+    def get_many(self, model: str, texts: dict[str, str]) -> dict[str, list[float]]:
+        # texts: content_hash -> text
+        found: dict[str, list[float]] = {}
+        with self._lock:
+            for key in texts:
+                vec = self._lru.get((model, key))
+                if vec is not None:
+                    self._lru.move_to_end((model, key))
+                    found[key] = vec
+        memory_hits = len(found)
+        pending = [k for k in texts if k not in found]
+        if pending and self.store is not None:
+            try:
+                from_store = self.store.get_many(model, pending)
+            except Exception:
+                logger.warning("Embedding cache store lookup failed", exc_info=True)
+                from_store = {}
+            with self._lock:
+                for key, vec in from_store.items():
+                    self._remember(model, key, vec)
+            found.update(from_store)
+        self.stats.record_lookup(
+            memory_hits=memory_hits,
+            store_hits=len(found) - memory_hits,
+            misses=len(texts) - len(found),
+            chars_saved=sum(len(texts[k]) for k in found),
+        )
+        return found
+
+    def put_many(self, model: str, items: dict[str, list[float]]) -> None:
+        if not items:
+            return
+        with self._lock:
+            for key, vec in items.items():
+                self._remember(model, key, vec)
+        if self.store is not None:
+            try:
+                self.store.put_many(model, items)
+            except Exception:
+                logger.warning("Embedding cache store write failed", exc_info=True)
+
+    async def aget_many(self, model: str, texts: dict[str, str]) -> dict[str, list[float]]:
+        # the shared store is sync; keep it off the event loop
+        if self.store is None:
+            return self.get_many(model, texts)
+        return await asyncio.to_thread(self.get_many, model, texts)
+
+    async def aput_many(self, model: str, items: dict[str, list[float]]) -> None:
+        if self.store is None:
+            return self.put_many(model, items)
+        await asyncio.to_thread(self.put_many, model, items)
+
+
+@lru_cache(maxsize=1)
+def get_embedding_cache() -> EmbeddingCache:
+    backend = settings.EMBED_CACHE_BACKEND.lower()
+    if backend == "postgres":
+        return EmbeddingCache(settings.EMBED_CACHE_MEMORY_ITEMS, PostgresCacheStore(settings.EMBED_CACHE_MAX_ROWS))
+    if backend == "memory":
+        return EmbeddingCache(settings.EMBED_CACHE_MEMORY_ITEMS)
+    if backend == "none":
+        return EmbeddingCache(0)
+    raise ValueError(f"unknown EMBED_CACHE_BACKEND: {settings.EMBED_CACHE_BACKEND}")
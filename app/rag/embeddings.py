@@ -1,15 +1,159 @@
-from langchain_openai import OpenAIEmbeddings
 from app.core.config import settings
-from typing import Sequence
+from app.rag.embedding_cache import content_hash, get_embedding_cache
+from functools import lru_cache
+from typing import Protocol, Sequence
+import hashlib
+import math
+import re
+import time
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class EmbeddingProvider(Protocol):
+    model: str
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]: ...
+
+    def embed_query(self, text: str) -> list[float]: ...
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]: ...
+
+    async def aembed_query(self, text: str) -> list[float]: ...
+
+
+class OpenAIEmbeddingProvider:
+    def __init__(self, model: str, api_key: str):
+        from langchain_openai import OpenAIEmbeddings
+
+        from app.core.http import get_async_http_client, get_http_client
+
+        self.model = model
+        # one client per process on the shared keep-alive HTTP pools
+        self._client = OpenAIEmbeddings(
+            api_key=api_key, model=model, http_client=get_http_client(), http_async_client=get_async_http_client()
+        )
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        # LangChain handles batching internally
+        return self._client.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._client.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self._client.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self._client.aembed_query(text)
+
+
+class HashingEmbeddingProvider:
+    """Deterministic feature-hashing embedder: no network, for tests and benchmarks."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.model = f"hashing-{dim}"
+
+    def _embed(self, text: str) -> list[float]:
+        vec = [0.0] * self.dim
+        for word in _WORD_RE.findall(text.lower()):
+            h = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            idx = int.from_bytes(h[:4], "little") % self.dim
+            vec[idx] += 1.0 if h[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec))
+        if not norm:
+            # cosine distance is undefined for the zero vector
+            vec[0], norm = 1.0, 1.0
+        return [v / norm for v in vec]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+@lru_cache(maxsize=1)
+def get_embedding_provider() -> EmbeddingProvider:
+    name = settings.EMBEDDING_PROVIDER.lower()
+    if name == "openai":
+        return OpenAIEmbeddingProvider(settings.EMBEDDING_MODEL, settings.OPENAI_API_KEY)
+    if name == "hashing":
+        return HashingEmbeddingProvider(settings.EMBED_DIM)
+    raise ValueError(f"unknown EMBEDDING_PROVIDER: {settings.EMBEDDING_PROVIDER}")
 
 
 def embed_texts(texts: Sequence[str]) -> list[list[float]]:
-    emb = OpenAIEmbeddings(api_key=settings.OPENAI_API_KEY, model=settings.EMBEDDING_MODEL)
-    # LangChain handles batching internally
-    vectors = emb.embed_documents(list(texts))
-    return vectors
+    provider = get_embedding_provider()
+    cache = get_embedding_cache()
+    keys = [content_hash(t) for t in texts]
+    # dict dedupes repeated boilerplate within the batch as well
+    unique = dict(zip(keys, texts))
+    found = cache.get_many(provider.model, unique)
+    missing = [k for k in unique if k not in found]
+    if missing:
+        t0 = time.perf_counter()
+        vectors = provider.embed_documents([unique[k] for k in missing])
+        cache.stats.record_embed(len(missing), time.perf_counter() - t0)
+        fresh = dict(zip(missing, vectors))
+        cache.put_many(provider.model, fresh)
+        found.update(fresh)
+    return [found[k] for k in keys]
 
 
 def embed_query(text: str) -> list[float]:
-    emb = OpenAIEmbeddings(api_key=settings.OPENAI_API_KEY, model=settings.EMBEDDING_MODEL)
-    return emb.embed_query(text)
+    provider = get_embedding_provider()
+    cache = get_embedding_cache()
+    key = content_hash(text)
+    # queries get their own namespace: providers may embed them differently
+    model = f"{provider.model}:query"
+    found = cache.get_many(model, {key: text})
+    if key in found:
+        return found[key]
+    t0 = time.perf_counter()
+    vector = provider.embed_query(text)
+    cache.stats.record_embed(1, time.perf_counter() - t0)
+    cache.put_many(model, {key: vector})
+    return vector
+
+
+async def aembed_query(text: str) -> list[float]:
+    provider = get_embedding_provider()
+    cache = get_embedding_cache()
+    key = content_hash(text)
+    model = f"{provider.model}:query"
+    found = await cache.aget_many(model, {key: text})
+    if key in found:
+        return found[key]
+    t0 = time.perf_counter()
+    vector = await provider.aembed_query(text)
+    cache.stats.record_embed(1, time.perf_counter() - t0)
+    await cache.aput_many(model, {key: vector})
+    return vector
+
+
+async def aembed_queries(texts: Sequence[str]) -> list[list[float]]:
+    # batch form of aembed_query: one provider call for every query the cache misses
+    provider = get_embedding_provider()
+    cache = get_embedding_cache()
+    model = f"{provider.model}:query"
+    keys = [content_hash(t) for t in texts]
+    unique = dict(zip(keys, texts))
+    found = await cache.aget_many(model, unique)
+    missing = [k for k in unique if k not in found]
+    if missing:
+        t0 = time.perf_counter()
+        # embed_query is embed_documents of a single text for the providers we ship
+        vectors = await provider.aembed_documents([unique[k] for k in missing])
+        cache.stats.record_embed(len(missing), time.perf_counter() - t0)
+        fresh = dict(zip(missing, vectors))
+        await cache.aput_many(model, fresh)
+        found.update(fresh)
+    return [found[k] for k in keys]
@@ -0,0 +1,33 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from langchain_core.language_models.chat_models import BaseChatModel
+
+
+def chat_model_name() -> str:
+    # what query_logs.model records
+    return settings.CHAT_MODEL if settings.CHAT_PROVIDER.lower() == "openai" else settings.CHAT_PROVIDER.lower()
+
+
+@lru_cache(maxsize=1)
+def get_chat_model() -> "BaseChatModel":
+    # Shared for the whole process; per-request options go through .bind(...). LangChain is
+    # imported here, on first use, not when the API or worker starts.
+    name = settings.CHAT_PROVIDER.lower()
+    if name == "openai":
+        from langchain_openai import ChatOpenAI
+
+        from app.core.http import get_async_http_client, get_http_client
+
+        return ChatOpenAI(
+            api_key=settings.OPENAI_API_KEY, model=settings.CHAT_MODEL,
+            http_client=get_http_client(), http_async_client=get_async_http_client(),
+        )
+    if name == "echo":
+        from app.rag.echo import EchoChatModel
+
+        return EchoChatModel(latency_ms=settings.ECHO_LATENCY_MS)
+    raise ValueError(f"unknown CHAT_PROVIDER: {settings.CHAT_PROVIDER}")
@@ -1,20 +1,26 @@
+from typing import Any, AsyncIterator
+import asyncio
+import time
 from sqlalchemy.orm import Session
-from app.schemas.chat import ChatRequest, ChatResponse, Citation
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
-from app.rag.retriever import search_similar_chunks
-from app.rag.prompt import SYSTEM_PROMPT, build_prompt
-from langchain_openai import ChatOpenAI
+from app.schemas.chat import BatchChatRequest, BatchChatResult, ChatRequest, ChatResponse, Citation
+from app.db.repositories import corpus_stamp, acorpus_stamp
+from app.db.tenants import DEFAULT_TENANT
+from app.rag.answer_cache import get_answer_cache
+from app.rag.retriever import search_similar_chunks, asearch_similar_chunks, asearch_similar_chunks_batch
+from app.rag.prompt import SYSTEM_PROMPT, build_prompt, pack_contexts
+from app.rag.llm import get_chat_model
+from app.rag.rerank import rerank, rerank_pool
+from app.core.metrics import RAG_STAGE_SECONDS
+from app.rag.telemetry import QueryTrace, log_query
 
 
-def answer_query(db: Session, payload: ChatRequest) -> ChatResponse:
-    from app.rag.embeddings import embed_query
-
-    qv = embed_query(payload.query)
-    rows = search_similar_chunks(db, qv, payload.top_k, payload.document_ids)
-    contexts = []
+def _contexts_and_citations(rows) -> tuple[list[str], list[Citation]]:
+    # citations cover exactly the chunks that made it into the packed prompt
+    contexts, used = pack_contexts(rows)
     citations: list[Citation] = []
-    for doc_id, chunk_id, chunk_index, sim, content in rows:
-        contexts.append(content)
+    for doc_id, chunk_id, chunk_index, sim, content, page in (rows[i] for i in used):
         citations.append(
             Citation(
                 document_id=doc_id,
@@ -22,12 +28,262 @@ def answer_query(db: Session, payload: ChatRequest) -> ChatResponse:
                 chunk_index=int(chunk_index),
                 similarity=float(sim),
                 snippet=content[:200],
+                page=page,
             )
         )
+    return contexts, citations
+
+
+def _messages(query: str, contexts: list[str]) -> list[dict]:
+    prompt = build_prompt(query, contexts)
+    return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+
+
+def _pool(payload: ChatRequest) -> int:
+    return rerank_pool(payload.top_k, payload.rerank, payload.rerank_candidates)
+
+
+def _llm(payload: ChatRequest):
+    return get_chat_model().bind(temperature=payload.temperature, max_tokens=payload.max_tokens)
+
+
+def _content(resp) -> str:
+    return resp.content if hasattr(resp, "content") else str(resp)
+
+
+def answer_query(db: Session, payload: ChatRequest, tenant: str = DEFAULT_TENANT) -> ChatResponse:
+    from app.rag.embeddings import embed_query
+
+    with QueryTrace("chat_query_sync", payload.query, payload.top_k, tenant) as trace:
+        cache = get_answer_cache()
+        stamp = ""
+        if cache:
+            with trace.stage("cache"):
+                stamp = corpus_stamp(db, payload.document_ids, tenant)
+                hit = cache.get_exact(payload, stamp, tenant)
+            if hit:
+                trace.cache = hit.cache
+                return hit
+        with trace.stage("embed"):
+            qv = embed_query(payload.query)
+        if cache:
+            with trace.stage("cache"):
+                hit = cache.get_semantic(payload, qv, stamp, tenant)
+            if hit:
+                trace.cache = hit.cache
+                return hit
+        with trace.stage("retrieve"):
+            rows = search_similar_chunks(
+                db, qv, _pool(payload), payload.document_ids, payload.probes, payload.ef_search,
+                mode=payload.search_mode, query_text=payload.query, tenant=tenant,
+            )
+        if len(rows) > payload.top_k:
+            with trace.stage("rerank"):
+                rows = rerank(payload.query, rows, payload.top_k)
+        with trace.stage("prompt"):
+            contexts, citations = _contexts_and_citations(rows)
+            messages = _messages(payload.query, contexts)
+        parts = []
+        t0 = time.perf_counter()
+        with trace.stage("llm"):
+            for chunk in _llm(payload).stream(messages):
+                if not parts:
+                    trace.add("llm_first_token", time.perf_counter() - t0)
+                parts.append(chunk.content)
+        response = ChatResponse(answer="".join(parts), citations=citations)
+        if cache:
+            cache.put(payload, qv, stamp, response, tenant)
+        return response
+
+
+async def _acached(
+    db: AsyncSession, payload: ChatRequest, trace: QueryTrace, tenant: str
+) -> tuple[ChatResponse | None, list[float], str]:
+    # (cache hit or None, query vector, corpus stamp); the stamp is read before
+    # retrieval so an answer racing a re-ingest is stored under the old stamp
+    from app.rag.embeddings import aembed_query
+
+    cache = get_answer_cache()
+    stamp = ""
+    if cache:
+        with trace.stage("cache"):
+            stamp = await acorpus_stamp(db, payload.document_ids, tenant)
+            hit = cache.get_exact(payload, stamp, tenant)
+        if hit:
+            trace.cache = hit.cache
+            return hit, [], stamp
+    with trace.stage("embed"):
+        qv = await aembed_query(payload.query)
+    if cache:
+        with trace.stage("cache"):
+            hit = cache.get_semantic(payload, qv, stamp, tenant)
+        if hit:
+            trace.cache = hit.cache
+            return hit, qv, stamp
+    return None, qv, stamp
+
+
+async def _aretrieve(db: AsyncSession, payload: ChatRequest, qv: list[float], trace: QueryTrace, tenant: str):
+    with trace.stage("retrieve"):
+        rows = await asearch_similar_chunks(
+            db, qv, _pool(payload), payload.document_ids, payload.probes, payload.ef_search,
+            mode=payload.search_mode, query_text=payload.query, tenant=tenant,
+        )
+    # release the pooled connection before the (slow) LLM call
+    await db.close()
+    if len(rows) > payload.top_k:
+        # CPU-bound (a local model can take tens of ms): off the event loop
+        with trace.stage("rerank"):
+            rows = await asyncio.to_thread(rerank, payload.query, rows, payload.top_k)
+    with trace.stage("prompt"):
+        contexts, citations = _contexts_and_citations(rows)
+        messages = _messages(payload.query, contexts)
+    return messages, citations
+
+
+async def _astream_tokens(payload: ChatRequest, messages: list[dict], trace: QueryTrace) -> AsyncIterator[str]:
+    # times the first token and the whole generation; closing early closes the model stream
+    t0 = time.perf_counter()
+    first = True
+    stream = _llm(payload).astream(messages)
+    try:
+        async for chunk in stream:
+            if first:
+                trace.add("llm_first_token", time.perf_counter() - t0)
+                first = False
+            if chunk.content:
+                yield chunk.content
+    finally:
+        trace.add("llm", time.perf_counter() - t0)
+        await stream.aclose()
+
+
+async def aanswer_query(db: AsyncSession, payload: ChatRequest, tenant: str = DEFAULT_TENANT) -> ChatResponse:
+    with QueryTrace("chat_query", payload.query, payload.top_k, tenant) as trace:
+        hit, qv, stamp = await _acached(db, payload, trace, tenant)
+        if hit:
+            return hit
+        messages, citations = await _aretrieve(db, payload, qv, trace, tenant)
+        # streamed and joined, so the first-token latency is measured
+        parts = [part async for part in _astream_tokens(payload, messages, trace)]
+        response = ChatResponse(answer="".join(parts), citations=citations)
+        if cache := get_answer_cache():
+            cache.put(payload, qv, stamp, response, tenant)
+        return response
+
+
+async def astream_answer(
+    db: AsyncSession, payload: ChatRequest, tenant: str = DEFAULT_TENANT
+) -> AsyncIterator[tuple[str, Any]]:
+    # ("citations", [...]) as soon as retrieval is done, then ("token", str)..., then ("done", {...}).
+    # Closing this generator early closes the upstream model stream as well.
+    with QueryTrace("chat_stream", payload.query, payload.top_k, tenant) as trace:
+        hit, qv, stamp = await _acached(db, payload, trace, tenant)
+        if hit:
+            await db.close()
+            yield "citations", [c.model_dump() for c in hit.citations]
+            yield "token", hit.answer
+            yield "done", {"cache": hit.cache}
+            return
+        messages, citations = await _aretrieve(db, payload, qv, trace, tenant)
+        yield "citations", [c.model_dump() for c in citations]
+        parts: list[str] = []
+        tokens = _astream_tokens(payload, messages, trace)
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield "token", token
+        finally:
+            await tokens.aclose()
+        # only completed generations reach the cache
+        if cache := get_answer_cache():
+            cache.put(payload, qv, stamp, ChatResponse(answer="".join(parts), citations=citations), tenant)
+        yield "done", {"cache": None}
+
+
+async def abatch_answer(
+    db: AsyncSession, payload: BatchChatRequest, tenant: str = DEFAULT_TENANT
+) -> AsyncIterator[BatchChatResult]:
+    # One embedding call and one retrieval statement for the whole batch, then at most
+    # BATCH_LLM_CONCURRENCY model calls in flight; results are yielded as they finish.
+    # Shared stages are timed once for the batch; each query gets its own query_logs row.
+    from app.rag.embeddings import aembed_queries
+
+    items = [payload.item(i) for i in range(len(payload.queries))]
+    with QueryTrace("chat_batch", tenant=tenant) as trace:
+
+        def logged(result: BatchChatResult, own: dict | None = None) -> BatchChatResult:
+            timings = {**trace.ms(), **(own or {})}
+            log_query(
+                "chat_batch", result.query, payload.top_k, result.cache, time.perf_counter() - trace.t0, timings,
+                "error" if result.error else "ok", tenant,
+            )
+            return result
+
+        cache = get_answer_cache()
+        pending = []
+        with trace.stage("cache"):
+            stamp = await acorpus_stamp(db, payload.document_ids, tenant) if cache else ""
+            exact = [(i, cache.get_exact(item, stamp, tenant) if cache else None) for i, item in enumerate(items)]
+        for i, hit in exact:
+            if hit:
+                yield logged(BatchChatResult(index=i, query=items[i].query, **hit.model_dump()))
+            else:
+                pending.append(i)
+        if not pending:
+            return
+        with trace.stage("embed"):
+            vectors = await aembed_queries([items[i].query for i in pending])
+        todo: list[tuple[int, list[float]]] = []
+        for i, qv in zip(pending, vectors):
+            if cache and (hit := cache.get_semantic(items[i], qv, stamp, tenant)):
+                yield logged(BatchChatResult(index=i, query=items[i].query, **hit.model_dump()))
+            else:
+                todo.append((i, qv))
+        if not todo:
+            return
+        with trace.stage("retrieve"):
+            hits = await asearch_similar_chunks_batch(
+                db, [qv for _, qv in todo], [items[i].query for i, _ in todo], _pool(payload), payload.document_ids,
+                payload.probes, payload.ef_search, mode=payload.search_mode, tenant=tenant,
+            )
+        await db.close()
+        llm = _llm(payload)
+        sem = asyncio.Semaphore(settings.BATCH_LLM_CONCURRENCY)
 
-    llm = ChatOpenAI(api_key=settings.OPENAI_API_KEY, model=settings.CHAT_MODEL, temperature=payload.temperature, max_tokens=payload.max_tokens)
-    prompt = build_prompt(payload.query, contexts)
-    resp = llm.invoke([{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}])
-    answer = resp.content if hasattr(resp, "content") else str(resp)
+        async def answer(i: int, qv: list[float], rows) -> BatchChatResult:
+            item = items[i]
+            own = {}
+            if len(rows) > item.top_k:
+                t0 = time.perf_counter()
+                rows = await asyncio.to_thread(rerank, item.query, rows, item.top_k)
+                rerank_s = time.perf_counter() - t0
+                RAG_STAGE_SECONDS.observe(rerank_s, route="chat_batch", stage="rerank")
+                own["rerank"] = round(rerank_s * 1000, 1)
+            t0 = time.perf_counter()
+            contexts, citations = _contexts_and_citations(rows)
+            messages = _messages(item.query, contexts)
+            prompt_s = time.perf_counter() - t0
+            try:
+                async with sem:
+                    t1 = time.perf_counter()
+                    resp = await llm.ainvoke(messages)
+                    llm_s = time.perf_counter() - t1
+            except Exception as e:
+                # one failed generation must not sink the rest of the batch
+                return logged(BatchChatResult(index=i, query=item.query, citations=citations, error=str(e)), own)
+            RAG_STAGE_SECONDS.observe(llm_s, route="chat_batch", stage="llm")
+            response = ChatResponse(answer=_content(resp), citations=citations)
+            if cache:
+                cache.put(item, qv, stamp, response, tenant)
+            own.update(prompt=round(prompt_s * 1000, 1), llm=round(llm_s * 1000, 1))
+            return logged(BatchChatResult(index=i, query=item.query, **response.model_dump()), own)
 
-    return ChatResponse(answer=answer, citations=citations)
+        tasks = [asyncio.create_task(answer(i, qv, rows)) for (i, qv), rows in zip(todo, hits)]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            # the client went away or the consumer stopped early
+            for task in tasks:
+                task.cancel()
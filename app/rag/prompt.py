@@ -1,4 +1,7 @@
-from typing import Sequence
+from typing import NamedTuple, Optional, Sequence
+import re
+
+from app.core.config import settings
 
 
 SYSTEM_PROMPT = (
@@ -6,6 +9,102 @@ SYSTEM_PROMPT = (
     "If the answer is not in the context, say you don't know. Reply concisely. Include citations."
 )
 
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_SHINGLE = 5
+# how far back in a chunk its successor's overlap can start
+_OVERLAP_WINDOW_CHARS = 8000
+_OVERLAP_PROBE_CHARS = 24
+
+
+class ContextBlock(NamedTuple):
+    document_id: str
+    chunk_indexes: tuple[int, ...]
+    text: str
+    rows: tuple[int, ...]  # positions in the retrieved rows
+
+
+def _shingles(text: str) -> frozenset:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < _SHINGLE:
+        return frozenset([tuple(words)])
+    return frozenset(tuple(words[i:i + _SHINGLE]) for i in range(len(words) - _SHINGLE + 1))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _merge_text(left: str, right: str) -> str:
+    # The chunker repeats the tail of a chunk at the head of the next one:
+    # find where `right` starts inside the end of `left` and keep that part once.
+    probe = right[:_OVERLAP_PROBE_CHARS]
+    start = max(0, len(left) - _OVERLAP_WINDOW_CHARS)
+    pos = left.find(probe, start) if probe else -1
+    while pos != -1:
+        if right.startswith(left[pos:]):
+            return left + right[len(left) - pos:]
+        pos = left.find(probe, pos + 1)
+    return f"{left}\n{right}"
+
+
+def _label(block: ContextBlock) -> str:
+    first, last = block.chunk_indexes[0], block.chunk_indexes[-1]
+    span = str(first) if first == last else f"{first}-{last}"
+    return f"[{block.document_id}:{span}]\n{block.text}"
+
+
+def pack_contexts(rows, budget_tokens: Optional[int] = None, dedup_similarity: Optional[float] = None) -> tuple[list[str], list[int]]:
+    """Rows are (document_id, chunk_id, chunk_index, similarity, content, ...) in relevance order.
+
+    Drops near-duplicate chunks, takes the most relevant ones that fit the token budget, then
+    merges adjacent chunks of the same document so their overlap appears once. Returns the
+    labelled context blocks, best first, and the positions of the rows they contain, for citations.
+    """
+    from app.rag.tokenizer import get_tokenizer
+
+    budget = settings.PROMPT_CONTEXT_TOKENS if budget_tokens is None else budget_tokens
+    threshold = settings.PROMPT_DEDUP_SIMILARITY if dedup_similarity is None else dedup_similarity
+    tok = get_tokenizer()
+    counts = tok.count_many([row[4] for row in rows]) if rows else []
+    label_tokens = tok.count(f"[{rows[0][0]}:0]\n") if rows else 0
+    selected: list[int] = []
+    seen: list[frozenset] = []
+    used = 0
+    for i, row in enumerate(rows):
+        # merging only removes text, so the per-chunk sum bounds the packed size
+        n = counts[i] + label_tokens
+        if used + n > budget and selected:
+            continue
+        shingles = _shingles(row[4])
+        if threshold > 0 and any(_jaccard(shingles, s) >= threshold for s in seen):
+            continue
+        selected.append(i)
+        seen.append(shingles)
+        used += n
+
+    # consecutive chunk_index runs per document become one block
+    blocks: list[ContextBlock] = []
+    by_doc: dict[str, list[int]] = {}
+    for i in selected:
+        by_doc.setdefault(rows[i][0], []).append(i)
+    for doc_id, positions in by_doc.items():
+        positions.sort(key=lambda i: int(rows[i][2]))
+        run = [positions[0]]
+        for i in positions[1:] + [None]:
+            if i is not None and int(rows[i][2]) - int(rows[run[-1]][2]) <= 1:
+                run.append(i)
+                continue
+            text = rows[run[0]][4]
+            for j in run[1:]:
+                text = _merge_text(text, rows[j][4])
+            blocks.append(ContextBlock(doc_id, tuple(int(rows[j][2]) for j in run), text, tuple(run)))
+            run = [i] if i is not None else []
+    # blocks follow the retrieval rank of their best chunk (fused rank in hybrid mode)
+    blocks.sort(key=lambda b: min(b.rows))
+    return [_label(b) for b in blocks], sorted(selected)
+
 
 def build_prompt(query: str, contexts: Sequence[str]) -> str:
     ctx = "\n\n---\n\n".join(contexts)
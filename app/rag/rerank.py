@@ -0,0 +1,122 @@
+"""Optional rerank stage between retrieval and prompt packing.
+
+Retrieval over-fetches a candidate pool, a local CPU scorer re-scores (query, chunk) pairs and
+only the best top_k go to the prompt, so answers get the benefit of a deep pool without a bigger
+prompt. The final score blends the scorer's (min-max normalized) score with the retrieval order,
+so the lexical default doesn't discard what the vector or hybrid ranking already knew.
+"""
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Protocol, Sequence
+import logging
+import re
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class Scorer(Protocol):
+    name: str
+
+    def score(self, query: str, passages: Sequence[str]) -> "np.ndarray":
+        """Relevance of each passage to the query; higher is better, any scale."""
+        ...
+
+
+class BM25Scorer:
+    """Okapi BM25 over the candidate pool. Document frequencies come from the pool itself, which
+    is what matters for ordering it; the pool's tf matrix is scored in one NumPy expression."""
+
+    name = "bm25"
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query: str, passages: Sequence[str]) -> "np.ndarray":
+        import numpy as np
+
+        terms = list(dict.fromkeys(_WORD_RE.findall(query.lower())))
+        if not terms or not passages:
+            return np.zeros(len(passages), dtype=np.float32)
+        column = {t: j for j, t in enumerate(terms)}
+        tf = np.zeros((len(passages), len(terms)), dtype=np.float32)
+        lengths = np.empty(len(passages), dtype=np.float32)
+        for i, passage in enumerate(passages):
+            words = _WORD_RE.findall(passage.lower())
+            lengths[i] = len(words)
+            for word in words:
+                j = column.get(word)
+                if j is not None:
+                    tf[i, j] += 1
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((len(passages) - df + 0.5) / (df + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(float(lengths.mean()), 1.0))
+        return (tf * (self.k1 + 1) / (tf + norm[:, None])) @ idf
+
+
+class CrossEncoderScorer:
+    """A local cross-encoder (sentence-transformers, optional dependency) on CPU, scoring the
+    whole pool in batches of RERANK_BATCH_SIZE pairs."""
+
+    def __init__(self, model: str, batch_size: int):
+        from sentence_transformers import CrossEncoder
+
+        self.name = model
+        self.batch_size = batch_size
+        self._model = CrossEncoder(model, device="cpu")
+
+    def score(self, query: str, passages: Sequence[str]) -> "np.ndarray":
+        import numpy as np
+
+        if not passages:
+            return np.zeros(0, dtype=np.float32)
+        scores = self._model.predict(
+            [(query, p) for p in passages], batch_size=self.batch_size, show_progress_bar=False
+        )
+        return np.asarray(scores, dtype=np.float32)
+
+
+@lru_cache(maxsize=1)
+def get_scorer() -> Scorer:
+    name = settings.RERANK_SCORER.lower()
+    if name == "bm25":
+        return BM25Scorer(settings.RERANK_BM25_K1, settings.RERANK_BM25_B)
+    if name == "cross-encoder":
+        try:
+            return CrossEncoderScorer(settings.RERANK_MODEL, settings.RERANK_BATCH_SIZE)
+        except Exception:
+            # sentence-transformers missing, or the model can't be loaded (offline)
+            logger.warning("Rerank model %r unavailable, falling back to BM25", settings.RERANK_MODEL, exc_info=True)
+            return BM25Scorer(settings.RERANK_BM25_K1, settings.RERANK_BM25_B)
+    raise ValueError(f"unknown RERANK_SCORER: {settings.RERANK_SCORER}")
+
+
+def rerank_pool(top_k: int, enabled: Optional[bool], candidates: Optional[int]) -> int:
+    # rows to retrieve: top_k without reranking, the candidate pool with it
+    if not (settings.RERANK_ENABLED if enabled is None else enabled):
+        return top_k
+    return max(top_k, candidates or settings.RERANK_CANDIDATES)
+
+
+def _minmax(values: "np.ndarray") -> "np.ndarray":
+    span = float(values.max() - values.min())
+    return (values - values.min()) / span if span > 0 else values * 0
+
+
+def rerank(query: str, rows: Sequence, top_k: int) -> list:
+    # rows as returned by the retriever, best first: (document_id, chunk_id, chunk_index, similarity, content, page)
+    import numpy as np
+
+    if len(rows) <= 1:
+        return list(rows)[:top_k]
+    scores = np.asarray(get_scorer().score(query, [row[4] for row in rows]), dtype=np.float32)
+    prior = 1 - np.arange(len(rows), dtype=np.float32) / (len(rows) - 1)
+    weight = settings.RERANK_WEIGHT
+    final = weight * _minmax(scores) + (1 - weight) * prior
+    return [rows[i] for i in np.argsort(-final, kind="stable")[:top_k]]
@@ -1,31 +1,472 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from typing import List, Optional
+from collections import OrderedDict
+from threading import Lock
+from typing import List, NamedTuple, Optional
+import logging
+import math
+
 from app.core.config import settings
+from app.db.repositories import corpus_stamp
+from app.db.indexes import compact_distance, live_index, rerank_factor, search_defaults, search_gucs, set_gucs_stmt
+from app.db.tenants import DEFAULT_TENANT
 from app.schemas.chat import SearchDebugResponse, SearchHit
 
+logger = logging.getLogger(__name__)
+
+
+# Every search reads one tenant's rows: the shard(s) holding it (two while it moves, see
+# app.db.tenants) prune chunk_embeddings to those partitions and their pieces of the ANN index,
+# tenant_id filters out the other tenants sharing them. The shards are looked up in the same
+# statement, so a concurrent move is never seen half done.
+def _scope(alias: str = "") -> str:
+    return (
+        f"{alias}shard IN ((SELECT shard FROM tenants WHERE tenant_id = :tenant), "
+        "(SELECT moving_to FROM tenants WHERE tenant_id = :tenant)) "
+        f"AND {alias}tenant_id = :tenant"
+    )
+
+
+_DOC_FILTER = "AND document_id = ANY(CAST(:doc_ids AS uuid[]))"
+
+# Vector leg: (chunk_id, distance) for the :n nearest rows to {qvec}. The ANN index only serves
+# ORDER BY on the bare operator ({key}: the full or compact distance the index was built on);
+# "+ 0" makes the planner read the filtered rows through a btree and sort them exactly.
+_ANN_SQL = {
+    "ann": """
+        SELECT chunk_id, embedding <=> {qvec} AS distance
+        FROM chunk_embeddings
+        WHERE {scope}
+        ORDER BY {key}
+        LIMIT {limit}
+    """,
+    "exact": """
+        SELECT chunk_id, embedding <=> {qvec} AS distance
+        FROM chunk_embeddings
+        WHERE {scope} {doc_filter}
+        ORDER BY (embedding <=> {qvec}) + 0
+        LIMIT :n
+    """,
+    # relaxed_order can return rows slightly out of order; every consumer re-sorts by distance
+    "iterative": """
+        SELECT chunk_id, embedding <=> {qvec} AS distance
+        FROM chunk_embeddings
+        WHERE {scope} {doc_filter}
+        ORDER BY {key}
+        LIMIT {limit}
+    """,
+    "overfetch": """
+        SELECT chunk_id, distance FROM (
+            SELECT chunk_id, document_id, embedding <=> {qvec} AS distance
+            FROM chunk_embeddings
+            WHERE {scope}
+            ORDER BY {key}
+            LIMIT :fetch
+        ) c
+        WHERE true {doc_filter}
+        ORDER BY distance
+        LIMIT :n
+    """,
+}
+
+# Lexical leg: chunks matching every query term (websearch syntax) rank first; only when fewer than :n
+# do, chunks matching any term fill up behind them. Each tier takes at most :lex_cap matches before
+# ts_rank_cd orders it, so a common word does not rank the tenant's whole corpus.
+# content_tsv is a generated column with a GIN index.
+_LEX_SQL = """
+    WITH all_terms AS MATERIALIZED (
+        SELECT dc.id, ts_rank_cd(dc.content_tsv, {q_all}) AS score
+        FROM document_chunks dc
+        WHERE dc.content_tsv @@ {q_all} AND dc.tenant_id = :tenant {doc_filter}
+        LIMIT :lex_cap
+    ),
+    any_term AS MATERIALIZED (
+        SELECT dc.id, ts_rank_cd(dc.content_tsv, {q_any}) AS score
+        FROM document_chunks dc
+        WHERE (SELECT count(*) FROM all_terms) < :n
+          AND dc.content_tsv @@ {q_any} AND NOT dc.content_tsv @@ {q_all}
+          AND dc.tenant_id = :tenant {doc_filter}
+        LIMIT :lex_cap
+    )
+    SELECT id AS chunk_id, row_number() OVER (ORDER BY tier, score DESC) AS rank
+    FROM (SELECT id, 0 AS tier, score FROM all_terms UNION ALL SELECT id, 1, score FROM any_term) m
+    ORDER BY tier, score DESC
+    LIMIT :n
+"""
+
+
+def _lex_sql(qtext: str, doc_filter: str) -> str:
+    q_all = f"websearch_to_tsquery(CAST(:fts_config AS regconfig), {qtext})"
+    q_any = f"replace(plainto_tsquery(CAST(:fts_config AS regconfig), {qtext})::text, ' & ', ' | ')::tsquery"
+    return _LEX_SQL.format(q_all=q_all, q_any=q_any, doc_filter=doc_filter)
+
+
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+
+
+_QVEC = "CAST(:qvec AS vector)"
+
+
+def _vector_leg(strategy: str, qvec: str, storage: str, dims: int, filtered: bool) -> str:
+    # Over a compact index, ann/iterative take :cand candidates by the compact distance and keep the
+    # :n nearest by the full one; overfetch already re-sorts by full distance, exact never uses the index.
+    parts = {"qvec": qvec, "scope": _scope(), "doc_filter": _DOC_FILTER if filtered else ""}
+    if storage == "full" or strategy == "exact":
+        return _ANN_SQL[strategy].format(key=f"embedding <=> {qvec}", limit=":n", **parts)
+    sql = _ANN_SQL[strategy].format(key=compact_distance(storage, dims, qvec), limit=":cand", **parts)
+    if strategy == "overfetch":
+        return sql
+    return f"SELECT chunk_id, distance FROM ({sql}) cand ORDER BY distance LIMIT :n"
+
+
+def search_sql(
+    strategy: str,
+    mode: str = "vector",
+    filtered: bool = False,
+    qvec: str = _QVEC,
+    qtext: str = ":qtext",
+    storage: str = "full",
+    dims: int = 0,
+) -> str:
+    # qvec/qtext are SQL expressions: bind parameters here, columns of the batch CTE in search_batch_sql.
+    # similarity is always the cosine similarity, so citations mean the same in every mode.
+    ann = _vector_leg(strategy, qvec, storage, dims, filtered)
+    if mode == "vector":
+        return f"""
+            WITH ann AS MATERIALIZED ({ann})
+            SELECT dc.document_id::text, ann.chunk_id::text, dc.chunk_index, 1 - ann.distance AS similarity, dc.content,
+                   (dc.metadata->>'page')::int AS page
+            FROM ann JOIN document_chunks dc ON dc.id = ann.chunk_id
+            ORDER BY ann.distance
+            LIMIT :k
+        """
+    doc_filter = "AND dc.document_id = ANY(CAST(:doc_ids AS uuid[]))" if filtered else ""
+    lex = _lex_sql(qtext, doc_filter)
+    if mode == "lexical":
+        legs, ranked = f"lex AS MATERIALIZED ({lex})", "SELECT chunk_id, rank FROM lex"
+    elif mode == "hybrid":
+        legs = f"ann AS MATERIALIZED ({ann}), lex AS MATERIALIZED ({lex})"
+        ranked = "SELECT chunk_id, row_number() OVER (ORDER BY distance) AS rank FROM ann UNION ALL SELECT chunk_id, rank FROM lex"
+    else:
+        raise ValueError(f"unknown search mode: {mode}")
+    # reciprocal rank fusion: score = sum over legs of 1 / (RRF_K + rank)
+    return f"""
+        WITH {legs},
+        fused AS (
+            SELECT chunk_id, sum(1.0 / (:rrf_k + rank)) AS score
+            FROM ({ranked}) r
+            GROUP BY chunk_id
+            ORDER BY score DESC
+            LIMIT :k
+        )
+        SELECT dc.document_id::text, fused.chunk_id::text, dc.chunk_index,
+               1 - (ce.embedding <=> {qvec}) AS similarity, dc.content, (dc.metadata->>'page')::int AS page
+        FROM fused
+        JOIN document_chunks dc ON dc.id = fused.chunk_id
+        JOIN chunk_embeddings ce ON ce.chunk_id = fused.chunk_id AND {_scope('ce.')}
+        ORDER BY fused.score DESC
+    """
+
+
+def search_batch_sql(
+    strategy: str, mode: str = "vector", filtered: bool = False, storage: str = "full", dims: int = 0
+) -> str:
+    # every query of a batch in one statement: the per-query search runs LATERAL over the unnested arrays
+    inner = search_sql(strategy, mode, filtered, qvec="batch.qvec", qtext="batch.qtext", storage=storage, dims=dims)
+    return f"""
+        WITH batch AS MATERIALIZED (
+            SELECT ord, CAST(v AS vector) AS qvec, t AS qtext
+            FROM unnest(CAST(:qvecs AS text[]), CAST(:qtexts AS text[])) WITH ORDINALITY AS u(v, t, ord)
+        )
+        SELECT batch.ord, hit.* FROM batch CROSS JOIN LATERAL ({inner}) hit
+    """
+
+
+# a partitioned table's own reltuples is never maintained by autovacuum: sum the partitions'
+_FILTER_STATS_SQL = text("""
+    SELECT
+        (SELECT coalesce(sum(ingested_chunks), 0) FROM documents
+         WHERE id = ANY(CAST(:doc_ids AS uuid[])) AND tenant_id = :tenant),
+        (SELECT sum(greatest(c.reltuples, 0))::bigint
+         FROM pg_partition_tree('chunk_embeddings') t JOIN pg_class c ON c.oid = t.relid WHERE t.isleaf)
+""")
+
+
+class SearchPlan(NamedTuple):
+    strategy: str  # ann | exact | iterative | overfetch
+    fetch: int  # rows pulled from the index before filtering (overfetch only)
+    storage: str = "full"  # storage of the live ANN index (app.db.indexes.STORAGE_MODES)
+    dims: int = 0
+    rows: int | None = None  # rows in scope, when the document filter tells
+
+
+def plan_search(top_k: int, filtered_rows: Optional[int], total_rows: int) -> SearchPlan:
+    # filtered_rows is None without a document filter: only the tenant scope applies. Within its
+    # shard that passes every row (a tenant of its own) or some (a shared one); iterative scans
+    # cover both, falling back to exact when the shard holds too few of the tenant's rows.
+    if filtered_rows is None:
+        return SearchPlan("iterative" if settings.ANN_ITERATIVE_SCAN.lower() != "off" else "ann", top_k)
+    if filtered_rows <= settings.FILTER_EXACT_MAX_ROWS:
+        return SearchPlan("exact", top_k, rows=filtered_rows)
+    if settings.ANN_ITERATIVE_SCAN.lower() != "off":
+        return SearchPlan("iterative", top_k, rows=filtered_rows)
+    # expect top_k matches after reading top_k / selectivity candidates, with 2x headroom
+    selectivity = filtered_rows / total_rows if total_rows > filtered_rows else 1.0
+    factor = min(settings.FILTER_MAX_OVERFETCH, max(2, math.ceil(2 / selectivity)))
+    return SearchPlan("overfetch", top_k * factor, rows=filtered_rows)
+
+
+_MAX_EF_SEARCH = 1000  # pgvector's upper bound
+
+
+def filter_stats(db: Session, document_ids: list[str], tenant: str = DEFAULT_TENANT) -> tuple[int, int]:
+    # per-document chunk counts and the planner's row estimate: no scan of chunk_embeddings
+    filtered, total = db.execute(_FILTER_STATS_SQL, {"doc_ids": document_ids, "tenant": tenant}).one()
+    return int(filtered), int(total or 0)
+
 
-def search_similar_chunks(db: Session, query_emb: list[float], top_k: int, document_ids: Optional[list[str]] = None):
+def apply_search_settings(
+    db: Session,
+    probes: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    iterative: bool = False,
+    min_ef_search: int = 0,
+    defaults: Optional[dict] = None,
+) -> None:
+    # transaction-local ivfflat.probes / hnsw.ef_search (and iterative scan) for the search that follows.
+    # An HNSW scan returns at most ef_search rows, so it is raised to the rows the query reads.
+    if defaults is None:
+        defaults = search_defaults(db.connection())
+    gucs = search_gucs(defaults, probes, ef_search)
+    if "hnsw.ef_search" in gucs and int(gucs["hnsw.ef_search"]) < min_ef_search:
+        gucs["hnsw.ef_search"] = min(_MAX_EF_SEARCH, min_ef_search)
+    if iterative:
+        gucs["hnsw.iterative_scan"] = settings.ANN_ITERATIVE_SCAN
+        gucs["ivfflat.iterative_scan"] = settings.ANN_ITERATIVE_SCAN
+    if gucs:
+        db.execute(*set_gucs_stmt(gucs))
+
+
+def _prepare_search(
+    db: Session,
+    top_k: int,
+    document_ids: Optional[list[str]],
+    probes: Optional[int],
+    ef_search: Optional[int],
+    strategy: Optional[str],
+    mode: Optional[str],
+    has_text: bool,
+    tenant: str,
+) -> tuple[SearchPlan, str, dict]:
+    # picks mode and strategy, applies the session GUCs and returns the shared bind parameters
+    mode = (mode or settings.SEARCH_MODE).lower()
+    if mode != "vector" and not has_text:
+        mode = "vector"
     if document_ids:
-        filter_clause = "AND dc.document_id = ANY(:doc_ids)"
+        plan = plan_search(top_k, *filter_stats(db, document_ids, tenant))
     else:
-        filter_clause = ""
-    sql = text(f"""        SELECT dc.document_id::text, ce.chunk_id::text, dc.chunk_index, 1 - (ce.embedding <=> :qvec) AS similarity, dc.content
-        FROM chunk_embeddings ce
-        JOIN document_chunks dc ON dc.id = ce.chunk_id
-        WHERE 1=1 {filter_clause}
-        ORDER BY ce.embedding <=> :qvec
-        LIMIT :k
-    """ )
-    rows = db.execute(sql, {"qvec": query_emb, "k": top_k, "doc_ids": document_ids}).all()
+        plan = plan_search(top_k, None, 0)
+    if strategy:
+        plan = plan._replace(strategy=strategy)
+    # fused modes rank a deeper candidate list per leg; plain vector search needs exactly top_k
+    n = top_k if mode == "vector" else max(top_k, settings.HYBRID_CANDIDATES)
+    cand = n
+    if mode != "lexical":
+        # one lookup of the live index for both its storage and its search GUCs
+        info = live_index(db.connection())
+        if info:
+            plan = plan._replace(storage=info["storage"], dims=info["dims"])
+        cand = n * rerank_factor(plan.storage)
+        reads = plan.fetch * n // top_k if plan.strategy == "overfetch" else cand
+        apply_search_settings(
+            db, probes, ef_search, iterative=plan.strategy == "iterative", min_ef_search=reads,
+            defaults=info["search"] if info else {},
+        )
+    params = {
+        "k": top_k,
+        "n": n,
+        "cand": cand,
+        "fetch": plan.fetch * n // top_k,
+        "doc_ids": document_ids,
+        "tenant": tenant,
+        "fts_config": settings.FTS_CONFIG,
+        "rrf_k": settings.RRF_K,
+        "lex_cap": max(n, settings.LEXICAL_MAX_MATCHES),
+    }
+    return plan, mode, params
+
+
+def _may_fall_short(plan: SearchPlan, mode: str) -> bool:
+    # ANN over a filter (the tenant scope at least) can run out of candidates before top_k rows match
+    return mode != "lexical" and plan.strategy != "exact"
+
+
+# Tenants found to hold fewer than top_k rows: tenant -> (corpus stamp, rows). An ANN result that
+# short is complete, and re-running it exact on every query would double the work for small
+# tenants (and for rerank pools larger than the corpus). Any document change moves the stamp,
+# which drops the entry. Document filters need none of this: their row count is in the plan.
+_SMALL_TENANTS: OrderedDict[str, tuple[str, int]] = OrderedDict()
+_SMALL_TENANTS_MAX = 4096
+_small_tenants_lock = Lock()
+
+
+def _expected_rows(db: Session, plan: SearchPlan, top_k: int, tenant: str) -> tuple[int, str | None]:
+    # rows a complete search returns (top_k unless the scope is known to be smaller), and the
+    # tenant's corpus stamp when the exact fallback may learn its size
+    if plan.rows is not None:
+        return min(top_k, plan.rows), None
+    stamp = corpus_stamp(db, None, tenant)
+    if not stamp:  # no documents at all
+        return 0, None
+    with _small_tenants_lock:
+        known = _SMALL_TENANTS.get(tenant)
+    if known is not None and known[0] == stamp:
+        return min(top_k, known[1]), None
+    return top_k, stamp
+
+
+def _remember_small_tenant(tenant: str, stamp: str, rows: int) -> None:
+    # an exact search returning fewer than top_k rows has returned all of the tenant's rows
+    with _small_tenants_lock:
+        _SMALL_TENANTS[tenant] = (stamp, rows)
+        _SMALL_TENANTS.move_to_end(tenant)
+        while len(_SMALL_TENANTS) > _SMALL_TENANTS_MAX:
+            _SMALL_TENANTS.popitem(last=False)
+
+
+def search_similar_chunks(
+    db: Session,
+    query_emb: list[float],
+    top_k: int,
+    document_ids: Optional[list[str]] = None,
+    probes: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    strategy: Optional[str] = None,
+    mode: Optional[str] = None,
+    query_text: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT,
+):
+    plan, mode, params = _prepare_search(
+        db, top_k, document_ids, probes, ef_search, strategy, mode, bool(query_text), tenant
+    )
+    params.update(qvec=query_emb, qtext=query_text)
+    filtered = bool(document_ids)
+    rows = db.execute(text(search_sql(plan.strategy, mode, filtered, storage=plan.storage, dims=plan.dims)), params).all()
+    if _may_fall_short(plan, mode) and len(rows) < top_k:
+        expected, stamp = _expected_rows(db, plan, top_k, tenant)
+        if len(rows) < expected:
+            logger.debug("%s search returned %d/%d rows; falling back to exact", plan.strategy, len(rows), expected)
+            rows = db.execute(text(search_sql("exact", mode, filtered)), params).all()
+            if stamp and len(rows) < top_k:
+                _remember_small_tenant(tenant, stamp, len(rows))
     return rows
 
 
-def debug_search_chunks(db: Session, query: str, top_k: int = 5) -> SearchDebugResponse:
-    from app.rag.embeddings import embed_query
-    qv = embed_query(query)
-    rows = search_similar_chunks(db, qv, top_k)
+async def asearch_similar_chunks(
+    db: AsyncSession,
+    query_emb: list[float],
+    top_k: int,
+    document_ids: Optional[list[str]] = None,
+    probes: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    strategy: Optional[str] = None,
+    mode: Optional[str] = None,
+    query_text: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT,
+):
+    # the plan takes a couple of dependent round trips; run them on the greenlet-backed sync session
+    return await db.run_sync(
+        search_similar_chunks, query_emb, top_k, document_ids, probes, ef_search, strategy, mode, query_text, tenant
+    )
+
+
+def _vector_literal(vec: list[float]) -> str:
+    return "[" + ",".join(repr(float(x)) for x in vec) + "]"
+
+
+def search_similar_chunks_batch(
+    db: Session,
+    query_embs: list[list[float]],
+    query_texts: list[str],
+    top_k: int,
+    document_ids: Optional[list[str]] = None,
+    probes: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT,
+) -> list[list]:
+    # one result list per query, in input order; a single statement for the whole batch
+    if not query_embs:
+        return []
+    plan, mode, params = _prepare_search(
+        db, top_k, document_ids, probes, ef_search, None, mode, all(query_texts), tenant
+    )
+    filtered = bool(document_ids)
+    vectors = [_vector_literal(v) for v in query_embs]
+    results: list[list] = [[] for _ in query_embs]
+
+    def run(strategy: str, positions: list[int]) -> None:
+        params.update(qvecs=[vectors[i] for i in positions], qtexts=[query_texts[i] for i in positions])
+        for row in db.execute(text(search_batch_sql(strategy, mode, filtered, plan.storage, plan.dims)), params):
+            results[positions[row[0] - 1]].append(tuple(row[1:]))
+
+    run(plan.strategy, list(range(len(query_embs))))
+    if _may_fall_short(plan, mode) and any(len(rows) < top_k for rows in results):
+        expected, stamp = _expected_rows(db, plan, top_k, tenant)
+        short = [i for i, rows in enumerate(results) if len(rows) < expected]
+        if short:
+            for i in short:
+                results[i] = []
+            run("exact", short)
+            if stamp and all(len(results[i]) < top_k for i in short):
+                _remember_small_tenant(tenant, stamp, max(len(results[i]) for i in short))
+    return results
+
+
+async def asearch_similar_chunks_batch(
+    db: AsyncSession,
+    query_embs: list[list[float]],
+    query_texts: list[str],
+    top_k: int,
+    document_ids: Optional[list[str]] = None,
+    probes: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT,
+) -> list[list]:
+    return await db.run_sync(
+        search_similar_chunks_batch, query_embs, query_texts, top_k, document_ids, probes, ef_search, mode, tenant
+    )
+
+
+def _to_debug_response(rows) -> SearchDebugResponse:
     hits: List[SearchHit] = []
-    for doc_id, chunk_id, chunk_index, sim, content in rows:
-        hits.append(SearchHit(document_id=doc_id, chunk_id=chunk_id, chunk_index=chunk_index, similarity=float(sim), content=content[:500]))
+    for doc_id, chunk_id, chunk_index, sim, content, page in rows:
+        hits.append(
+            SearchHit(document_id=doc_id, chunk_id=chunk_id, chunk_index=chunk_index, similarity=float(sim), content=content[:500], page=page)
+        )
     return SearchDebugResponse(hits=hits)
+
+
+def debug_search_chunks(
+    db: Session, query: str, top_k: int = 5, probes: Optional[int] = None, ef_search: Optional[int] = None, mode: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT,
+) -> SearchDebugResponse:
+    from app.rag.embeddings import embed_query
+    qv = embed_query(query)
+    return _to_debug_response(
+        search_similar_chunks(db, qv, top_k, probes=probes, ef_search=ef_search, mode=mode, query_text=query, tenant=tenant)
+    )
+
+
+async def adebug_search_chunks(
+    db: AsyncSession, query: str, top_k: int = 5, probes: Optional[int] = None, ef_search: Optional[int] = None, mode: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT,
+) -> SearchDebugResponse:
+    from app.rag.embeddings import aembed_query
+    qv = await aembed_query(query)
+    rows = await asearch_similar_chunks(
+        db, qv, top_k, probes=probes, ef_search=ef_search, mode=mode, query_text=query, tenant=tenant
+    )
+    return _to_debug_response(rows)
@@ -0,0 +1,304 @@
+"""Per-stage timing for queries and ingest, the batched query_logs writer and slow-query sampling.
+
+A QueryTrace times the stages of one query, feeds the rag_stage_seconds histograms on exit and
+hands a row to the QueryLogWriter, whose background thread inserts rows in batches; a full queue
+drops rows rather than slow a request down. The SlowQuerySampler keeps recent slow queries and,
+when switched on at runtime, profiles a sample of queries with cProfile.
+"""
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from threading import Lock, Thread
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import queue
+import random
+import time
+
+from app.core.config import settings
+from app.core.metrics import QUERY_LOG_ROWS, RAG_QUERIES, RAG_STAGE_SECONDS, SLOW_QUERIES, Histogram
+from app.db.tenants import DEFAULT_TENANT
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class StageTimer:
+    # Accumulates seconds per stage (stages may repeat, e.g. one per batch, and run in threads);
+    # the histogram sees the totals once, in finish().
+    def __init__(self, histogram: Histogram, **labels: str):
+        self.histogram = histogram
+        self.labels = labels
+        self.t0 = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self._lock = Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def timed(self, name: str, fn: Callable[..., T]) -> Callable[..., T]:
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            with self.stage(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    def iterate(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        # charges the time spent producing each item (lazy reads, chunking) to `name`
+        it = iter(items)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add(name, time.perf_counter() - t0)
+                return
+            self.add(name, time.perf_counter() - t0)
+            yield item
+
+    def finish(self) -> float:
+        total = time.perf_counter() - self.t0
+        self.stages["total"] = total
+        for stage, seconds in self.stages.items():
+            self.histogram.observe(seconds, stage=stage, **self.labels)
+        return total
+
+    def ms(self) -> dict[str, float]:
+        return {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+
+
+class QueryTrace(StageTimer):
+    """Stages of one query. Used as a context manager: on exit the stages go to the histograms,
+    the query to query_logs (unless `query` is None, as for a whole batch) and to the sampler."""
+
+    def __init__(
+        self, route: str, query: Optional[str] = None, top_k: Optional[int] = None, tenant: str = DEFAULT_TENANT
+    ):
+        super().__init__(RAG_STAGE_SECONDS, route=route)
+        self.route = route
+        self.query = query
+        self.top_k = top_k
+        self.tenant = tenant
+        self.cache: Optional[str] = None
+        self._profile: Optional[cProfile.Profile] = None
+
+    def __enter__(self) -> "QueryTrace":
+        self._profile = get_slow_query_sampler().start_profile()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            status = "ok"
+        elif issubclass(exc_type, (GeneratorExit, asyncio.CancelledError)):
+            status = "cancelled"
+        else:
+            status = "error"
+        total = self.finish()
+        if self.query is not None:
+            log_query(self.route, self.query, self.top_k, self.cache, total, self.ms(), status, self.tenant)
+        get_slow_query_sampler().observe(self.route, self.query, total, self.ms(), self._profile, self.tenant)
+
+
+def log_query(
+    route: str,
+    query: str,
+    top_k: Optional[int],
+    cache: Optional[str],
+    seconds: float,
+    timings: dict,
+    status: str = "ok",
+    tenant: str = DEFAULT_TENANT,
+) -> None:
+    from app.rag.llm import chat_model_name
+
+    if status == "ok":
+        RAG_QUERIES.inc(route=route, cache=cache or "miss")
+    get_query_log_writer().submit({
+        "tenant_id": tenant,
+        "query": query,
+        "top_k": top_k or 0,
+        "latency_ms": int(seconds * 1000),
+        "model": chat_model_name(),
+        "route": route,
+        "cache": cache,
+        "status": status,
+        "timings": timings,
+    })
+
+
+class QueryLogWriter:
+    _STOP = object()
+
+    def __init__(self, max_queue: int, batch_size: int, flush_s: float):
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self._queue: queue.Queue = queue.Queue(max_queue)
+        self._thread: Optional[Thread] = None
+        self._start_lock = Lock()
+
+    def submit(self, row: dict) -> None:
+        if not settings.QUERY_LOG_ENABLED:
+            return
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            QUERY_LOG_ROWS.inc(outcome="dropped")
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="query-log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            row = self._queue.get()
+            if row is self._STOP:
+                return
+            batch = [row]
+            deadline = time.monotonic() + self.flush_s
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    row = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if row is self._STOP:
+                    stop = True
+                    break
+                batch.append(row)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, rows: list[dict]) -> None:
+        from app.db.base import SessionLocal
+        from app.db.repositories import write_query_logs
+
+        try:
+            with SessionLocal() as db:
+                write_query_logs(db, rows)
+            QUERY_LOG_ROWS.inc(len(rows), outcome="written")
+        except Exception:
+            logger.exception("Writing %d query_logs rows failed", len(rows))
+            QUERY_LOG_ROWS.inc(len(rows), outcome="failed")
+
+    def close(self, timeout: float = 5.0) -> None:
+        # flush what is queued; called on shutdown
+        if self._thread is not None:
+            try:
+                self._queue.put(self._STOP, timeout=timeout)
+            except queue.Full:
+                return
+            self._thread.join(timeout)
+            self._thread = None
+
+
+@lru_cache(maxsize=1)
+def get_query_log_writer() -> QueryLogWriter:
+    return QueryLogWriter(settings.QUERY_LOG_QUEUE, settings.QUERY_LOG_BATCH_SIZE, settings.QUERY_LOG_FLUSH_S)
+
+
+class SlowQuerySampler:
+    """Queries at or over `threshold_ms` (0 = off) are counted, and a `sample_rate` share of them is
+    logged and kept for /admin/slow-queries. With `profile` on, that share of all queries runs under
+    cProfile (one at a time; on the event loop that includes other requests in flight) and the
+    profile is kept only if the query turns out slow. Settable at runtime, per process."""
+
+    def __init__(self, threshold_ms: int, sample_rate: float, profile: bool, keep: int = 50):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.profile = profile
+        self.samples: deque = deque(maxlen=keep)
+        self._profiling = Lock()
+
+    def configure(
+        self, threshold_ms: Optional[int] = None, sample_rate: Optional[float] = None, profile: Optional[bool] = None
+    ) -> None:
+        if threshold_ms is not None:
+            self.threshold_ms = threshold_ms
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if profile is not None:
+            self.profile = profile
+
+    def state(self, tenant: Optional[str] = None) -> dict:
+        return {
+            "threshold_ms": self.threshold_ms,
+            "sample_rate": self.sample_rate,
+            "profile": self.profile,
+            "samples": [s for s in self.samples if tenant is None or s["tenant"] == tenant],
+        }
+
+    def start_profile(self) -> Optional[cProfile.Profile]:
+        if not self.profile or self.threshold_ms <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._profiling.acquire(blocking=False):
+            return None
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:  # another profiler is active in this process
+            self._profiling.release()
+            return None
+        return prof
+
+    def _stop_profile(self, prof: cProfile.Profile) -> str:
+        prof.disable()
+        self._profiling.release()
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(settings.SLOW_QUERY_PROFILE_LINES)
+        return out.getvalue()
+
+    def observe(
+        self,
+        route: str,
+        query: Optional[str],
+        seconds: float,
+        timings: dict,
+        prof: Optional[cProfile.Profile] = None,
+        tenant: str = DEFAULT_TENANT,
+    ) -> bool:
+        report = self._stop_profile(prof) if prof is not None else None
+        total_ms = seconds * 1000
+        if self.threshold_ms <= 0 or total_ms < self.threshold_ms:
+            return False
+        SLOW_QUERIES.inc(route=route)
+        # a profiled query was already sampled when it started
+        if prof is None and random.random() >= self.sample_rate:
+            return True
+        logger.warning("Slow query on %s (tenant %s): %.0f ms %s %r", route, tenant, total_ms, timings, (query or "")[:200])
+        self.samples.append({
+            "tenant": tenant,
+            "route": route,
+            "query": (query or "")[:500],
+            "latency_ms": round(total_ms, 1),
+            "timings": timings,
+            "at": time.time(),
+            "profile": report,
+        })
+        return True
+
+
+@lru_cache(maxsize=1)
+def get_slow_query_sampler() -> SlowQuerySampler:
+    return SlowQuerySampler(settings.SLOW_QUERY_MS, settings.SLOW_QUERY_SAMPLE_RATE, settings.SLOW_QUERY_PROFILE)
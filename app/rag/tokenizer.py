@@ -0,0 +1,65 @@
+from functools import lru_cache
+from typing import Protocol
+import logging
+import math
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Tokenizer(Protocol):
+    name: str
+
+    def count(self, text: str) -> int: ...
+
+    def count_many(self, texts: list[str]) -> list[int]: ...
+
+    def split(self, text: str, max_tokens: int) -> list[str]: ...
+
+
+class TiktokenTokenizer:
+    def __init__(self, encoding: str):
+        import tiktoken
+
+        self.name = encoding
+        self._enc = tiktoken.get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self._enc.encode_ordinary(text))
+
+    def count_many(self, texts: list[str]) -> list[int]:
+        return [len(ids) for ids in self._enc.encode_ordinary_batch(texts)]
+
+    def split(self, text: str, max_tokens: int) -> list[str]:
+        ids = self._enc.encode_ordinary(text)
+        return [self._enc.decode(ids[i:i + max_tokens]) for i in range(0, len(ids), max_tokens)]
+
+
+class CharTokenizer:
+    """Fallback when no BPE tokenizer is available: estimates ~4 characters per token."""
+
+    name = "chars"
+    chars_per_token = 4
+
+    def count(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def count_many(self, texts: list[str]) -> list[int]:
+        return [self.count(t) for t in texts]
+
+    def split(self, text: str, max_tokens: int) -> list[str]:
+        step = max_tokens * self.chars_per_token
+        return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer() -> Tokenizer:
+    if settings.CHUNK_TOKENIZER.lower() == "chars":
+        return CharTokenizer()
+    try:
+        return TiktokenTokenizer(settings.CHUNK_TOKENIZER)
+    except Exception:
+        # tiktoken missing, or its BPE file can't be fetched (offline)
+        logger.warning("Tokenizer %r unavailable, falling back to character estimate", settings.CHUNK_TOKENIZER, exc_info=True)
+        return CharTokenizer()
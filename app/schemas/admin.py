@@ -0,0 +1,53 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+
+
+class IndexRebuildRequest(BaseModel):
+    kind: Optional[str] = Field(None, pattern="^(hnsw|ivfflat)$")
+    storage: Optional[str] = Field(None, pattern="^(full|halfvec|binary|truncate)$")
+
+
+class IndexRebuildResponse(BaseModel):
+    status: str
+    kind: str
+    storage: str
+
+
+class IndexInfoResponse(BaseModel):
+    rows: int
+    index: Optional[Dict[str, Any]] = None
+
+
+class TenantMoveRequest(BaseModel):
+    shard: int = Field(..., ge=0, le=32767)
+
+
+class TenantMoveResponse(BaseModel):
+    status: str
+    tenant_id: str
+    shard: int
+
+
+class ShardsResponse(BaseModel):
+    partitioned: bool
+    shards: List[Dict[str, Any]] = []
+    tenants: List[Dict[str, Any]] = []
+
+
+class SlowQueryConfig(BaseModel):
+    threshold_ms: Optional[int] = Field(None, ge=0)  # 0 = off
+    sample_rate: Optional[float] = Field(None, ge=0, le=1)
+    profile: Optional[bool] = None
+
+
+class SlowQueryStateResponse(BaseModel):
+    threshold_ms: int
+    sample_rate: float
+    profile: bool
+    samples: List[Dict[str, Any]] = []
+
+
+class PoolStatsResponse(BaseModel):
+    db: Dict[str, Dict[str, int]]
+    http: Dict[str, Dict[str, int]]
+    broker: Dict[str, Any]
@@ -1,13 +1,32 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Annotated, List, Literal, Optional
 
 
-class ChatRequest(BaseModel):
-    query: str = Field(..., min_length=1)
+class ChatOptions(BaseModel):
     top_k: int = 6
     temperature: float = 0.0
     max_tokens: int = 400
     document_ids: Optional[List[str]] = None
+    # ANN recall/latency knobs; default to what the live index was built for
+    probes: Optional[int] = Field(None, ge=1, description="ivfflat.probes")
+    ef_search: Optional[int] = Field(None, ge=1, le=1000, description="hnsw.ef_search")
+    # None follows SEARCH_MODE
+    search_mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
+    # None follows RERANK_ENABLED / RERANK_CANDIDATES; top_k stays the number of chunks prompted
+    rerank: Optional[bool] = None
+    rerank_candidates: Optional[int] = Field(None, ge=1, le=200)
+
+
+class ChatRequest(ChatOptions):
+    query: str = Field(..., min_length=1)
+
+
+class BatchChatRequest(ChatOptions):
+    # options apply to every query of the batch
+    queries: List[Annotated[str, Field(min_length=1)]] = Field(..., min_length=1)
+
+    def item(self, index: int) -> ChatRequest:
+        return ChatRequest(query=self.queries[index], **self.model_dump(exclude={"queries"}))
 
 
 class Citation(BaseModel):
@@ -16,11 +35,31 @@ class Citation(BaseModel):
     chunk_index: int
     similarity: float
     snippet: str
+    page: Optional[int] = None  # first page of the chunk, for paged formats (PDF, DOCX with page breaks)
 
 
 class ChatResponse(BaseModel):
     answer: str
     citations: List[Citation]
+    cache: Optional[str] = None  # "exact" | "semantic" when served from the answer cache
+
+
+class BatchChatResult(BaseModel):
+    # one NDJSON line of /chat/batch; index points into BatchChatRequest.queries
+    index: int
+    query: str
+    answer: Optional[str] = None
+    citations: List[Citation] = []
+    cache: Optional[str] = None
+    error: Optional[str] = None
+
+
+class AnswerCacheStatsResponse(BaseModel):
+    entries: int
+    exact_hits: int
+    semantic_hits: int
+    misses: int
+    hit_rate: float
 
 
 class SearchHit(BaseModel):
@@ -29,7 +68,9 @@ class SearchHit(BaseModel):
     chunk_index: int
     similarity: float
     content: str
+    page: Optional[int] = None
 
 
 class SearchDebugResponse(BaseModel):
     hits: List[SearchHit]
+
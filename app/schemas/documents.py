@@ -9,3 +9,4 @@ class DocumentCreateResponse(BaseModel):
 class DocumentStatusResponse(BaseModel):
     document_id: str
     status: str
+    ingested_chunks: int | None = None
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+
+class EmbeddingCacheStatsResponse(BaseModel):
+    hits: int
+    misses: int
+    memory_hits: int
+    store_hits: int
+    hit_rate: float
+    texts_embedded: int
+    chars_saved: int
+    avg_embed_ms_per_text: float
+    est_saved_ms: float
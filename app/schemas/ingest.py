@@ -0,0 +1,25 @@
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+
+
+class IngestJobRequest(BaseModel):
+    # server-local files or directories, under BULK_INGEST_ALLOWED_ROOTS
+    paths: List[str] = Field(..., min_length=1)
+
+
+class IngestJobResponse(BaseModel):
+    job_id: str
+    status: str
+    total_documents: int
+
+
+class IngestJobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    source: str
+    total_documents: int
+    documents: Dict[str, int]  # by document status: queued | chunked | ready | failed
+    chunks_embedded: int
+    elapsed_s: float
+    docs_per_min: Optional[float] = None
+    error: Optional[str] = None
@@ -0,0 +1,62 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from app.core.config import settings
+from app.ingestion.bulk import extract_archive
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(settings, "BULK_ARCHIVE_MAX_MEMBERS", 3)
+    monkeypatch.setattr(settings, "BULK_ARCHIVE_MAX_BYTES", 1000)
+
+
+def _zip(path, members: dict[str, bytes]) -> str:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+def _tar(path, members: dict[str, bytes]) -> str:
+    with tarfile.open(path, "w:gz") as tf:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return str(path)
+
+
+@pytest.mark.parametrize("make", [_zip, _tar])
+def test_extract_within_limits(tmp_path, limits, make):
+    archive = make(tmp_path / "a", {"a.txt": b"x" * 400, "d/b.txt": b"y" * 400})
+    files = extract_archive(archive, str(tmp_path / "out"))
+    assert [f.rsplit("/", 2)[-2:] for f in files] == [["out", "a.txt"], ["d", "b.txt"]]
+
+
+@pytest.mark.parametrize("make", [_zip, _tar])
+def test_extract_rejects_too_many_members(tmp_path, limits, make):
+    archive = make(tmp_path / "a", {f"{i}.txt": b"x" for i in range(4)})
+    with pytest.raises(ValueError, match="members"):
+        extract_archive(archive, str(tmp_path / "out"))
+
+
+@pytest.mark.parametrize("make", [_zip, _tar])
+def test_extract_rejects_too_many_bytes(tmp_path, limits, make):
+    archive = make(tmp_path / "a", {"a.txt": b"\0" * 600, "b.txt": b"\0" * 600})
+    with pytest.raises(ValueError, match="bytes"):
+        extract_archive(archive, str(tmp_path / "out"))
+
+
+def test_extract_rejects_understated_zip_sizes(tmp_path, limits):
+    # a forged central directory claiming small sizes is a bad archive, not a disk full
+    archive = _zip(tmp_path / "a.zip", {"a.txt": b"\0" * 5000})
+    data = bytearray(open(archive, "rb").read())
+    cd = data.rindex(b"PK\x01\x02")
+    data[cd + 24:cd + 28] = (10).to_bytes(4, "little")  # uncompressed size
+    open(archive, "wb").write(bytes(data))
+    with pytest.raises(ValueError):
+        extract_archive(archive, str(tmp_path / "out"))
@@ -0,0 +1,33 @@
+from uuid import uuid4
+
+from app.ingestion.tasks import ChunkDiff
+from app.rag.chunker import Chunk
+from app.rag.embedding_cache import content_hash
+
+
+def test_chunk_diff_updates_every_changed_field():
+    same, moved, repaged, retokenized, gone = (uuid4() for _ in range(5))
+    existing = {
+        content_hash("a"): [(same, 0, 1, {"page": 1, "page_end": 1})],
+        content_hash("b"): [(moved, 5, 1, {"page": 1, "page_end": 1})],
+        content_hash("c"): [(repaged, 2, 1, {"page": 1, "page_end": 1})],
+        content_hash("d"): [(retokenized, 3, None, {"page": 2, "page_end": 2})],
+        content_hash("old"): [(gone, 4, 1, None)],
+    }
+    diff = ChunkDiff(existing, page_offsets=[0, 100])
+    batch = [
+        (0, Chunk("a", 1, 0, 1)),
+        (1, Chunk("b", 1, 10, 11)),
+        (2, Chunk("c", 1, 100, 101)),
+        (3, Chunk("d", 1, 150, 151)),
+        (4, Chunk("new", 1, 160, 163)),
+    ]
+    fresh, updated = diff.classify(batch)
+    assert [f[1] for f in fresh] == ["new"]
+    assert updated == [
+        (moved, 1, 1, {"page": 1, "page_end": 1}),
+        (repaged, 2, 1, {"page": 2, "page_end": 2}),
+        (retokenized, 3, 1, {"page": 2, "page_end": 2}),
+    ]
+    assert diff.kept == 4
+    assert diff.stale_ids() == [gone]
@@ -0,0 +1,26 @@
+from app.core.metrics import Counter, Histogram, gauge, render
+
+
+def test_label_values_are_escaped():
+    c = Counter("test_escape_total", "Escaping.", ("path",))
+    c.inc(path='C:\\tmp\\"a"\nb')
+    assert 'test_escape_total{path="C:\\\\tmp\\\\\\"a\\"\\nb"} 1' in c.render().splitlines()
+    assert gauge("test_gauge", "Gauge.", series=[({"k": 'x"y'}, 2.5)]).splitlines()[-1] == 'test_gauge{k="x\\"y"} 2.5'
+
+
+def test_histogram_exposition():
+    h = Histogram("test_seconds", "Durations.", ("stage",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 2.0):
+        h.observe(v, stage="embed")
+    assert h.render().splitlines() == [
+        "# HELP test_seconds Durations.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="embed",le="0.1"} 2',
+        'test_seconds_bucket{stage="embed",le="1"} 3',
+        'test_seconds_bucket{stage="embed",le="+Inf"} 4',
+        'test_seconds_sum{stage="embed"} 2.65',
+        'test_seconds_count{stage="embed"} 4',
+    ]
+    assert h.snapshot(stage="embed") == (4, 2.65)
+    text = render()
+    assert text.endswith("\n") and 'test_seconds_count{stage="embed"} 4' in text
@@ -0,0 +1,32 @@
+from app.ingestion.parsers import parse_markdown, parse_text
+
+
+def _markdown(tmp_path, body: str) -> str:
+    path = tmp_path / "doc.md"
+    path.write_text(body, encoding="utf-8")
+    return parse_markdown(str(path)).text
+
+
+def test_markdown_keeps_identifiers(tmp_path):
+    text = _markdown(tmp_path, "Got ERR_CONN_RESET for part_no_123_b and 2*3*4, but *this* and __that__ are emphasis.")
+    assert text == "Got ERR_CONN_RESET for part_no_123_b and 2*3*4, but this and that are emphasis."
+
+
+def test_markdown_strips_only_real_tags(tmp_path):
+    text = _markdown(tmp_path, 'if a<b and c>d then <b>bold</b><br/> <a href="x" class=y>link</a><!-- note -->')
+    assert text == "if a<b and c>d then bold link"
+
+
+def test_markdown_keeps_paragraphs(tmp_path):
+    text = _markdown(tmp_path, "# Title\n\nFirst paragraph.\n\n- one\n  - two\n\n---\n\n> quoted\n\nLast.")
+    assert text == "Title\n\nFirst paragraph.\n\none\ntwo\n\n\n\nquoted\n\nLast."
+
+
+def test_text_decodes_from_mapping(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_bytes("naïve café".encode())
+    assert parse_text(str(path)).text == "naïve café"
+    path.write_bytes(b"")
+    assert parse_text(str(path)).text == ""
+    path.write_bytes(b"\xff\xfe\x00")
+    assert parse_text(str(path)).text == ""
@@ -0,0 +1,32 @@
+from app.core.config import settings
+from app.core.metrics import QUERY_LOG_ROWS
+from app.rag.telemetry import QueryLogWriter
+
+
+def _dropped() -> float:
+    return QUERY_LOG_ROWS._values.get(("dropped",), 0)
+
+
+def test_full_queue_drops_rows(monkeypatch):
+    monkeypatch.setattr(settings, "QUERY_LOG_ENABLED", True)
+    writer = QueryLogWriter(max_queue=2, batch_size=10, flush_s=1.0)
+    monkeypatch.setattr(writer, "_start", lambda: None)  # no consumer: the queue stays full
+    before = _dropped()
+    for i in range(5):
+        writer.submit({"i": i})
+    assert writer.pending() == 2
+    assert _dropped() - before == 3
+
+
+def test_close_flushes_queued_rows(monkeypatch):
+    monkeypatch.setattr(settings, "QUERY_LOG_ENABLED", True)
+    writer = QueryLogWriter(max_queue=100, batch_size=100, flush_s=60.0)
+    batches = []
+    monkeypatch.setattr(writer, "_write", batches.append)
+    rows = [{"i": i} for i in range(3)]
+    for row in rows:
+        writer.submit(row)
+    writer.close(timeout=5.0)
+    # well before flush_s: the stop marker ends the batch and the thread
+    assert batches == [rows]
+    assert writer.pending() == 0 and writer._thread is None